@@ -0,0 +1,118 @@
+"""
+Benchmarks for the FastAPI client's token handling.
+
+    python bench_fastapi.py [--iterations N] [--output results.json]
+"""
+
+import argparse
+import asyncio
+
+import harness
+import tokens
+
+harness.load_client("fast-api")
+
+import jwt  # noqa: E402
+
+import main  # noqa: E402
+from token_parser import parse_combined  # noqa: E402
+
+
+def secret_hash_per_login(username):
+    # What `login_for_access_token` used to do, keying the HMAC on every login
+    import hmac
+    import hashlib
+    import base64
+
+    message = bytes(username + main.config['COGNITO_CLIENT_ID'], 'utf-8')
+    key = bytes(main.config['COGNITO_CLIENT_SECRET'], 'utf-8')
+    return base64.b64encode(hmac.new(key, message, digestmod=hashlib.sha256).digest()).decode()
+
+
+def verify_tokens_pyjwt(combined_token):
+    # What `authenticate` used to do on a cache miss, PyJWT decoding each token from scratch
+    access_token, id_token = combined_token.split(main.TOKEN_DELIMITER)
+    claims = {}
+    for token, token_use in ((access_token, "access"), (id_token, "id")):
+        key = main.jwks.get(jwt.get_unverified_header(token).get("kid"))
+        claims[token_use] = jwt.decode(
+            token,
+            key,
+            algorithms=["RS256"],
+            issuer=main.issuer,
+            audience=main.config['COGNITO_CLIENT_ID'] if token_use == "id" else None,
+            options={"require": ["exp", "iss", "token_use"], "verify_aud": token_use == "id"},
+        )
+    return claims
+
+
+def run(iterations):
+    main.jwks.load(tokens.jwks())
+
+    auth_response = tokens.cognito_auth_response()
+    combined_token = main.Token.from_cognito(auth_response).access_token
+    _, claims = main.authenticate(combined_token)
+
+    def get_current_user_cached():
+        harness.run_sync(main.get_current_user(combined_token))
+
+    # A batch of distinct tokens, as a gateway would introspect them
+    batch = [main.Token.from_cognito(tokens.cognito_auth_response()).access_token for _ in range(100)]
+    loop = asyncio.new_event_loop()
+
+    def introspect_batch_uncached():
+        main.claims_cache.clear()
+        loop.run_until_complete(main.introspect_tokens(main.IntrospectionRequest(tokens=batch)))
+
+    def get_current_user_batch_uncached():
+        main.claims_cache.clear()
+        for token in batch:
+            harness.run_sync(main.get_current_user(token))
+
+    def verify_tokens():
+        main.verify_tokens(*parse_combined(combined_token, main.TOKEN_DELIMITER))
+
+    # Too long to be a token, it should be turned away before it's even hashed
+    oversized_token = "A" * 64 * 1024
+
+    def authenticate_oversized():
+        try:
+            main.authenticate(oversized_token)
+        except jwt.DecodeError:
+            pass
+
+    def get_current_user_uncached():
+        main.claims_cache.clear()
+        harness.run_sync(main.get_current_user(combined_token))
+
+    return {
+        "fastapi.get_current_user[cached]": harness.bench(get_current_user_cached, iterations),
+        "fastapi.get_current_user[uncached]": harness.bench(get_current_user_uncached, iterations),
+        # Each of these checks 100 tokens, so they're run fewer times
+        "fastapi.introspect[100 uncached]": harness.bench(introspect_batch_uncached, iterations // 50, warmup=5),
+        "fastapi.get_current_user[100 uncached]": harness.bench(
+            get_current_user_batch_uncached, iterations // 50, warmup=5,
+        ),
+        "fastapi.verify_tokens": harness.bench(verify_tokens, iterations),
+        "fastapi.verify_tokens[pyjwt]": harness.bench(lambda: verify_tokens_pyjwt(combined_token), iterations),
+        "fastapi.authenticate[oversized]": harness.bench(authenticate_oversized, iterations),
+        "fastapi.revocations.is_revoked": harness.bench(
+            lambda: main.revocations.is_revoked(claims["access"]), iterations,
+        ),
+        "fastapi.Token.from_cognito": harness.bench(lambda: main.Token.from_cognito(auth_response), iterations),
+        "fastapi.secret_hash": harness.bench(
+            lambda: main.secret_hash("user@example.com", main.config['COGNITO_CLIENT_ID']), iterations,
+        ),
+        "fastapi.secret_hash[per-login]": harness.bench(
+            lambda: secret_hash_per_login("user@example.com"), iterations,
+        ),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    harness.report(run(args.iterations), args.output)
@@ -0,0 +1,52 @@
+"""
+Benchmarks for the Flask client's token handling.
+
+    python bench_flask.py [--iterations N] [--output results.json]
+"""
+
+import argparse
+import time
+
+import jwt
+
+import harness
+import tokens
+
+harness.load_client("python-flask")
+
+import auth_handlers  # noqa: E402
+import hello  # noqa: E402
+
+
+def token_is_valid_pyjwt(token):
+    # What `token_is_valid` used to do, PyJWT decoding the whole token to read `exp`
+    return jwt.decode(token, options={"verify_signature": False}).get("exp") >= time.time()
+
+
+def run(iterations):
+    id_token = tokens.mint("id")
+
+    client = hello.app.test_client()
+    with client.session_transaction() as session:
+        session["id_token"] = id_token
+        session["access_token"] = tokens.mint("access")
+        session["refresh_token"] = "benchmark-refresh-token"
+
+    def private():
+        response = client.get("/private")
+        assert response.status_code == 200
+
+    return {
+        "flask.token_is_valid": harness.bench(lambda: auth_handlers.token_is_valid(id_token), iterations),
+        "flask.token_is_valid[pyjwt]": harness.bench(lambda: token_is_valid_pyjwt(id_token), iterations),
+        "flask.private": harness.bench(private, iterations),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    harness.report(run(args.iterations), args.output)
@@ -0,0 +1,76 @@
+"""
+Timing, and loading the clients outside of their own directories.
+"""
+
+import json
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import tokens  # noqa: E402 - needs nothing from the clients
+
+
+def load_client(name):
+    """Put a client (e.g. "fast-api") on the path, configured for the benchmark keys.
+
+    Both clients have a module called `config`, so only load one per process.
+    """
+    os.environ.setdefault("COGNITO_CLIENT_ID", tokens.CLIENT_ID)
+    os.environ.setdefault("COGNITO_CLIENT_SECRET", tokens.CLIENT_SECRET)
+    os.environ.setdefault("COGNITO_USER_POOL_ID", tokens.USER_POOL_ID)
+    os.environ.setdefault("REDIRECT_URI", "http://localhost:3000/callbacks/cognito/login")
+    os.environ.setdefault("HOSTEDUIPATH", "http://127.0.0.1:9")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+    sys.path.insert(0, os.path.join(REPO_ROOT, "clients", name))
+
+
+def run_sync(coro):
+    """Run a coroutine which never actually suspends, without an event loop."""
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError("The coroutine suspended, it needs a real event loop")
+
+
+def bench(fn, iterations=2000, warmup=200):
+    """Call `fn` repeatedly, returning its throughput and latency percentiles."""
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    clock = time.perf_counter_ns
+    for _ in range(iterations):
+        start = clock()
+        fn()
+        timings.append(clock() - start)
+
+    timings.sort()
+
+    def percentile(p):
+        return timings[min(len(timings) - 1, int(len(timings) * p / 100))] / 1000
+
+    return {
+        "ops_per_sec": round(len(timings) / (sum(timings) / 1e9), 1),
+        "p50_us": round(percentile(50), 2),
+        "p90_us": round(percentile(90), 2),
+        "p99_us": round(percentile(99), 2),
+    }
+
+
+def report(results, output=None):
+    """Print the results as a table, and write them as JSON to `output` if given."""
+    for name, result in results.items():
+        print(
+            f"{name:48} {result['ops_per_sec']:>12,.0f} ops/s"
+            f"   p50 {result['p50_us']:>9.1f}us   p90 {result['p90_us']:>9.1f}us   p99 {result['p99_us']:>9.1f}us"
+        )
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
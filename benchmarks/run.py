@@ -0,0 +1,72 @@
+"""
+Run every benchmark and compare the results with the baseline.
+
+    python run.py                    # fail if anything is more than 25% slower than the baseline
+    python run.py --tolerance 0.1    # ... or 10% slower
+    python run.py --update-baseline  # record these results as the new baseline
+
+Each benchmark file runs in its own process, as the clients can't share one.
+The baseline is only meaningful on the machine it was recorded on, so record
+one on your CI runner (or laptop) before comparing against it.
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "baseline.json")
+
+
+def run_all(iterations):
+    results = {}
+    for path in sorted(glob.glob(os.path.join(HERE, "bench_*.py"))):
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            subprocess.run(
+                [sys.executable, path, "--iterations", str(iterations), "--output", output.name],
+                cwd=HERE,
+                check=True,
+            )
+            results.update(json.load(output))
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """The benchmarks whose throughput has dropped more than `tolerance` below the baseline."""
+    slower = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["ops_per_sec"] / baseline[name]["ops_per_sec"]
+        if ratio < 1 - tolerance:
+            slower[name] = ratio
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    results = run_all(args.iterations)
+
+    if args.update_baseline:
+        with open(BASELINE, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {BASELINE}")
+        sys.exit(0)
+
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+
+    slower = regressions(results, baseline, args.tolerance)
+    for name, ratio in slower.items():
+        print(f"REGRESSION {name}: {ratio:.0%} of the baseline throughput")
+    sys.exit(1 if slower else 0)
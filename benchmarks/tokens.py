@@ -0,0 +1,61 @@
+"""
+Locally generated signing keys and Cognito-shaped tokens for the benchmarks.
+
+Nothing here talks to AWS - the tokens are signed with an RSA key we generate
+on the fly, and the clients are pointed at its public half.
+"""
+
+import json
+import time
+import uuid
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+USER_POOL_ID = "eu-west-1_Benchmark"
+ISSUER = f"https://cognito-idp.eu-west-1.amazonaws.com/{USER_POOL_ID}"
+CLIENT_ID = "benchmarkclientid"
+CLIENT_SECRET = "benchmarkclientsecret"
+KID = "benchmark-key"
+
+_private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def jwks():
+    """The JWKS document for the benchmark signing key."""
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(_private_key.public_key()))
+    jwk.update(kid=KID, alg="RS256", use="sig")
+    return {"keys": [jwk]}
+
+
+def mint(token_use, sub="benchmark-user", email="user@example.com", lifetime=3600):
+    """An access or ID token, shaped like the ones Cognito issues."""
+    now = int(time.time())
+    claims = {
+        "sub": sub,
+        "iss": ISSUER,
+        "token_use": token_use,
+        "auth_time": now,
+        "iat": now,
+        "exp": now + lifetime,
+        "jti": str(uuid.uuid4()),
+    }
+    if token_use == "id":
+        claims.update(aud=CLIENT_ID, email=email, email_verified=True)
+    else:
+        claims.update(client_id=CLIENT_ID, scope="aws.cognito.signin.user.admin", username=sub)
+
+    return jwt.encode(claims, _private_key, algorithm="RS256", headers={"kid": KID})
+
+
+def cognito_auth_response(lifetime=3600):
+    """A response from `initiate_auth`, as `Token.from_cognito` expects it."""
+    return {
+        "AuthenticationResult": {
+            "AccessToken": mint("access", lifetime=lifetime),
+            "IdToken": mint("id", lifetime=lifetime),
+            "RefreshToken": str(uuid.uuid4()),
+            "TokenType": "Bearer",
+            "ExpiresIn": lifetime,
+        }
+    }
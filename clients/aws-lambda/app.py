@@ -2,6 +2,7 @@
 import os
 
 import aws_cdk as cdk
+from aws_cdk.aws_lambda import Architecture
 
 from aws_lambda.aws_lambda_stack import AwsLambdaStack
 
@@ -10,6 +11,12 @@ app = cdk.App()
 AwsLambdaStack(app, "AwsLambdaStack",
     user_pool_id=os.environ['USER_POOL_ID'],
     user_pool_client_id=os.environ['USER_POOL_CLIENT_ID'],
+    use_lambda_authorizer=os.environ.get('USE_LAMBDA_AUTHORIZER') == 'true',
+    memory_size=int(os.environ.get('LAMBDA_MEMORY_SIZE', 256)),
+    architecture=Architecture.X86_64 if os.environ.get('LAMBDA_ARCHITECTURE') == 'x86_64' else Architecture.ARM_64,
+    snap_start=os.environ.get('LAMBDA_SNAP_START') == 'true',
+    provisioned_concurrency=int(os.environ.get('LAMBDA_PROVISIONED_CONCURRENCY', 0)),
+    shared_layer=os.environ.get('LAMBDA_SHARED_LAYER') == 'true',
     env=cdk.Environment(account=os.getenv('CDK_DEFAULT_ACCOUNT'), region=os.getenv('CDK_DEFAULT_REGION')),
 )
 
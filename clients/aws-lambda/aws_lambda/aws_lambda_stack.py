@@ -5,16 +5,51 @@ from aws_cdk import (
     aws_apigatewayv2_integrations,
     aws_apigatewayv2_authorizers,
     Arn,
+    BundlingOptions,
     CfnOutput,
+    Duration,
     Stack,
 )
 from constructs import Construct
 
+# The platform to ask pip for, so we bundle wheels which match the functions' architecture
+PIP_PLATFORMS = {
+    "arm64": "manylinux2014_aarch64",
+    "x86_64": "manylinux2014_x86_64",
+}
+
 class AwsLambdaStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, user_pool_id: str, user_pool_client_id: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, user_pool_id: str, user_pool_client_id: str,
+                 use_lambda_authorizer: bool = False,
+                 authorizer_cache_ttl: Duration = Duration.minutes(5),
+                 memory_size: int = 256,
+                 architecture: aws_lambda.Architecture = aws_lambda.Architecture.ARM_64,
+                 snap_start: bool = False,
+                 provisioned_concurrency: int = 0,
+                 shared_layer: bool = False,
+                 **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        if snap_start and provisioned_concurrency:
+            raise ValueError("Lambda doesn't support SnapStart and provisioned concurrency together")
+
+        self.memory_size = memory_size
+        self.architecture = architecture
+        self.snap_start = snap_start
+        self.provisioned_concurrency = provisioned_concurrency
+
+        # Install the dependencies once, into a layer the functions which need
+        # them share, rather than into each function's own package
+        self.layer = None
+        if shared_layer:
+            self.layer = aws_lambda.LayerVersion(
+                self, "SharedLayer",
+                code=aws_lambda.Code.from_asset("lambdas", bundling=self._pip_install("/asset-output/python")),
+                compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_12],
+                compatible_architectures=[architecture],
+            )
+
         # Import the userpool from the already deployed stack
         user_pool_arn = Arn.format(
             stack=self,
@@ -32,24 +67,40 @@ class AwsLambdaStack(Stack):
             self, "UserPoolClient", user_pool_client_id,
         )
 
-        # Create an authorizer for the private route
-        # https://docs.aws.amazon.com/apigateway/latest/developerguide/apigateway-integrate-with-cognito.html
-        authorizer = aws_apigatewayv2_authorizers.HttpUserPoolAuthorizer(
-            "Authorizer", user_pool,
-            user_pool_clients=[user_pool_client],  # If unspecified, a new client will be created
-        )
+        if use_lambda_authorizer:
+            # Our own authorizer, which verifies the JWTs in a Lambda function.
+            # It keeps the signing keys and verified tokens in memory between
+            # invocations, and API Gateway caches its answer for each
+            # Authorization header for authorizer_cache_ttl, so repeat requests
+            # with the same token don't invoke it at all.
+            authorizer_fn = self._function(
+                "AuthorizerFunction", "authorizer.handler",
+                needs_dependencies=True,
+                environment={
+                    "USER_POOL_ID": user_pool_id,
+                    "USER_POOL_CLIENT_ID": user_pool_client_id,
+                },
+            )
+            authorizer = aws_apigatewayv2_authorizers.HttpLambdaAuthorizer(
+                "Authorizer", authorizer_fn,
+                response_types=[aws_apigatewayv2_authorizers.HttpLambdaResponseType.SIMPLE],
+                identity_source=["$request.header.Authorization"],
+                results_cache_ttl=authorizer_cache_ttl,
+            )
+        else:
+            # Create an authorizer for the private route
+            # https://docs.aws.amazon.com/apigateway/latest/developerguide/apigateway-integrate-with-cognito.html
+            authorizer = aws_apigatewayv2_authorizers.HttpUserPoolAuthorizer(
+                "Authorizer", user_pool,
+                user_pool_clients=[user_pool_client],  # If unspecified, a new client will be created
+            )
 
         # Create an HTTP API
         api = aws_apigatewayv2.HttpApi(self, "HttpApi")
         CfnOutput(self, "ApiUrl", value=api.url)
 
         # Create a lambda function to manage the Private route
-        private_fn = aws_lambda.Function(
-            self, "PrivateFunction",
-            handler="main.private_handler",
-            runtime=aws_lambda.Runtime.PYTHON_3_12,
-            code=aws_lambda.Code.from_asset("lambdas"),
-        )
+        private_fn = self._function("PrivateFunction", "main.private_handler")
 
         api.add_routes(
             path="/private",
@@ -61,12 +112,7 @@ class AwsLambdaStack(Stack):
         )
 
         # Create a lambda function to manage the Public route
-        public_fn = aws_lambda.Function(
-            self, "PublicFunction",
-            handler="main.public_handler",
-            runtime=aws_lambda.Runtime.PYTHON_3_12,
-            code=aws_lambda.Code.from_asset("lambdas"),
-        )
+        public_fn = self._function("PublicFunction", "main.public_handler")
 
         api.add_routes(
             path="/public",
@@ -75,3 +121,53 @@ class AwsLambdaStack(Stack):
                 "PublicFnIntegration", public_fn
             ),
         )
+
+    def _pip_install(self, target, copy_source=False):
+        """Bundling which pip installs lambdas/requirements.txt into `target`."""
+        command = (
+            f"pip install -r requirements.txt -t {target} --only-binary=:all: "
+            f"--platform {PIP_PLATFORMS[self.architecture.name]} --python-version 3.12"
+        )
+        if copy_source:
+            command += " && cp -au . /asset-output"
+        return BundlingOptions(
+            image=aws_lambda.Runtime.PYTHON_3_12.bundling_image,
+            command=["bash", "-c", command],
+        )
+
+    def _function(self, construct_id, handler, needs_dependencies=False, environment=None):
+        """A function from the lambdas directory, tuned as configured for the stack.
+
+        Only functions which `needs_dependencies` get them, from the shared layer
+        or bundled in - extracting a layer adds to every cold start.
+
+        With SnapStart or provisioned concurrency, this returns an alias of its
+        latest version - those only apply to published versions.
+        """
+        if needs_dependencies and self.layer is None:
+            code = aws_lambda.Code.from_asset("lambdas", bundling=self._pip_install("/asset-output", copy_source=True))
+        else:
+            code = aws_lambda.Code.from_asset("lambdas")
+
+        fn = aws_lambda.Function(
+            self, construct_id,
+            handler=handler,
+            runtime=aws_lambda.Runtime.PYTHON_3_12,
+            code=code,
+            memory_size=self.memory_size,
+            architecture=self.architecture,
+            layers=[self.layer] if needs_dependencies and self.layer else None,
+            environment=environment,
+        )
+
+        if not (self.snap_start or self.provisioned_concurrency):
+            return fn
+
+        if self.snap_start:
+            # Restore new containers from a snapshot taken after initialization
+            fn.node.default_child.add_property_override("SnapStart", {"ApplyOn": "PublishedVersions"})
+
+        return fn.add_alias(
+            "live",
+            provisioned_concurrent_executions=self.provisioned_concurrency or None,
+        )
@@ -0,0 +1,197 @@
+"""
+A Lambda authorizer for the HTTP API, which verifies Cognito JWTs itself.
+
+It's an alternative to the `HttpUserPoolAuthorizer`, for when you want control
+over which claims are checked. Everything expensive is kept in module scope,
+so it is only done once per warm container:
+
+* the user pool's signing keys (the JWKS), fetched on the first invocation and
+  re-fetched - at most once a minute - when a token is signed with a key we
+  don't know.
+* the result of verifying each token, until the token expires.
+
+API Gateway also caches our answer for each Authorization header (see the
+stack), so repeat requests with the same token usually don't reach us at all.
+
+Each invocation logs one line of metrics in CloudWatch's Embedded Metric
+Format, which CloudWatch turns into metrics without any API calls from us.
+See https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+"""
+
+import hashlib
+import json
+import os
+import time
+import urllib.request
+
+import jwt
+
+USER_POOL_ID = os.environ.get("USER_POOL_ID", "")
+CLIENT_ID = os.environ.get("USER_POOL_CLIENT_ID", "")
+REGION = os.environ.get("AWS_REGION", USER_POOL_ID.split("_", 1)[0])
+ISSUER = os.environ.get("ISSUER", f"https://cognito-idp.{REGION}.amazonaws.com/{USER_POOL_ID}")
+
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "CognitoPlayground")
+FUNCTION_NAME = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "authorizer")
+
+JWKS_MIN_REFRESH_INTERVAL = 60
+VERIFIED_CACHE_MAX_ENTRIES = 10_000
+
+_keys = {}  # kid -> public key
+_last_jwks_fetch = 0.0
+_verified = {}  # token digest -> (expires_at, context)
+_cold_start = True
+_metrics = {}  # name -> (value, unit), for this invocation
+
+
+def put_metric(name, value, unit="Count"):
+    _metrics[name] = (value, unit)
+
+
+def emit_metrics():
+    """Log this invocation's metrics, in the Embedded Metric Format."""
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["FunctionName"]],
+                "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in _metrics.items()],
+            }],
+        },
+        "FunctionName": FUNCTION_NAME,
+    }
+    record.update((name, value) for name, (value, _) in _metrics.items())
+    print(json.dumps(record))
+    _metrics.clear()
+
+
+def load_jwks(jwks):
+    global _keys
+    _keys = {
+        jwk["kid"]: jwt.PyJWK(jwk, algorithm="RS256").key
+        for jwk in jwks.get("keys", [])
+        if jwk.get("kty") == "RSA" and "kid" in jwk
+    }
+
+
+def fetch_jwks():
+    with urllib.request.urlopen(f"{ISSUER}/.well-known/jwks.json", timeout=5) as response:
+        return json.load(response)
+
+
+def signing_key(kid):
+    """The public key for `kid`, fetching the JWKS if we haven't seen it."""
+    global _last_jwks_fetch
+
+    key = _keys.get(kid)
+    if key is None and time.time() - _last_jwks_fetch >= JWKS_MIN_REFRESH_INTERVAL:
+        _last_jwks_fetch = time.time()
+        start = time.perf_counter()
+        try:
+            load_jwks(fetch_jwks())
+            put_metric("JwksFetches", 1)
+        except Exception as e:
+            # Keep the keys we have, and deny this token
+            print(f"Failed to fetch the JWKS: {e}")
+            put_metric("JwksFetchFailures", 1)
+        put_metric("JwksFetchDuration", (time.perf_counter() - start) * 1000, "Milliseconds")
+        key = _keys.get(kid)
+    return key
+
+
+def verify(token):
+    """Return the claims of a Cognito access or ID token, or raise a `jwt.InvalidTokenError`."""
+    key = signing_key(jwt.get_unverified_header(token).get("kid"))
+    if key is None:
+        raise jwt.InvalidTokenError("Unknown signing key")
+
+    claims = jwt.decode(
+        token,
+        key,
+        algorithms=["RS256"],
+        issuer=ISSUER,
+        options={"require": ["exp", "iss", "token_use"], "verify_aud": False},
+    )
+
+    # ID tokens name the client in `aud`, access tokens in `client_id`
+    if claims["token_use"] == "id":
+        client_id = claims.get("aud")
+    elif claims["token_use"] == "access":
+        client_id = claims.get("client_id")
+    else:
+        raise jwt.InvalidTokenError("Unexpected token_use")
+
+    if client_id != CLIENT_ID:
+        raise jwt.InvalidTokenError("Token was issued to a different client")
+
+    return claims
+
+
+def authorize(token):
+    """Return the context to pass to the route for a valid token, or None."""
+    digest = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+
+    cached = _verified.get(digest)
+    if cached is not None and cached[0] > now:
+        put_metric("VerifiedCacheHits", 1)
+        return cached[1]
+    put_metric("VerifiedCacheHits", 0)
+
+    start = time.perf_counter()
+    try:
+        claims = verify(token)
+    except jwt.InvalidTokenError:
+        return None
+    finally:
+        put_metric("VerifyDuration", (time.perf_counter() - start) * 1000, "Milliseconds")
+
+    context = {
+        "sub": claims["sub"],
+        "username": claims.get("username") or claims.get("cognito:username", ""),
+        "token_use": claims["token_use"],
+    }
+
+    if len(_verified) >= VERIFIED_CACHE_MAX_ENTRIES:
+        # Drop the expired entries, and if that isn't enough the oldest ones
+        for expired in [d for d, (expires_at, _) in _verified.items() if expires_at <= now]:
+            del _verified[expired]
+        while len(_verified) >= VERIFIED_CACHE_MAX_ENTRIES:
+            del _verified[next(iter(_verified))]
+    _verified[digest] = (claims["exp"], context)
+
+    return context
+
+
+def handler(event, context):
+    """An HTTP API REQUEST authorizer, using the simple response format."""
+    global _cold_start
+
+    start = time.perf_counter()
+    response = _authorize_request(event)
+
+    put_metric("Authorized", int(response["isAuthorized"]))
+    put_metric("ColdStart", int(_cold_start))
+    put_metric("Duration", (time.perf_counter() - start) * 1000, "Milliseconds")
+    emit_metrics()
+    _cold_start = False
+
+    return response
+
+
+def _authorize_request(event):
+    authorization = (event.get("headers") or {}).get("authorization", "")
+    # Accept "Bearer <token>", or the bare token like the JWT authorizer does
+    scheme, _, token = authorization.partition(" ")
+    if not token:
+        token = scheme
+    elif scheme.lower() != "bearer":
+        return {"isAuthorized": False}
+    if not token:
+        return {"isAuthorized": False}
+
+    claims_context = authorize(token)
+    if claims_context is None:
+        return {"isAuthorized": False}
+    return {"isAuthorized": True, "context": claims_context}
@@ -1,11 +1,11 @@
 import json
+import os
+import time
 
-def private_handler(event, context):
-    return _json_response({"message": "Hello, Authorized World!"})
-
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "CognitoPlayground")
+FUNCTION_NAME = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "main")
 
-def public_handler(event, context):
-    return _json_response({"message": "Hello, World!"})
+_cold_start = True
 
 def _json_response(body):
     return {
@@ -15,3 +15,41 @@ def _json_response(body):
         },
         "body": json.dumps(body)
     }
+
+# These responses never change, so build and serialize them once, while the
+# container initializes, rather than on every invocation.
+PRIVATE_RESPONSE = _json_response({"message": "Hello, Authorized World!"})
+PUBLIC_RESPONSE = _json_response({"message": "Hello, World!"})
+
+
+def _emit_cold_start():
+    """Log a ColdStart metric, in CloudWatch's Embedded Metric Format, on a container's first invocation.
+
+    Warm invocations log nothing, so they stay as cheap as they can be.
+    """
+    global _cold_start
+    if not _cold_start:
+        return
+    _cold_start = False
+    print(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["FunctionName"]],
+                "Metrics": [{"Name": "ColdStart", "Unit": "Count"}],
+            }],
+        },
+        "FunctionName": FUNCTION_NAME,
+        "ColdStart": 1,
+    }))
+
+
+def private_handler(event, context):
+    _emit_cold_start()
+    return PRIVATE_RESPONSE
+
+
+def public_handler(event, context):
+    _emit_cold_start()
+    return PUBLIC_RESPONSE
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Measure how long each Lambda handler takes to import, and to run.
+
+    python measure_cold_start.py [--runs 5] [--invocations 1000] [--output results.json]
+
+Every run starts a fresh Python process, like a cold Lambda container, and
+times importing the handler's module (the init phase), its first invocation,
+and then warm invocations. This runs locally, so the absolute numbers won't
+match Lambda's - compare them between changes to spot cold start regressions.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HANDLERS = {
+    "main.public_handler": {},
+    "main.private_handler": {},
+    # Without an Authorization header, so this doesn't need any keys or network
+    "authorizer.handler": {"headers": {}},
+}
+
+# Runs in the fresh process, with the lambdas directory as its working directory
+MEASURE = """
+import importlib, json, sys, time
+
+module_name, handler_name = sys.argv[1].rsplit(".", 1)
+event = json.loads(sys.argv[2])
+invocations = int(sys.argv[3])
+
+start = time.perf_counter()
+handler = getattr(importlib.import_module(module_name), handler_name)
+init = time.perf_counter() - start
+
+start = time.perf_counter()
+handler(event, None)
+first = time.perf_counter() - start
+
+timings = []
+for _ in range(invocations):
+    start = time.perf_counter()
+    handler(event, None)
+    timings.append(time.perf_counter() - start)
+timings.sort()
+
+print(json.dumps({
+    "init_ms": init * 1000,
+    "first_invocation_ms": first * 1000,
+    "warm_p50_us": timings[len(timings) // 2] * 1e6,
+    "warm_p99_us": timings[int(len(timings) * 0.99)] * 1e6,
+}))
+"""
+
+
+def measure(handler, event, invocations):
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE, handler, json.dumps(event), str(invocations)],
+        cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), "lambdas"),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return round(values[len(values) // 2], 3)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per handler")
+    parser.add_argument("--invocations", type=int, default=1000, help="warm invocations per run")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results = {}
+    for handler, event in HANDLERS.items():
+        runs = [measure(handler, event, args.invocations) for _ in range(args.runs)]
+        # The median of each measurement over the runs
+        results[handler] = {key: median([run[key] for run in runs]) for key in runs[0]}
+
+        result = results[handler]
+        print(
+            f"{handler:24} init {result['init_ms']:8.2f}ms   first invocation {result['first_invocation_ms']:7.3f}ms"
+            f"   warm p50 {result['warm_p50_us']:7.2f}us   p99 {result['warm_p99_us']:7.2f}us"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
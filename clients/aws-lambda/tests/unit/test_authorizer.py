@@ -0,0 +1,111 @@
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from lambdas import authorizer
+
+ISSUER = "https://cognito-idp.eu-west-1.amazonaws.com/eu-west-1_Test"
+CLIENT_ID = "testclientid"
+
+signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def jwks(key, kid="test-kid"):
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+    jwk.update(kid=kid, alg="RS256", use="sig")
+    return {"keys": [jwk]}
+
+
+def make_token(token_use="access", key=signing_key, kid="test-kid", lifetime=3600, **claims):
+    now = int(time.time())
+    payload = {"sub": "user-1", "iss": ISSUER, "token_use": token_use, "iat": now, "exp": now + lifetime}
+    if token_use == "id":
+        payload.update({"aud": CLIENT_ID, "cognito:username": "user-1"})
+    else:
+        payload.update({"client_id": CLIENT_ID, "username": "user-1"})
+    payload.update(claims)
+    return jwt.encode(payload, key, algorithm="RS256", headers={"kid": kid})
+
+
+def event(token):
+    return {"headers": {"authorization": f"Bearer {token}"}}
+
+
+@pytest.fixture(autouse=True)
+def authorizer_state(monkeypatch):
+    monkeypatch.setattr(authorizer, "ISSUER", ISSUER)
+    monkeypatch.setattr(authorizer, "CLIENT_ID", CLIENT_ID)
+    monkeypatch.setattr(authorizer, "_verified", {})
+    monkeypatch.setattr(authorizer, "_last_jwks_fetch", time.time())
+    authorizer.load_jwks(jwks(signing_key))
+
+
+def test_access_token_is_authorized():
+    response = authorizer.handler(event(make_token("access")), None)
+    assert response == {
+        "isAuthorized": True,
+        "context": {"sub": "user-1", "username": "user-1", "token_use": "access"},
+    }
+
+
+def test_id_token_is_authorized():
+    assert authorizer.handler(event(make_token("id")), None)["isAuthorized"]
+
+
+@pytest.mark.parametrize("token", [
+    make_token(lifetime=-60),
+    make_token(key=other_key),
+    make_token(client_id="someoneelse"),
+    make_token("id", aud="someoneelse"),
+    make_token(iss="https://example.com"),
+    make_token(token_use="refresh"),
+    "not-a-jwt",
+])
+def test_bad_tokens_are_denied(token):
+    assert authorizer.handler(event(token), None) == {"isAuthorized": False}
+
+
+def test_missing_header_is_denied():
+    assert authorizer.handler({"headers": {}}, None) == {"isAuthorized": False}
+
+
+def test_verified_tokens_are_cached(monkeypatch):
+    token = make_token()
+    authorizer.handler(event(token), None)
+
+    def fail(token):
+        raise AssertionError("The token should have come from the cache")
+
+    monkeypatch.setattr(authorizer, "verify", fail)
+    assert authorizer.handler(event(token), None)["isAuthorized"]
+
+
+def test_unknown_kid_refetches_jwks_at_most_once_a_minute(monkeypatch):
+    fetches = []
+
+    def fetch_jwks():
+        fetches.append(time.time())
+        return jwks(other_key, kid="rotated-kid")
+
+    monkeypatch.setattr(authorizer, "fetch_jwks", fetch_jwks)
+    monkeypatch.setattr(authorizer, "_last_jwks_fetch", 0.0)
+
+    assert authorizer.handler(event(make_token(key=other_key, kid="rotated-kid")), None)["isAuthorized"]
+    assert not authorizer.handler(event(make_token(kid="unknown-kid")), None)["isAuthorized"]
+    assert len(fetches) == 1
+
+
+def test_each_invocation_logs_its_metrics(capsys):
+    token = make_token()
+    authorizer.handler(event(token), None)
+    authorizer.handler(event(token), None)
+
+    first, second = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert first["_aws"]["CloudWatchMetrics"][0]["Namespace"] == authorizer.METRICS_NAMESPACE
+    assert {m["Name"] for m in first["_aws"]["CloudWatchMetrics"][0]["Metrics"]} >= {"Authorized", "Duration"}
+    assert (first["Authorized"], first["VerifiedCacheHits"]) == (1, 0)
+    assert (second["Authorized"], second["VerifiedCacheHits"], second["ColdStart"]) == (1, 1, 0)
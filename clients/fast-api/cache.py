@@ -0,0 +1,72 @@
+"""
+A small, thread-safe, in-process LRU cache whose entries expire at a fixed time.
+
+It's bounded both by the number of entries and by an estimate of their size,
+so a burst of distinct tokens can't grow it without limit.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class BoundedTTLCache:
+
+    def __init__(self, max_entries=10_000, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the value for `key`, or None if it's missing or has expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at, size = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self._bytes -= size
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at, size=0):
+        """Store `value` until `expires_at` (a unix timestamp).
+
+        `size` is the caller's estimate of how many bytes the entry holds.
+        """
+        if self.max_entries <= 0 or size > self.max_bytes or expires_at <= time.time():
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+            self._entries[key] = (value, expires_at, size)
+            self._bytes += size
+
+            # Evict the least recently used entries until we're back in bounds
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
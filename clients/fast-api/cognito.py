@@ -0,0 +1,227 @@
+"""
+Call Cognito without blocking the event loop, and without overwhelming it.
+
+boto3 is synchronous, so calling it from an `async def` endpoint stalls every
+other request the worker is serving until Cognito answers. Instead we run the
+calls on a bounded pool of threads. If too many calls are already waiting for
+a thread we refuse new ones straight away, rather than letting the queue (and
+everyone's latency) grow without limit.
+
+Cognito also has request rate quotas, and answers with a
+`TooManyRequestsException` once you go over them (or a 503, when it's
+overloaded). So that we degrade gracefully instead of falling over:
+
+* a token bucket holds us to the rate we've configured (our share of the
+  quota). When it's empty we refuse the call, with how long to wait before
+  trying again, rather than queueing it.
+* the number of calls we make at once adapts to how Cognito is coping: it
+  halves every time we're throttled, and creeps back up as calls succeed.
+* throttled calls are retried a couple of times, with jittered backoff.
+"""
+
+import asyncio
+import functools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import metrics
+
+THROTTLING_ERRORS = {"TooManyRequestsException", "ThrottlingException", "LimitExceededException"}
+# Whatever the error code, these mean the same
+THROTTLING_STATUSES = {429, 503}
+
+
+def is_throttling(error):
+    """Whether a ClientError means Cognito is throttling us, or too busy to answer."""
+    return (
+        error.response.get("Error", {}).get("Code") in THROTTLING_ERRORS
+        or error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") in THROTTLING_STATUSES
+    )
+
+
+class CognitoBusy(Exception):
+    """Raised when too many calls to Cognito are already in flight."""
+
+
+class CognitoThrottled(Exception):
+    """Raised when we're over our rate limit for Cognito, or it throttled us."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Cognito is throttling us, retry after {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, in bursts of up to `burst`."""
+
+    def __init__(self, rate, burst):
+        if burst < 1:
+            # Every call takes a whole token, so a smaller bucket would refuse them all
+            raise ValueError(f"The burst must be at least 1, not {burst}")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_take(self):
+        """Take a token if there is one. Returns 0, or how many seconds until there will be one."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class AdaptiveLimit:
+    """A concurrency limit which halves when we're throttled, and grows back by one per `limit` successes."""
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        # Made on first use, from inside the event loop - we're created at import,
+        # before there is one, and a test client or reloader may start a new one
+        self._condition = None
+        self._loop = None
+
+    def _get_condition(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+        return self._condition
+
+    async def __aenter__(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc_info):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def throttled(self):
+        self.limit = max(self.min_limit, self.limit / 2)
+
+    def succeeded(self):
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class AsyncCognitoClient:
+
+    def __init__(self, max_workers=10, max_pending=100, rate_limit=None, burst=None,
+                 max_retries=2, retry_base_delay=0.05, **client_kwargs):
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+
+        # One HTTP connection per worker thread, so the threads don't queue for connections.
+        # botocore's own retries are off, we retry (or don't) below.
+        self.client = boto3.client(
+            'cognito-idp',
+            config=Config(max_pool_connections=max_workers, retries={"mode": "standard", "max_attempts": 1}),
+            **client_kwargs,
+        )
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="cognito")
+        self._bucket = TokenBucket(rate_limit, burst or max(1, rate_limit)) if rate_limit else None
+        self._concurrency = AdaptiveLimit(max_workers)
+        # Only ever touched from the event loop, so it doesn't need a lock
+        self._pending = 0
+
+    def _take_token(self):
+        if self._bucket is None:
+            return
+        retry_after = self._bucket.try_take()
+        if retry_after:
+            raise CognitoThrottled(retry_after)
+
+    async def call(self, operation, **kwargs):
+        """Call a boto3 operation, e.g. `await cognito.call("initiate_auth", ...)`"""
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await self._call(operation, **kwargs)
+            outcome = "ok"
+            return response
+        except CognitoBusy:
+            outcome = "busy"
+            raise
+        except CognitoThrottled:
+            outcome = "throttled"
+            raise
+        finally:
+            metrics.cognito_calls.observe(time.perf_counter() - start, operation, outcome)
+
+    async def _call(self, operation, **kwargs):
+        if self._pending >= self.max_pending:
+            raise CognitoBusy(f"{self._pending} calls to Cognito are already in flight")
+
+        self._take_token()
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            request = functools.partial(getattr(self.client, operation), **kwargs)
+
+            for attempt in range(self.max_retries + 1):
+                async with self._concurrency:
+                    try:
+                        response = await loop.run_in_executor(self._executor, request)
+                    except ClientError as e:
+                        if not is_throttling(e):
+                            raise
+                        self._concurrency.throttled()
+                        if attempt == self.max_retries:
+                            raise CognitoThrottled(self.retry_base_delay * 2 ** attempt) from e
+                    else:
+                        self._concurrency.succeeded()
+                        return response
+
+                # "Full jitter" backoff, so retries from many requests don't arrive in waves
+                await asyncio.sleep(random.uniform(0, self.retry_base_delay * 2 ** attempt))
+                self._take_token()
+        finally:
+            self._pending -= 1
+
+    async def initiate_auth(self, **kwargs):
+        return await self.call("initiate_auth", **kwargs)
+
+    async def warm_up(self, connections):
+        """Open up to `connections` connections to Cognito, before a real call needs them.
+
+        botocore also loads its service model on the first call. We make the
+        calls at the same time, so each one needs a connection of its own. GetUser
+        with a made-up access token is unauthenticated, changes nothing, and is
+        turned away straight away - but not before the connection is open.
+        Returns how many calls got an answer.
+        """
+        loop = asyncio.get_running_loop()
+
+        def get_user():
+            try:
+                self.client.get_user(AccessToken="warm-up")
+            except ClientError:
+                pass
+
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, get_user) for _ in range(connections)),
+            return_exceptions=True,
+        )
+        return sum(1 for result in results if not isinstance(result, Exception))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -25,8 +25,61 @@ REDIRECT_URI = os.environ.get("REDIRECT_URI", config.get('RedirectUri'))
 HOSTEDUIPATH = os.environ.get("HOSTEDUIPATH", config.get('HostedUiPath'))
 COGNITO_USER_POOL_ID = os.environ.get("COGNITO_USER_POOL_ID", config.get('UserPoolId'))
 
+# Optional - where to send Cognito API calls, e.g. to the local stand-in in cognito-local/
+COGNITO_ENDPOINT_URL = os.environ.get("COGNITO_ENDPOINT_URL")
+# Optional - where tokens are issued from. Defaults to the Cognito issuer for the user pool.
+COGNITO_ISSUER = os.environ.get("COGNITO_ISSUER")
+# Optional - how often (in seconds) to re-fetch the signing keys, and the
+# shortest gap between fetches triggered by a token signed with an unknown key.
+JWKS_REFRESH_INTERVAL = int(os.environ.get("JWKS_REFRESH_INTERVAL", 3600))
+JWKS_MIN_REFRESH_INTERVAL = int(os.environ.get("JWKS_MIN_REFRESH_INTERVAL", 30))
+# Optional - a JSON file listing more user pools (tenants) whose tokens we accept, and
+# how often (in seconds) to check it for changes. See the README.
+TENANTS_FILE = os.environ.get("TENANTS_FILE")
+TENANTS_RELOAD_INTERVAL = int(os.environ.get("TENANTS_RELOAD_INTERVAL", 5))
+# Optional - the longest JWT (in characters) we'll look at. Anything longer is turned away unread.
+MAX_TOKEN_LENGTH = int(os.environ.get("MAX_TOKEN_LENGTH", 16 * 1024))
+# Optional - bounds on the cache of verified tokens. Set the entries to 0 to disable it.
+CLAIMS_CACHE_MAX_ENTRIES = int(os.environ.get("CLAIMS_CACHE_MAX_ENTRIES", 10_000))
+CLAIMS_CACHE_MAX_BYTES = int(os.environ.get("CLAIMS_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+# Optional - a file (ideally in memory, e.g. /dev/shm/...) to share the keys
+# and verified tokens between the workers on this host, and how many tokens it holds.
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH")
+SHARED_CACHE_SLOTS = int(os.environ.get("SHARED_CACHE_SLOTS", 8192))
+# Optional - "combined" hands out the access and ID tokens joined together,
+# "opaque" hands out a short handle to claims we keep on the server.
+TOKEN_MODE = os.environ.get("TOKEN_MODE", "combined")
+OPAQUE_SESSIONS_MAX_ENTRIES = int(os.environ.get("OPAQUE_SESSIONS_MAX_ENTRIES", 100_000))
+# Optional - how many calls to Cognito can run at once, and how many can be waiting to run.
+COGNITO_MAX_WORKERS = int(os.environ.get("COGNITO_MAX_WORKERS", 10))
+COGNITO_MAX_PENDING = int(os.environ.get("COGNITO_MAX_PENDING", 100))
+# Optional - the most calls per second (and the burst size) this process makes
+# to Cognito - its share of your user pool's quota - and how often to retry throttled calls.
+COGNITO_RATE_LIMIT = float(os.environ.get("COGNITO_RATE_LIMIT", 0)) or None
+COGNITO_BURST = float(os.environ.get("COGNITO_BURST", 0)) or None
+COGNITO_MAX_RETRIES = int(os.environ.get("COGNITO_MAX_RETRIES", 2))
+# Optional - how many revoked tokens and users to plan the revocation list's Bloom filters for
+REVOCATION_CAPACITY = int(os.environ.get("REVOCATION_CAPACITY", 100_000))
+# Optional - the longest (in seconds) an access token can live, so logging out everywhere covers them all
+MAX_TOKEN_LIFETIME = int(os.environ.get("MAX_TOKEN_LIFETIME", 86400))
+# Optional - where /users/me/ gets the user's attributes and enabled state: "token" (its claims) or "cognito"
+USER_PROFILE_SOURCE = os.environ.get("USER_PROFILE_SOURCE", "token")
+# Optional - how long (in seconds) profiles from Cognito are fresh, can be served stale, and "no such user" is cached
+PROFILE_TTL = int(os.environ.get("PROFILE_TTL", 300))
+PROFILE_STALE_TTL = int(os.environ.get("PROFILE_STALE_TTL", 3600))
+PROFILE_NEGATIVE_TTL = int(os.environ.get("PROFILE_NEGATIVE_TTL", 60))
+# Optional - set to "false" not to load every profile in the user pool at startup
+PROFILE_PREFETCH = os.environ.get("PROFILE_PREFETCH", "true").lower() != "false"
+# Optional - the most tokens /introspect accepts at once, and how many threads verify them
+INTROSPECTION_MAX_TOKENS = int(os.environ.get("INTROSPECTION_MAX_TOKENS", 1000))
+INTROSPECTION_WORKERS = int(os.environ.get("INTROSPECTION_WORKERS", os.cpu_count() or 4))
+# Optional - how many connections to Cognito to open at startup, before the first requests need them
+WARMUP_CONNECTIONS = int(os.environ.get("WARMUP_CONNECTIONS", 2))
+# Optional - set to "false" to stop recording the metrics served on /metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() != "false"
+
 def get_config():
-    if any([not COGNITO_CLIENT_ID, not COGNITO_CLIENT_SECRET, not REDIRECT_URI, not HOSTEDUIPATH]):
+    if any([not COGNITO_CLIENT_ID, not COGNITO_CLIENT_SECRET, not COGNITO_USER_POOL_ID, not REDIRECT_URI, not HOSTEDUIPATH]):
         raise ValueError("""
             Missing required ENV VARs:
                 * COGNITO_CLIENT_ID
@@ -43,6 +96,35 @@ def get_config():
         "REDIRECT_URI": REDIRECT_URI,
         "HOSTEDUIPATH": HOSTEDUIPATH,
         "COGNITO_USER_POOL_ID": COGNITO_USER_POOL_ID,
+        "COGNITO_ENDPOINT_URL": COGNITO_ENDPOINT_URL,
+        "COGNITO_ISSUER": COGNITO_ISSUER,
+        "JWKS_REFRESH_INTERVAL": JWKS_REFRESH_INTERVAL,
+        "JWKS_MIN_REFRESH_INTERVAL": JWKS_MIN_REFRESH_INTERVAL,
+        "TENANTS_FILE": TENANTS_FILE,
+        "TENANTS_RELOAD_INTERVAL": TENANTS_RELOAD_INTERVAL,
+        "MAX_TOKEN_LENGTH": MAX_TOKEN_LENGTH,
+        "CLAIMS_CACHE_MAX_ENTRIES": CLAIMS_CACHE_MAX_ENTRIES,
+        "CLAIMS_CACHE_MAX_BYTES": CLAIMS_CACHE_MAX_BYTES,
+        "SHARED_CACHE_PATH": SHARED_CACHE_PATH,
+        "SHARED_CACHE_SLOTS": SHARED_CACHE_SLOTS,
+        "TOKEN_MODE": TOKEN_MODE,
+        "OPAQUE_SESSIONS_MAX_ENTRIES": OPAQUE_SESSIONS_MAX_ENTRIES,
+        "COGNITO_MAX_WORKERS": COGNITO_MAX_WORKERS,
+        "COGNITO_MAX_PENDING": COGNITO_MAX_PENDING,
+        "COGNITO_RATE_LIMIT": COGNITO_RATE_LIMIT,
+        "COGNITO_BURST": COGNITO_BURST,
+        "COGNITO_MAX_RETRIES": COGNITO_MAX_RETRIES,
+        "REVOCATION_CAPACITY": REVOCATION_CAPACITY,
+        "MAX_TOKEN_LIFETIME": MAX_TOKEN_LIFETIME,
+        "USER_PROFILE_SOURCE": USER_PROFILE_SOURCE,
+        "PROFILE_TTL": PROFILE_TTL,
+        "PROFILE_STALE_TTL": PROFILE_STALE_TTL,
+        "PROFILE_NEGATIVE_TTL": PROFILE_NEGATIVE_TTL,
+        "PROFILE_PREFETCH": PROFILE_PREFETCH,
+        "INTROSPECTION_MAX_TOKENS": INTROSPECTION_MAX_TOKENS,
+        "INTROSPECTION_WORKERS": INTROSPECTION_WORKERS,
+        "WARMUP_CONNECTIONS": WARMUP_CONNECTIONS,
+        "METRICS_ENABLED": METRICS_ENABLED,
     }
 
 config = get_config()
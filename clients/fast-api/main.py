@@ -1,18 +1,104 @@
+from contextlib import asynccontextmanager
 from typing import Annotated
+import asyncio
+import hashlib
+import math
+import secrets
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
 import jwt
-from fastapi import Depends, FastAPI, HTTPException, status
+from botocore.exceptions import BotoCoreError, ClientError
+from fastapi import Depends, FastAPI, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
+import metrics
+from cache import BoundedTTLCache
+from cognito import AsyncCognitoClient, CognitoBusy, CognitoThrottled
 from config import config
+from profiles import NOT_FOUND, ProfileSource
+from revocation import RevocationList
+from secret_hash import SecretHashes
+from shared_cache import SharedCache
+from token_parser import MalformedToken, parse_combined, parse_token
+from verifier import JwksCache, TokenVerifier, VerifierRegistry, issuer_for_user_pool
+from warmup import SYNTHETIC_ISSUER, Readiness, synthetic_tokens
 
-cognito_client = boto3.client('cognito-idp')
+# Started before anything else is set up, so the startup time covers all of it
+readiness = Readiness()
+
+cognito_client = AsyncCognitoClient(
+    max_workers=config['COGNITO_MAX_WORKERS'],
+    max_pending=config['COGNITO_MAX_PENDING'],
+    rate_limit=config['COGNITO_RATE_LIMIT'],
+    burst=config['COGNITO_BURST'],
+    max_retries=config['COGNITO_MAX_RETRIES'],
+    endpoint_url=config['COGNITO_ENDPOINT_URL'],
+)
+
+# Shared by all the workers on this host, if it's configured
+shared_cache = None
+if config['SHARED_CACHE_PATH']:
+    shared_cache = SharedCache(config['SHARED_CACHE_PATH'], slots=config['SHARED_CACHE_SLOTS'])
+
+# The user pool we log users in to. Only its keys are shared through the shared cache
+issuer = config['COGNITO_ISSUER'] or issuer_for_user_pool(config['COGNITO_USER_POOL_ID'])
+jwks = JwksCache(
+    f"{issuer}/.well-known/jwks.json",
+    refresh_interval=config['JWKS_REFRESH_INTERVAL'],
+    min_refresh_interval=config['JWKS_MIN_REFRESH_INTERVAL'],
+    shared=shared_cache,
+)
+# Plus any other tenants' pools, which tokens are routed to by their issuer
+verifier = VerifierRegistry(
+    TokenVerifier(issuer, [config['COGNITO_CLIENT_ID']], jwks),
+    tenants_file=config['TENANTS_FILE'],
+    reload_interval=config['TENANTS_RELOAD_INTERVAL'],
+    refresh_interval=config['JWKS_REFRESH_INTERVAL'],
+    min_refresh_interval=config['JWKS_MIN_REFRESH_INTERVAL'],
+)
+
+# Verified tokens, keyed by a digest of the combined token string.
+# Each entry expires when the first of its two tokens does.
+claims_cache = BoundedTTLCache(
+    max_entries=config['CLAIMS_CACHE_MAX_ENTRIES'],
+    max_bytes=config['CLAIMS_CACHE_MAX_BYTES'],
+)
+
+# In "opaque" token mode, the claims behind each handle we've handed out.
+# These live in this process, so run a single worker (or route each client
+# back to the same one) when using it.
+opaque_sessions = BoundedTTLCache(
+    max_entries=config['OPAQUE_SESSIONS_MAX_ENTRIES'],
+    max_bytes=float("inf"),
+)
+
+# Where /users/me/ looks up whether the user is still enabled, if anywhere
+profiles = None
+if config['USER_PROFILE_SOURCE'] == "cognito":
+    profiles = ProfileSource(
+        cognito_client,
+        config['COGNITO_USER_POOL_ID'],
+        ttl=config['PROFILE_TTL'],
+        stale_ttl=config['PROFILE_STALE_TTL'],
+        negative_ttl=config['PROFILE_NEGATIVE_TTL'],
+    )
+
+# Tokens which have been logged out of before they expire
+revocations = RevocationList(capacity=config['REVOCATION_CAPACITY'])
+
+# Verifies the tokens posted to /introspect. The signature checks release the GIL,
+# so they run in parallel
+introspection_executor = ThreadPoolExecutor(config['INTROSPECTION_WORKERS'], thread_name_prefix="introspect")
+
+# Keyed once per app client, rather than on every login
+secret_hash = SecretHashes()
+secret_hash.register(config['COGNITO_CLIENT_ID'], config['COGNITO_CLIENT_SECRET'])
 
 TOKEN_DELIMITER = "++++++"
+max_combined_length = 2 * config['MAX_TOKEN_LENGTH'] + len(TOKEN_DELIMITER)
 
 class Token(BaseModel):
     access_token: str
@@ -41,6 +127,15 @@ class Token(BaseModel):
             token_type=resp['AuthenticationResult']['TokenType']
         )
 
+    @classmethod
+    def from_handle(cls, handle, resp):
+        """Create a Token which carries an opaque handle instead of the JWTs."""
+        return cls(
+            access_token=handle,
+            refresh_token=resp['AuthenticationResult']['RefreshToken'],
+            token_type=resp['AuthenticationResult']['TokenType']
+        )
+
 
 class User(BaseModel):
     username: str
@@ -48,44 +143,244 @@ class User(BaseModel):
     disabled: bool = False
 
 
+class IntrospectionRequest(BaseModel):
+    tokens: list[str] = Field(max_length=config['INTROSPECTION_MAX_TOKENS'])
+
+
+class Introspection(BaseModel):
+    active: bool
+    user: User | None = None
+    claims: dict | None = None
+    error: str | None = None
+
+
+class IntrospectionResponse(BaseModel):
+    # In the same order as the tokens in the request
+    results: list[Introspection]
+
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the signing keys before we take any requests, and keep them fresh
+    with readiness.step("keys"):
+        verifier.start()
+    # The rest doesn't hold up startup, but /ready doesn't say we're ready until it's done
+    warming_up = asyncio.create_task(warm_up())
+    # Don't hold up startup for it, the profiles are fetched on demand until it's done
+    prefetch = None
+    if profiles is not None and config['PROFILE_PREFETCH']:
+        prefetch = asyncio.create_task(prefetch_profiles())
+    yield
+    warming_up.cancel()
+    if prefetch is not None:
+        prefetch.cancel()
+    verifier.stop()
+    cognito_client.shutdown()
+    introspection_executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def warm_up():
+    with readiness.step("connections"):
+        opened = await cognito_client.warm_up(min(config['WARMUP_CONNECTIONS'], config['COGNITO_MAX_WORKERS']))
+        print(f"Opened {opened} connections to Cognito")
+    with readiness.step("verify"):
+        # Generating the key takes a moment, so keep it off the event loop
+        await asyncio.to_thread(synthetic_verify)
+    readiness.done()
+
+
+def synthetic_verify():
+    """Check a made-up pair of tokens the way we check real ones, so whatever that loads is loaded now."""
+    jwks_document, access_token, id_token = synthetic_tokens(config['COGNITO_CLIENT_ID'])
+    keys = JwksCache(f"{SYNTHETIC_ISSUER}/.well-known/jwks.json")
+    keys.load(jwks_document)
+    synthetic = TokenVerifier(SYNTHETIC_ISSUER, [config['COGNITO_CLIENT_ID']], keys)
+
+    access_payload = synthetic.verify(parse_token(access_token), "access")
+    id_payload = synthetic.verify(parse_token(id_token), "id")
+    revocations.is_revoked(access_payload)
+    secret_hash(id_payload["email"], config['COGNITO_CLIENT_ID'])
+
+
+async def prefetch_profiles():
+    try:
+        count = await profiles.prefetch()
+        print(f"Prefetched {count} user profiles")
+    except Exception as e:
+        print(f"Failed to prefetch the user profiles: {e}")
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def authenticate(token):
+    """Return the User and claims for a combined token.
+
+    Verifying the signatures is the expensive part, so we only do it the first
+    time we see a token. Raises a `jwt.InvalidTokenError` if the token is bad.
+    """
+    # Don't even hash anything too long to be ours
+    if len(token) > max_combined_length:
+        raise MalformedToken("Token is too long")
+
+    cache_key = hashlib.sha256(token.encode()).digest()
+    cached = claims_cache.get(cache_key)
+    if cached is not None:
+        metrics.cache_lookups.inc("claims", "hit")
+        return cached
+    metrics.cache_lookups.inc("claims", "miss")
+
+    # Another worker on this host may have verified it already
+    if shared_cache is not None:
+        shared = shared_cache.get(cache_key)
+        if shared is not None:
+            metrics.cache_lookups.inc("shared", "hit")
+            user, claims = User(**shared["user"]), shared["claims"]
+            expires_at = min(claims["access"]["exp"], claims["id"]["exp"])
+            claims_cache.set(cache_key, (user, claims), expires_at, size=len(token))
+            return user, claims
+        metrics.cache_lookups.inc("shared", "miss")
+
+    access_token, id_token = parse_combined(token, TOKEN_DELIMITER, config['MAX_TOKEN_LENGTH'])
+    user, claims, expires_at = verify_tokens(access_token, id_token)
+    # The decoded claims take up about as much memory as the encoded token
+    claims_cache.set(cache_key, (user, claims), expires_at, size=len(token))
+    if shared_cache is not None:
+        shared_cache.set(cache_key, {"user": user.model_dump(), "claims": claims}, expires_at)
+
+    return user, claims
+
+
+def verify(token, token_use):
+    """`verifier.verify`, timed."""
+    start = time.perf_counter()
+    outcome = "invalid"
+    try:
+        claims = verifier.verify(token, token_use)
+        outcome = "ok"
+        return claims
+    except jwt.ExpiredSignatureError:
+        outcome = "expired"
+        raise
+    finally:
+        metrics.jwt_verifications.observe(time.perf_counter() - start, token_use, outcome)
+
+
+def verify_tokens(access_token, id_token):
+    """Verify a pair of ParsedTokens, returning the User, their claims and when they expire."""
+    access_payload = verify(access_token, "access")
+    id_payload = verify(id_token, "id")
+    # With several pools, both halves have to come from the same one - and be for the same user
+    if (access_payload["iss"], access_payload["sub"]) != (id_payload["iss"], id_payload["sub"]):
+        raise jwt.InvalidTokenError("The access and ID tokens are for different users")
+
+    user = User(
+        username=access_payload.get("sub"),
+        email=id_payload.get("email"),
+    )
+    claims = {"access": access_payload, "id": id_payload}
+    expires_at = min(access_payload["exp"], id_payload["exp"])
+
+    return user, claims, expires_at
+
+
+def issue_opaque_handle(resp):
+    """Verify the tokens from Cognito once, and keep their claims behind a random handle."""
+    user, claims, expires_at = verify_tokens(
+        parse_token(resp['AuthenticationResult']['AccessToken'], config['MAX_TOKEN_LENGTH']),
+        parse_token(resp['AuthenticationResult']['IdToken'], config['MAX_TOKEN_LENGTH']),
+    )
+    handle = secrets.token_urlsafe(32)
+    opaque_sessions.set(handle, (user, claims), expires_at)
+    return handle
+
+
+async def get_current_session(token: Annotated[str, Depends(oauth2_scheme)]):
+    """The User and claims for the request's token - FastAPI only works them out once per request."""
+    start = time.perf_counter()
+    outcome = "invalid"
+    try:
+        session = current_session(token)
+        outcome = "ok"
+        return session
+    except HTTPException as e:
+        outcome = {"Expired token": "expired", "Revoked token": "revoked"}.get(e.detail, "invalid")
+        raise
+    finally:
+        metrics.auth_requests.observe(time.perf_counter() - start, "get_current_user", outcome)
 
 
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+    user, _ = await get_current_session(token)
+    return user
+
+
+def current_session(token):
+    """Return the User and claims for a token, or raise a 401 if it isn't valid."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        access_token = token.split(TOKEN_DELIMITER)[0]
-        access_payload = jwt.decode(access_token, options={"verify_signature": False})
-
-        if access_payload.get("exp") < int(time.time()):
+    if config['TOKEN_MODE'] == "opaque":
+        # A single lookup, there's nothing to parse or verify
+        session = opaque_sessions.get(token)
+        if session is None:
+            metrics.cache_lookups.inc("opaque", "miss")
+            raise credentials_exception
+        metrics.cache_lookups.inc("opaque", "hit")
+        user, claims = session
+    else:
+        try:
+            user, claims = authenticate(token)
+        except jwt.ExpiredSignatureError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Expired token",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        except jwt.InvalidTokenError:
+            raise credentials_exception
 
-        username: str = access_payload.get("sub")
-    except jwt.exceptions.DecodeError:
-        raise credentials_exception
-    
-    id_token = token.split(TOKEN_DELIMITER)[1]
-    id_payload = jwt.decode(id_token, options={"verify_signature": False})
-    user = User(
-        username=username,
-        email=id_payload.get("email"),
-    )
-    return user
+    # Checked on every request, even when the token came from a cache
+    if revocations.is_revoked(claims["access"]):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Revoked token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    return user, claims
+
+
+async def with_profile(user):
+    """The user, brought up to date with their profile in Cognito."""
+    try:
+        profile = await profiles.get(user.username)
+    except (CognitoBusy, CognitoThrottled, ClientError, BotoCoreError) as e:
+        # We've nothing cached for them and can't ask Cognito, so go on what the token says
+        print(f"Failed to look up the profile of {user.username}: {e}")
+        return user
+
+    if profile is NOT_FOUND:
+        # They've been deleted since the token was issued
+        return user.model_copy(update={"disabled": True})
+    return user.model_copy(update={
+        "email": profile["email"] or user.email,
+        "disabled": not profile["enabled"],
+    })
 
 
 async def get_current_active_user(
-    current_user: Annotated[User, Depends(get_current_user)]
+    session: Annotated[tuple[User, dict], Depends(get_current_session)],
 ):
+    current_user, claims = session
+    # We can only look up the profiles of users in our own pool, not the other tenants'
+    if profiles is not None and claims["access"]["iss"] == issuer:
+        current_user = await with_profile(current_user)
     if current_user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
@@ -95,30 +390,45 @@ async def get_current_active_user(
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
 ) -> Token:
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        token = await _login(form_data)
+        outcome = "ok"
+        return token
+    except HTTPException as e:
+        outcome = {429: "throttled", 503: "busy"}.get(e.status_code, "error")
+        raise
+    finally:
+        metrics.auth_requests.observe(time.perf_counter() - start, "token", outcome)
 
-    def secret_hash(username):
-        """ Create a secret hash for cognito
-        See https://docs.aws.amazon.com/cognito/latest/developerguide/signing-up-users-in-your-app.html#cognito-user-pools-computing-secret-hash
-        """
-
-        import hmac
-        import hashlib
-        import base64
-
-        message = bytes(username + config['COGNITO_CLIENT_ID'],'utf-8') 
-        key = bytes(config['COGNITO_CLIENT_SECRET'],'utf-8')
-        secret_hash = base64.b64encode(hmac.new(key, message, digestmod=hashlib.sha256).digest()).decode() 
-        return secret_hash
-
-    resp = cognito_client.initiate_auth(
-        ClientId=config['COGNITO_CLIENT_ID'],
-        AuthFlow='USER_PASSWORD_AUTH',
-        AuthParameters={
-            'USERNAME': form_data.username,
-            'PASSWORD': form_data.password,
-            'SECRET_HASH': secret_hash(form_data.username)
-        }
-    )
+
+async def _login(form_data):
+    try:
+        resp = await cognito_client.initiate_auth(
+            ClientId=config['COGNITO_CLIENT_ID'],
+            AuthFlow='USER_PASSWORD_AUTH',
+            AuthParameters={
+                'USERNAME': form_data.username,
+                'PASSWORD': form_data.password,
+                'SECRET_HASH': secret_hash(form_data.username, config['COGNITO_CLIENT_ID'])
+            }
+        )
+    except CognitoBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    except CognitoThrottled as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many logins, try again shortly",
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+
+    if config['TOKEN_MODE'] == "opaque":
+        return Token.from_handle(issue_opaque_handle(resp), resp)
     return Token.from_cognito(resp)
 
 
@@ -127,3 +437,102 @@ async def read_users_me(
     current_user: Annotated[User, Depends(get_current_active_user)]
 ):
     return current_user
+
+
+@app.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(token: Annotated[str, Depends(oauth2_scheme)], everywhere: bool = False):
+    """Revoke this token - or with `?everywhere=true`, every token the user has been issued."""
+    _, claims = current_session(token)
+    access_claims = claims["access"]
+
+    if config['TOKEN_MODE'] == "opaque":
+        opaque_sessions.delete(token)
+
+    if not everywhere:
+        revocations.revoke_token(access_claims["jti"], access_claims["exp"])
+        metrics.revocations.inc("token")
+        return
+
+    revocations.revoke_subject(access_claims["sub"], config['MAX_TOKEN_LIFETIME'])
+    metrics.revocations.inc("user")
+    # We can only sign users out of our own pool, not the other tenants'
+    if access_claims["iss"] != issuer:
+        return
+
+    # We've stopped accepting their tokens, this stops Cognito refreshing them
+    try:
+        await cognito_client.call(
+            "admin_user_global_sign_out",
+            UserPoolId=config['COGNITO_USER_POOL_ID'],
+            Username=access_claims["username"],
+        )
+    except (CognitoBusy, CognitoThrottled):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Logged out here, but couldn't sign out of Cognito. Try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    except (ClientError, BotoCoreError) as e:
+        if isinstance(e, ClientError) and e.response.get("Error", {}).get("Code") == "UserNotFoundException":
+            # They've been deleted since, so there's nothing left to sign out of
+            return
+        print(f"Failed to sign {access_claims['username']} out of Cognito: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Logged out here, but couldn't sign out of Cognito",
+        )
+
+
+def introspect(token):
+    """What we make of one token - the same checks `get_current_user` makes."""
+    try:
+        user, claims = current_session(token)
+    except HTTPException as e:
+        return Introspection(active=False, error=e.detail)
+    return Introspection(active=True, user=user, claims=claims)
+
+
+def introspect_all(tokens):
+    return {token: introspect(token) for token in tokens}
+
+
+@app.post("/introspect")
+async def introspect_tokens(request: IntrospectionRequest) -> IntrospectionResponse:
+    """Check a batch of tokens at once, e.g. for a gateway making many calls on behalf of users."""
+    start = time.perf_counter()
+
+    # Each distinct token is only checked once. They're shared out in one chunk
+    # per thread, so handing work to the threads doesn't cost more than the
+    # (mostly cached) checks themselves
+    unique = list(dict.fromkeys(request.tokens))
+    workers = min(config['INTROSPECTION_WORKERS'], len(unique))
+    loop = asyncio.get_running_loop()
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(introspection_executor, introspect_all, unique[i::workers])
+        for i in range(workers)
+    ))
+
+    results = {}
+    for chunk in chunks:
+        results.update(chunk)
+
+    metrics.auth_requests.observe(time.perf_counter() - start, "introspect", "ok")
+    return IntrospectionResponse(results=[results[token] for token in request.tokens])
+
+
+@app.get("/ready")
+async def read_readiness(response: Response):
+    """200 once we've warmed up and have the signing keys, 503 until then. For load balancers' health checks."""
+    if not len(jwks):
+        # We can't check any tokens without them. Try again (the retries are rate limited)
+        jwks.refresh_in_background()
+    ready = readiness.ready and len(jwks) > 0
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"ready": ready, "startup": readiness.durations, "failed": readiness.failed}
+
+
+@app.get("/metrics")
+async def read_metrics():
+    """The metrics, for Prometheus to scrape."""
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,211 @@
+"""
+Count and time what the auth code does, and expose it for Prometheus to scrape.
+
+The hot paths only ever call `inc` on a Counter or `observe`/`time` on a
+Histogram, which update a few numbers under a lock - cheap enough to leave on
+in production. Gauges are only `set` once in a while, at startup. Turning the
+text format out happens when `/metrics` is scraped, not on every request.
+
+Label values are passed positionally, in the order the labels were declared:
+
+    cognito_calls.observe(0.12, "initiate_auth", "ok")
+
+Set METRICS_ENABLED=false and every metric becomes a no-op.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from config import config
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds, in seconds. From well under a millisecond (a cache hit) up to
+# several seconds (a throttled call to Cognito, with retries)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(label_values)
+            if values is None:
+                # One count per bucket, one for +Inf, then the sum
+                values = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            values[index] += 1
+            values[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = [(label_values, list(counts)) for label_values, counts in self._values.items()]
+
+        for label_values, counts in values:
+            # Prometheus buckets are cumulative
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {counts[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Disabled:
+
+    def inc(self, *label_values, amount=1):
+        pass
+
+    def set(self, value, *label_values):
+        pass
+
+    def observe(self, value, *label_values):
+        pass
+
+    @contextmanager
+    def time(self, *label_values):
+        yield
+
+    def render(self):
+        return []
+
+
+class Registry:
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+
+    def _register(self, metric):
+        if not self.enabled:
+            return _Disabled()
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """Every metric, in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(enabled=config["METRICS_ENABLED"])
+
+auth_requests = registry.histogram(
+    "auth_request_duration_seconds",
+    "Time spent authenticating a request, or logging in.",
+    labels=("endpoint", "outcome"),
+)
+cognito_calls = registry.histogram(
+    "cognito_call_duration_seconds",
+    "Time spent calling the Cognito API, including retries.",
+    labels=("operation", "outcome"),
+)
+jwt_verifications = registry.histogram(
+    "jwt_verify_duration_seconds",
+    "Time spent decoding and verifying a JWT.",
+    labels=("token_use", "outcome"),
+)
+cache_lookups = registry.counter(
+    "token_cache_lookups_total",
+    "Lookups of verified tokens, by cache and whether they hit.",
+    labels=("cache", "result"),
+)
+jwks_refreshes = registry.counter(
+    "jwks_refreshes_total",
+    "Refreshes of the signing keys, by where they came from.",
+    labels=("source",),
+)
+revocations = registry.counter(
+    "revocations_total",
+    "Tokens revoked by logging out, of one token or every token a user has.",
+    labels=("scope",),
+)
+startup = registry.gauge(
+    "startup_duration_seconds",
+    "How long each step of warming up took when the app started, and in total.",
+    labels=("step",),
+)
@@ -0,0 +1,131 @@
+"""
+Look up users' profiles - their attributes, and whether they're enabled - in Cognito.
+
+The tokens only carry what was true when they were issued, so a user disabled
+since then still looks fine. Asking Cognito on every request would add a
+network call (and eat into its rate limits), so the profiles are cached:
+
+* fresh for `ttl` seconds, then served stale for up to `stale_ttl` while
+  they're fetched again in the background - so a request never waits for a
+  profile we've seen recently.
+* "no such user" is cached too, for `negative_ttl`, so tokens for a deleted
+  user don't each cost a call.
+* concurrent lookups of the same user share one call.
+
+`prefetch` pages through the whole user pool with ListUsers, so after startup
+most lookups are already cached.
+"""
+
+import asyncio
+import time
+
+from botocore.exceptions import ClientError
+
+import metrics
+from cache import BoundedTTLCache
+from cognito import CognitoBusy, CognitoThrottled
+
+NOT_FOUND = object()
+
+
+def profile_from_attributes(attributes, enabled, status):
+    attributes = {a["Name"]: a["Value"] for a in attributes}
+    return {
+        "attributes": attributes,
+        "email": attributes.get("email"),
+        "enabled": enabled,
+        "status": status,
+    }
+
+
+class ProfileSource:
+
+    def __init__(self, cognito, user_pool_id, ttl=300, stale_ttl=3600, negative_ttl=60, max_entries=100_000):
+        self.cognito = cognito
+        self.user_pool_id = user_pool_id
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.negative_ttl = negative_ttl
+
+        # sub -> (fetched at, profile or NOT_FOUND)
+        self._profiles = BoundedTTLCache(max_entries=max_entries, max_bytes=float("inf"))
+        # sub -> the task fetching it, so concurrent lookups share one call
+        self._fetching = {}
+
+    def _store(self, sub, profile, fetched_at=None):
+        fetched_at = fetched_at or time.time()
+        lifetime = self.negative_ttl if profile is NOT_FOUND else self.stale_ttl
+        self._profiles.set(sub, (fetched_at, profile), fetched_at + lifetime)
+
+    async def get(self, sub):
+        """Return the profile of the user with this `sub`, or NOT_FOUND.
+
+        Raises CognitoBusy or CognitoThrottled if we have nothing cached and
+        can't ask Cognito right now, or botocore's error if asking it failed.
+        """
+        cached = self._profiles.get(sub)
+        if cached is not None:
+            fetched_at, profile = cached
+            if profile is NOT_FOUND or time.time() - fetched_at < self.ttl:
+                metrics.cache_lookups.inc("profiles", "hit")
+                return profile
+
+            # Serve it stale, and bring it up to date for next time
+            metrics.cache_lookups.inc("profiles", "stale")
+            self._fetch(sub).add_done_callback(self._ignore_failure)
+            return profile
+
+        metrics.cache_lookups.inc("profiles", "miss")
+        return await self._fetch(sub)
+
+    def _fetch(self, sub):
+        task = self._fetching.get(sub)
+        if task is None:
+            task = self._fetching[sub] = asyncio.ensure_future(self._fetch_now(sub))
+            task.add_done_callback(lambda _: self._fetching.pop(sub, None))
+        # Shielded, so one caller going away doesn't cancel it for the rest
+        return asyncio.shield(task)
+
+    async def _fetch_now(self, sub):
+        # In pools which sign in with an email address the username is the sub
+        try:
+            response = await self.cognito.call("admin_get_user", UserPoolId=self.user_pool_id, Username=sub)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "UserNotFoundException":
+                raise
+            profile = NOT_FOUND
+        else:
+            profile = profile_from_attributes(
+                response.get("UserAttributes", []), response.get("Enabled", True), response.get("UserStatus"),
+            )
+
+        self._store(sub, profile)
+        return profile
+
+    @staticmethod
+    def _ignore_failure(future):
+        # A background refresh which failed leaves the stale profile in place
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Failed to refresh a user profile: {future.exception()}")
+
+    async def prefetch(self, page_size=60):
+        """Page through every user in the pool, caching their profiles. Returns how many there were."""
+        count = 0
+        kwargs = {"UserPoolId": self.user_pool_id, "Limit": page_size}
+        while True:
+            try:
+                response = await self.cognito.call("list_users", **kwargs)
+            except (CognitoBusy, CognitoThrottled):
+                # Back off, rather than give up on the rest of the pool
+                await asyncio.sleep(1)
+                continue
+
+            fetched_at = time.time()
+            for user in response.get("Users", []):
+                profile = profile_from_attributes(user.get("Attributes", []), user.get("Enabled", True), user.get("UserStatus"))
+                self._store(profile["attributes"].get("sub", user["Username"]), profile, fetched_at)
+                count += 1
+
+            kwargs["PaginationToken"] = response.get("PaginationToken")
+            if not kwargs["PaginationToken"]:
+                return count
@@ -0,0 +1,142 @@
+"""
+Revoke tokens before they expire.
+
+Cognito's tokens are self-contained, so once we've verified one we'd keep
+accepting it until its `exp` - even after the user has logged out. Asking
+Cognito about every token would cost a network call per request, so instead
+we keep a list of what has been revoked here:
+
+* single tokens, by their `jti` claim - logging out of one session
+* everything issued to a user before a point in time, by their `sub` - logging
+  out everywhere
+
+Nearly every token we check hasn't been revoked, so the list sits behind
+Bloom filters, which can say "definitely not revoked" without touching the
+exact entries. Only when the filter says "maybe" (a revoked token, or the
+odd false positive) do we look at them.
+
+Entries are only needed until the tokens they cover would have expired
+anyway. Bloom filters can't forget things, so pruning rebuilds the filters
+from the entries that are left.
+"""
+
+import math
+import threading
+import time
+
+
+class BloomFilter:
+    """A set of strings which can have false positives, but never false negatives.
+
+    It hashes with Python's own `hash`, which strings cache - so checking the
+    claims of a token we've seen before doesn't even hash the string again.
+    That's randomized per process, so a filter can't be shared between them.
+    """
+
+    def __init__(self, capacity, error_rate):
+        # The optimal number of bits and hash functions for the capacity and error rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Two hashes from the halves of one, combined into as many as we need (Kirsch-Mitzenmacher)
+        h = hash(item)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        bits = self._bits
+        h = hash(item)
+        h1 = h & 0xFFFFFFFF
+        # Most items aren't in the filter, and most of those miss on the first bit
+        position = h1 % self.size
+        if not bits[position >> 3] & (1 << (position & 7)):
+            return False
+
+        h2 = (h >> 32) | 1
+        for i in range(1, self.hashes):
+            position = (h1 + i * h2) % self.size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class RevocationList:
+
+    def __init__(self, capacity=100_000, error_rate=0.001, prune_interval=60):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.prune_interval = prune_interval
+
+        self._tokens = {}  # jti -> when the token expires
+        self._subjects = {}  # sub -> (revoked at, when the last token it covers expires)
+        self._token_filter = BloomFilter(capacity, error_rate)
+        self._subject_filter = BloomFilter(capacity, error_rate)
+        self._filter_capacity = capacity
+        self._lock = threading.Lock()
+        self._next_prune = time.time() + prune_interval
+
+    def revoke_token(self, jti, expires_at):
+        """Revoke one token, until it would have expired."""
+        with self._lock:
+            self._tokens[jti] = max(expires_at, self._tokens.get(jti, 0))
+            self._token_filter.add(jti)
+            self._maybe_prune()
+
+    def revoke_subject(self, sub, max_token_lifetime):
+        """Revoke every token issued to `sub` up to now."""
+        now = time.time()
+        with self._lock:
+            self._subjects[sub] = (now, now + max_token_lifetime)
+            self._subject_filter.add(sub)
+            self._maybe_prune()
+
+    def is_revoked(self, claims):
+        """Whether the token with these claims has been revoked."""
+        jti = claims.get("jti")
+        if jti is not None and jti in self._token_filter:
+            expires_at = self._tokens.get(jti)
+            if expires_at is not None and expires_at > time.time():
+                return True
+
+        sub = claims.get("sub")
+        if sub is not None and sub in self._subject_filter:
+            revoked = self._subjects.get(sub)
+            # `iat` is in whole seconds, so this errs on the side of also
+            # revoking tokens issued in the same second, just after
+            if revoked is not None and claims.get("iat", 0) <= revoked[0]:
+                return True
+
+        return False
+
+    def _maybe_prune(self):
+        # Must be called holding the lock. Revocations are rare, so pruning on
+        # the way out of one costs the requests nothing
+        now = time.time()
+        if now < self._next_prune and len(self) < self._filter_capacity:
+            return
+        self._next_prune = now + self.prune_interval
+
+        self._tokens = {jti: exp for jti, exp in self._tokens.items() if exp > now}
+        self._subjects = {sub: entry for sub, entry in self._subjects.items() if entry[1] > now}
+
+        # Size the new filters for what's left, if that's more than we planned for
+        self._filter_capacity = max(self.capacity, 2 * len(self))
+        token_filter = BloomFilter(self._filter_capacity, self.error_rate)
+        for jti in self._tokens:
+            token_filter.add(jti)
+        subject_filter = BloomFilter(self._filter_capacity, self.error_rate)
+        for sub in self._subjects:
+            subject_filter.add(sub)
+        # Swap them in whole, readers never see a half-built filter
+        self._token_filter = token_filter
+        self._subject_filter = subject_filter
+
+    def __len__(self):
+        return len(self._tokens) + len(self._subjects)
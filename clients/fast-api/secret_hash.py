@@ -0,0 +1,42 @@
+"""
+Compute the SECRET_HASH Cognito wants with each login, for app clients with a secret.
+
+The hash is an HMAC-SHA256, keyed with the client secret, of the username
+followed by the client ID. Keying an HMAC does real work (hashing the key into
+its inner and outer states), so we do that once per app client and copy the
+keyed state for each login, instead of starting from scratch every time.
+
+See https://docs.aws.amazon.com/cognito/latest/developerguide/signing-up-users-in-your-app.html#cognito-user-pools-computing-secret-hash
+"""
+
+import base64
+import hashlib
+import hmac
+
+
+class SecretHasher:
+    """The secret hash for one app client."""
+
+    def __init__(self, client_id, client_secret):
+        self.client_id = client_id
+        self._client_id = client_id.encode()
+        self._keyed = hmac.new(client_secret.encode(), digestmod=hashlib.sha256)
+
+    def __call__(self, username):
+        mac = self._keyed.copy()
+        mac.update(username.encode())
+        mac.update(self._client_id)
+        return base64.b64encode(mac.digest()).decode()
+
+
+class SecretHashes:
+    """Secret hashers for any number of app clients, by client ID."""
+
+    def __init__(self):
+        self._hashers = {}
+
+    def register(self, client_id, client_secret):
+        self._hashers[client_id] = SecretHasher(client_id, client_secret)
+
+    def __call__(self, username, client_id):
+        return self._hashers[client_id](username)
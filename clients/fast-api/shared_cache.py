@@ -0,0 +1,191 @@
+"""
+A cache shared by every worker process on a host, in a memory-mapped file.
+
+With N uvicorn/gunicorn workers, each would otherwise verify every token (and
+fetch the signing keys) for itself, and hold its own copy of the results.
+Put the file somewhere in memory, like /dev/shm, and they share them instead.
+
+The file holds:
+
+* a header, describing the layout
+* the latest JWKS document, and when it was fetched
+* a table of verified tokens: fixed-size slots, indexed by the token digest
+
+Reads never take a lock. Every region starts with a sequence number which a
+writer makes odd while it's writing, and even again when it's done (a
+"seqlock"). A reader checks the number before and after copying the region,
+and treats a change (or an odd number) as a miss. Writes are rare - a token
+we haven't seen before, or a key refresh - and take an exclusive `flock` on
+the file, so writers in different processes don't interleave.
+
+A file laid out differently (by another version, or other settings) is never
+resized, as that would crash the workers which have it mapped. We replace it
+with a new file instead, and they carry on with the old one until they restart.
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+
+MAGIC = b"CGSC"
+VERSION = 1
+
+# magic, version, slot count, slot size, JWKS region size
+HEADER = struct.Struct("<4sIIII")
+HEADER_SIZE = 64
+
+# sequence, fetched at, length - followed by the JWKS JSON
+JWKS_HEADER = struct.Struct("<QdI")
+
+# sequence, token digest, expires at, length - followed by the entry JSON
+SLOT_HEADER = struct.Struct("<Q32sdI")
+
+SEQUENCE = struct.Struct("<Q")
+
+
+class SharedCache:
+
+    def __init__(self, path, slots=8192, slot_size=4096, jwks_size=64 * 1024):
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.jwks_size = jwks_size
+        self.size = HEADER_SIZE + jwks_size + slots * slot_size
+
+        self._fd = self._open()
+        self._mm = mmap.mmap(self._fd, self.size)
+
+    def _open(self):
+        """Open the file, setting it up if it's new, or replacing it if it's laid out differently."""
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                ready = self._set_up(fd)
+            except BaseException:
+                os.close(fd)
+                raise
+            if ready:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                return fd
+            # Closing it releases the lock
+            os.close(fd)
+
+    def _set_up(self, fd):
+        """Check the file we've opened (and locked) is ready to map, or return False to open it again."""
+        try:
+            if os.stat(self.path).st_ino != os.fstat(fd).st_ino:
+                # Another worker replaced the file while we waited for the lock
+                return False
+        except FileNotFoundError:
+            return False
+
+        expected = HEADER.pack(MAGIC, VERSION, self.slots, self.slot_size, self.jwks_size)
+        size = os.fstat(fd).st_size
+        if size == 0:
+            # A new file. Only the pages we touch take up any memory
+            os.ftruncate(fd, self.size)
+            os.pwrite(fd, expected, 0)
+            return True
+        if size == self.size and os.pread(fd, HEADER.size, 0) == expected:
+            return True
+
+        # Laid out differently. Shrinking it would crash the workers which have
+        # it mapped (with a SIGBUS), so we leave it to them and start a new file
+        print(f"Replacing {self.path}, which was laid out differently")
+        os.unlink(self.path)
+        return False
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _read(self, offset, size):
+        """Copy a region, or return None if it was being written while we read it."""
+        before = SEQUENCE.unpack_from(self._mm, offset)[0]
+        if before % 2:
+            return None
+        data = self._mm[offset:offset + size]
+        if SEQUENCE.unpack_from(self._mm, offset)[0] != before:
+            return None
+        return data
+
+    def _write(self, offset, data):
+        """Write a region (after its sequence number). Must hold the lock."""
+        sequence = SEQUENCE.unpack_from(self._mm, offset)[0]
+        SEQUENCE.pack_into(self._mm, offset, sequence + 1)
+        self._mm[offset + SEQUENCE.size:offset + SEQUENCE.size + len(data)] = data
+        SEQUENCE.pack_into(self._mm, offset, sequence + 2)
+
+    # The signing keys
+
+    def get_jwks(self):
+        """Return the shared JWKS and when it was fetched, or (None, 0)."""
+        # The header and the document in one read, so the length goes with the document
+        data = self._read(HEADER_SIZE, self.jwks_size)
+        if data is None:
+            return None, 0
+        _, fetched_at, length = JWKS_HEADER.unpack_from(data)
+        if not length or JWKS_HEADER.size + length > self.jwks_size:
+            return None, 0
+
+        try:
+            return json.loads(data[JWKS_HEADER.size:JWKS_HEADER.size + length]), fetched_at
+        except ValueError:
+            return None, 0
+
+    def set_jwks(self, jwks, fetched_at=None):
+        data = json.dumps(jwks).encode()
+        if JWKS_HEADER.size + len(data) > self.jwks_size:
+            return
+
+        body = JWKS_HEADER.pack(0, fetched_at or time.time(), len(data))[SEQUENCE.size:] + data
+        with self._locked():
+            self._write(HEADER_SIZE, body)
+
+    # Verified tokens
+
+    def _slot_offset(self, digest):
+        index = int.from_bytes(digest[:8], "little") % self.slots
+        return HEADER_SIZE + self.jwks_size + index * self.slot_size
+
+    def get(self, digest):
+        """Return the entry stored for a token digest, or None."""
+        offset = self._slot_offset(digest)
+        data = self._read(offset, self.slot_size)
+        if data is None:
+            return None
+
+        _, stored_digest, expires_at, length = SLOT_HEADER.unpack_from(data)
+        if stored_digest != digest or expires_at <= time.time() or SLOT_HEADER.size + length > self.slot_size:
+            return None
+        try:
+            return json.loads(data[SLOT_HEADER.size:SLOT_HEADER.size + length])
+        except ValueError:
+            return None
+
+    def set(self, digest, entry, expires_at):
+        """Store a JSON-serializable entry for a token digest, until `expires_at`.
+
+        Each digest maps to one slot, so this replaces whatever was in it.
+        Entries too big for a slot aren't stored.
+        """
+        data = json.dumps(entry, separators=(",", ":")).encode()
+        if SLOT_HEADER.size + len(data) > self.slot_size:
+            return
+
+        body = SLOT_HEADER.pack(0, digest, expires_at, len(data))[SEQUENCE.size:] + data
+        with self._locked():
+            self._write(self._slot_offset(digest), body)
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
@@ -0,0 +1,9 @@
+import os
+
+# config.py insists on these, but nothing under test talks to Cognito
+os.environ.setdefault("COGNITO_CLIENT_ID", "testclientid")
+os.environ.setdefault("COGNITO_CLIENT_SECRET", "testclientsecret")
+os.environ.setdefault("COGNITO_USER_POOL_ID", "eu-west-1_Test")
+os.environ.setdefault("REDIRECT_URI", "http://localhost:8000/callbacks/cognito/login")
+os.environ.setdefault("HOSTEDUIPATH", "http://localhost:9229")
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
@@ -0,0 +1,191 @@
+import asyncio
+
+import pytest
+from botocore.exceptions import ClientError
+
+import cognito
+from cognito import AdaptiveLimit, AsyncCognitoClient, CognitoBusy, CognitoThrottled, TokenBucket
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cognito.time, "monotonic", clock)
+    return clock
+
+
+def client_error(code, status=400):
+    return ClientError(
+        {"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        "InitiateAuth",
+    )
+
+
+class FakeClient:
+    """Stands in for the boto3 client, answering each call with the next of `outcomes`."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def initiate_auth(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else {"AuthenticationResult": {}}
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def make_client(*outcomes, **kwargs):
+    client = AsyncCognitoClient(region_name="eu-west-1", retry_base_delay=0, **kwargs)
+    client.client = FakeClient(*outcomes)
+    return client
+
+
+# The token bucket
+
+def test_bucket_allows_a_burst_then_refuses(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    assert [bucket.try_take() for _ in range(3)] == [0, 0, 0]
+    # Empty, and refilling at 2 a second
+    assert bucket.try_take() == pytest.approx(0.5)
+
+
+def test_bucket_refills(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        bucket.try_take()
+
+    clock.now += 0.5
+    assert bucket.try_take() == 0
+    assert bucket.try_take() == pytest.approx(0.5)
+
+    # Never past the burst, however long we wait
+    clock.now += 60
+    assert [bucket.try_take() for _ in range(4)][-1] > 0
+
+
+def test_bucket_rates_below_one_a_second(clock):
+    bucket = TokenBucket(rate=0.5, burst=1)
+    assert bucket.try_take() == 0
+    assert bucket.try_take() == pytest.approx(2)
+
+
+def test_bucket_needs_room_for_a_whole_token():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0.5, burst=0.5)
+
+
+# The adaptive concurrency limit
+
+def test_limit_halves_down_to_the_minimum():
+    limit = AdaptiveLimit(max_limit=8, min_limit=1)
+
+    limit.throttled()
+    assert limit.limit == 4
+    for _ in range(10):
+        limit.throttled()
+    assert limit.limit == 1
+
+
+def test_limit_grows_back_to_the_maximum():
+    limit = AdaptiveLimit(max_limit=8)
+    limit.throttled()
+    limit.throttled()
+
+    # Back up by one for every `limit` successes
+    for _ in range(2):
+        limit.succeeded()
+    assert limit.limit == pytest.approx(3, abs=0.2)
+    for _ in range(100):
+        limit.succeeded()
+    assert limit.limit == 8
+
+
+def test_limit_holds_calls_over_it():
+    limit = AdaptiveLimit(max_limit=2)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with limit:
+            peak = max(peak, limit.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert limit.in_flight == 0
+
+
+# Calling Cognito
+
+def test_calls_cognito():
+    client = make_client({"AuthenticationResult": {"IdToken": "id"}})
+    assert asyncio.run(client.initiate_auth(AuthFlow="USER_PASSWORD_AUTH")) == {"AuthenticationResult": {"IdToken": "id"}}
+
+
+@pytest.mark.parametrize("error", [
+    client_error("TooManyRequestsException"),
+    client_error("SomethingElse", status=429),
+    client_error("ServiceUnavailable", status=503),
+])
+def test_retries_when_throttled(error):
+    client = make_client(error, {"AuthenticationResult": {}}, max_retries=2)
+
+    assert asyncio.run(client.initiate_auth()) == {"AuthenticationResult": {}}
+    assert client.client.calls == 2
+    # Halved by the throttling, then back up a little
+    assert client._concurrency.limit == pytest.approx(5.2)
+
+
+def test_gives_up_after_max_retries():
+    client = make_client(*[client_error("TooManyRequestsException")] * 5, max_retries=2)
+
+    with pytest.raises(CognitoThrottled):
+        asyncio.run(client.initiate_auth())
+    assert client.client.calls == 3
+    assert client._concurrency.limit == 10 / 8
+
+
+def test_other_errors_are_not_retried():
+    client = make_client(client_error("NotAuthorizedException"))
+
+    with pytest.raises(ClientError):
+        asyncio.run(client.initiate_auth())
+    assert client.client.calls == 1
+    assert client._concurrency.limit == 10
+
+
+def test_refuses_calls_over_the_rate_limit(clock):
+    client = make_client(rate_limit=1, burst=2)
+
+    async def main():
+        await client.initiate_auth()
+        await client.initiate_auth()
+        await client.initiate_auth()
+
+    with pytest.raises(CognitoThrottled) as e:
+        asyncio.run(main())
+    assert e.value.retry_after == pytest.approx(1)
+    assert client.client.calls == 2
+
+
+def test_refuses_calls_when_too_many_are_pending():
+    client = make_client(max_pending=0)
+
+    with pytest.raises(CognitoBusy):
+        asyncio.run(client.initiate_auth())
+    assert client.client.calls == 0
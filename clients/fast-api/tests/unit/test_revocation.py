@@ -0,0 +1,157 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import revocation
+from revocation import BloomFilter, RevocationList
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(revocation.time, "time", clock)
+    return clock
+
+
+def claims(jti="token-1", sub="user-1", iat=None, exp=None):
+    now = int(time.time())
+    return {"jti": jti, "sub": sub, "iat": iat or now - 10, "exp": exp or now + 3600}
+
+
+# The Bloom filter
+
+def test_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f"item-{i}")
+    assert all(f"item-{i}" in bloom for i in range(1000))
+
+
+def test_filter_false_positive_rate():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f"item-{i}")
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+# Revoking tokens
+
+def test_revoked_token_is_rejected(clock):
+    revocations = RevocationList()
+    token = claims()
+    revocations.revoke_token(token["jti"], token["exp"])
+
+    assert revocations.is_revoked(token)
+    assert not revocations.is_revoked(claims(jti="token-2"))
+
+
+def test_revoked_token_expires(clock):
+    revocations = RevocationList()
+    token = claims(exp=int(clock.now) + 60)
+    revocations.revoke_token(token["jti"], token["exp"])
+
+    clock.now += 61
+    assert not revocations.is_revoked(token)
+
+
+def test_revoked_subject_rejects_earlier_tokens(clock):
+    revocations = RevocationList()
+    earlier = claims(jti="token-1", iat=int(clock.now) - 10)
+    revocations.revoke_subject("user-1", max_token_lifetime=3600)
+
+    assert revocations.is_revoked(earlier)
+    # Logging in again afterwards works
+    assert not revocations.is_revoked(claims(jti="token-2", iat=int(clock.now) + 1))
+    assert not revocations.is_revoked(claims(jti="token-3", sub="user-2"))
+
+
+def test_tokens_without_the_claims_are_not_revoked():
+    revocations = RevocationList()
+    revocations.revoke_token("token-1", time.time() + 60)
+    revocations.revoke_subject("user-1", 3600)
+    assert not revocations.is_revoked({})
+
+
+def test_pruning_drops_expired_entries(clock):
+    revocations = RevocationList(prune_interval=60)
+    revocations.revoke_token("token-1", clock.now + 30)
+    revocations.revoke_subject("user-1", max_token_lifetime=30)
+    assert len(revocations) == 2
+
+    clock.now += 61
+    revocations.revoke_token("token-2", clock.now + 3600)
+    assert len(revocations) == 1
+    assert "token-1" not in revocations._tokens
+    assert revocations.is_revoked(claims(jti="token-2"))
+
+
+def test_grows_past_its_capacity(clock):
+    revocations = RevocationList(capacity=10, prune_interval=3600)
+    for i in range(100):
+        revocations.revoke_token(f"token-{i}", clock.now + 3600)
+
+    assert len(revocations) == 100
+    assert all(revocations.is_revoked(claims(jti=f"token-{i}")) for i in range(100))
+    assert revocations._filter_capacity >= 100
+
+
+# Logging out
+
+@pytest.fixture
+def app(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "revocations", RevocationList())
+
+    def authenticate(token):
+        access = claims(jti=f"jti-{token}", sub="user-1")
+        access.update(iss=main.issuer, username="user-1")
+        return main.User(username="user-1", email="user-1@example.com"), {"access": access, "id": {}}
+
+    monkeypatch.setattr(main, "authenticate", authenticate)
+    return main
+
+
+def test_logout_revokes_the_token(app):
+    client = TestClient(app.app)
+
+    response = client.post("/logout", headers={"Authorization": "Bearer one"})
+    assert response.status_code == 204
+
+    with pytest.raises(HTTPException) as e:
+        app.current_session("one")
+    assert e.value.detail == "Revoked token"
+    # Their other sessions carry on
+    assert app.current_session("two")[0].username == "user-1"
+
+    assert client.post("/logout", headers={"Authorization": "Bearer one"}).status_code == 401
+
+
+def test_logout_everywhere_revokes_every_token(app, monkeypatch):
+    calls = []
+
+    async def call(operation, **kwargs):
+        calls.append((operation, kwargs["Username"]))
+
+    monkeypatch.setattr(app.cognito_client, "call", call)
+    client = TestClient(app.app)
+
+    response = client.post("/logout?everywhere=true", headers={"Authorization": "Bearer one"})
+    assert response.status_code == 204
+    assert calls == [("admin_user_global_sign_out", "user-1")]
+
+    for token in ("one", "two"):
+        with pytest.raises(HTTPException):
+            app.current_session(token)
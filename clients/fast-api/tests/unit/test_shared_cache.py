@@ -0,0 +1,135 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+from shared_cache import HEADER_SIZE, JWKS_HEADER, SEQUENCE, SLOT_HEADER, SharedCache
+
+
+def digest(token):
+    return hashlib.sha256(token.encode()).digest()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cache")
+
+
+@pytest.fixture
+def cache(path):
+    cache = SharedCache(path, slots=16, slot_size=256, jwks_size=1024)
+    yield cache
+    cache.close()
+
+
+def test_round_trip(cache):
+    cache.set(digest("a"), {"sub": "user-1"}, time.time() + 60)
+    assert cache.get(digest("a")) == {"sub": "user-1"}
+    assert cache.get(digest("b")) is None
+
+
+def test_shared_between_instances(cache, path):
+    other = SharedCache(path, slots=16, slot_size=256, jwks_size=1024)
+    try:
+        cache.set(digest("a"), {"sub": "user-1"}, time.time() + 60)
+        assert other.get(digest("a")) == {"sub": "user-1"}
+    finally:
+        other.close()
+
+
+def test_expired_entries_miss(cache):
+    cache.set(digest("a"), {"sub": "user-1"}, time.time() - 1)
+    assert cache.get(digest("a")) is None
+
+
+def test_entries_too_big_are_not_stored(cache):
+    cache.set(digest("a"), {"sub": "x" * 1000}, time.time() + 60)
+    assert cache.get(digest("a")) is None
+
+
+def test_jwks_round_trip(cache):
+    assert cache.get_jwks() == (None, 0)
+    cache.set_jwks({"keys": [{"kid": "a"}]}, fetched_at=1234.0)
+    assert cache.get_jwks() == ({"keys": [{"kid": "a"}]}, 1234.0)
+
+
+def test_jwks_replaced_by_a_shorter_one(cache):
+    cache.set_jwks({"keys": [{"kid": "a" * 100}]}, fetched_at=1.0)
+    cache.set_jwks({"keys": []}, fetched_at=2.0)
+    assert cache.get_jwks() == ({"keys": []}, 2.0)
+
+
+def test_read_during_a_write_misses(cache):
+    cache.set(digest("a"), {"sub": "user-1"}, time.time() + 60)
+    cache.set_jwks({"keys": []})
+
+    # A writer makes the sequence odd while it's writing
+    offset = cache._slot_offset(digest("a"))
+    SEQUENCE.pack_into(cache._mm, offset, SEQUENCE.unpack_from(cache._mm, offset)[0] + 1)
+    SEQUENCE.pack_into(cache._mm, HEADER_SIZE, SEQUENCE.unpack_from(cache._mm, HEADER_SIZE)[0] + 1)
+
+    assert cache.get(digest("a")) is None
+    assert cache.get_jwks() == (None, 0)
+
+
+def test_corrupt_entries_miss(cache):
+    cache.set(digest("a"), {"sub": "user-1"}, time.time() + 60)
+    offset = cache._slot_offset(digest("a"))
+    cache._mm[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + 4] = b"\xff{{{"
+    assert cache.get(digest("a")) is None
+
+    # A length running past the slot
+    with cache._locked():
+        cache._write(offset, SLOT_HEADER.pack(0, digest("a"), time.time() + 60, 10000)[SEQUENCE.size:])
+    assert cache.get(digest("a")) is None
+
+
+def test_corrupt_jwks_misses(cache):
+    cache.set_jwks({"keys": []})
+    cache._mm[HEADER_SIZE + JWKS_HEADER.size] = ord("!")
+    assert cache.get_jwks() == (None, 0)
+
+    with cache._locked():
+        cache._write(HEADER_SIZE, JWKS_HEADER.pack(0, time.time(), 10000)[SEQUENCE.size:])
+    assert cache.get_jwks() == (None, 0)
+
+
+def test_layout_mismatch_starts_a_new_file(cache, path):
+    cache.set(digest("a"), {"sub": "user-1"}, time.time() + 60)
+    cache.set_jwks({"keys": []}, fetched_at=1.0)
+
+    other = SharedCache(path, slots=32, slot_size=256, jwks_size=1024)
+    try:
+        assert other.get(digest("a")) is None
+        assert os.path.getsize(path) == other.size
+
+        # The file we had mapped is left alone, so reading it doesn't crash (SIGBUS)
+        assert cache.get(digest("a")) == {"sub": "user-1"}
+        assert cache.get_jwks() == ({"keys": []}, 1.0)
+        assert os.fstat(cache._fd).st_size == cache.size
+    finally:
+        other.close()
+
+
+def test_reuses_a_file_laid_out_the_same(cache, path):
+    cache.set(digest("a"), {"sub": "user-1"}, time.time() + 60)
+    inode = os.stat(path).st_ino
+
+    other = SharedCache(path, slots=16, slot_size=256, jwks_size=1024)
+    try:
+        assert os.stat(path).st_ino == inode
+        assert other.get(digest("a")) == {"sub": "user-1"}
+    finally:
+        other.close()
+
+
+def test_a_truncated_file_is_replaced(path):
+    with open(path, "wb") as f:
+        f.write(b"CGSC")
+    cache = SharedCache(path, slots=16, slot_size=256, jwks_size=1024)
+    try:
+        assert os.path.getsize(path) == cache.size
+        assert cache.get_jwks() == (None, 0)
+    finally:
+        cache.close()
@@ -0,0 +1,112 @@
+import base64
+import json
+from pathlib import Path
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import token_parser
+from token_parser import MalformedToken, parse_combined, parse_token
+
+DELIMITER = "++++++"
+
+signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def segment(value):
+    raw = value if isinstance(value, bytes) else json.dumps(value).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def make_token(**claims):
+    return jwt.encode({"sub": "user-1", **claims}, signing_key, algorithm="RS256", headers={"kid": "test-kid"})
+
+
+def test_parses_like_pyjwt():
+    token = make_token(exp=2000000000, groups=["a", "b"])
+    parsed = parse_token(token)
+
+    assert parsed.header == jwt.get_unverified_header(token)
+    assert parsed.claims == jwt.decode(token, options={"verify_signature": False})
+    assert parsed.signing_input == token.rsplit(".", 1)[0].encode()
+    assert parsed.signature == base64.urlsafe_b64decode(token.rsplit(".", 1)[1] + "==")
+
+
+def test_decodes_lazily():
+    # Only the shape is checked up front, so a bad payload isn't noticed until it's read
+    parsed = parse_token(f"{segment({'alg': 'RS256'})}.!!!.c2ln")
+    assert parsed.header == {"alg": "RS256"}
+    with pytest.raises(MalformedToken):
+        parsed.claims
+
+
+@pytest.mark.parametrize("token", [
+    "",
+    "abc",
+    "a.b",
+    "a.b.c.d",
+    ".b.c",
+    "a..c",
+    "a.b.",
+    "a.b.cé",
+    "a" * (token_parser.MAX_TOKEN_LENGTH - 3) + ".b.c",
+])
+def test_rejects_the_wrong_shape(token):
+    with pytest.raises(MalformedToken):
+        parse_token(token)
+
+
+@pytest.mark.parametrize("bad", [segment(b"not json"), segment([1, 2]), segment("a string"), "a", "!!!"])
+@pytest.mark.parametrize("part", ["header", "claims"])
+def test_rejects_bad_segments(part, bad):
+    header, payload = (bad, segment({})) if part == "header" else (segment({}), bad)
+    parsed = parse_token(f"{header}.{payload}.c2ln")
+
+    with pytest.raises(MalformedToken):
+        getattr(parsed, part)
+    # The other part still decodes
+    assert getattr(parsed, "claims" if part == "header" else "header") == {}
+
+
+def test_malformed_tokens_are_decode_errors():
+    # So anything which catches PyJWT's errors catches ours
+    assert issubclass(MalformedToken, jwt.DecodeError)
+
+
+def test_max_length():
+    token = make_token()
+    assert parse_token(token, max_length=len(token)).claims["sub"] == "user-1"
+    with pytest.raises(MalformedToken):
+        parse_token(token, max_length=len(token) - 1)
+
+
+def test_parse_combined():
+    access_token, id_token = make_token(token_use="access"), make_token(token_use="id")
+    access, id_ = parse_combined(f"{access_token}{DELIMITER}{id_token}", DELIMITER)
+    assert (access.token, id_.token) == (access_token, id_token)
+    assert (access.claims["token_use"], id_.claims["token_use"]) == ("access", "id")
+
+
+@pytest.mark.parametrize("combined", [
+    "a.b.c",
+    f"a.b.c{DELIMITER}a.b.c{DELIMITER}a.b.c",
+    f"a.b.c{DELIMITER}",
+    f"a.b.c{DELIMITER}a.b",
+])
+def test_parse_combined_rejects_the_wrong_shape(combined):
+    with pytest.raises(MalformedToken):
+        parse_combined(combined, DELIMITER)
+
+
+def test_parse_combined_max_length():
+    token = make_token()
+    combined = f"{token}{DELIMITER}{token}"
+    assert len(parse_combined(combined, DELIMITER, max_length=len(token))) == 2
+    with pytest.raises(MalformedToken):
+        parse_combined(combined + "x", DELIMITER, max_length=len(token))
+
+
+def test_the_flask_client_has_the_same_copy():
+    flask_copy = Path(__file__).parents[3] / "python-flask" / "token_parser.py"
+    assert flask_copy.read_text() == Path(token_parser.__file__).read_text()
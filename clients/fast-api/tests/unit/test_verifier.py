@@ -0,0 +1,275 @@
+import json
+import os
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from token_parser import MalformedToken, parse_token
+from verifier import InvalidTokenUse, JwksCache, TokenVerifier, UnknownIssuer, UnknownSigningKey, VerifierRegistry
+
+ISSUER = "https://cognito-idp.eu-west-1.amazonaws.com/eu-west-1_Test"
+OTHER_ISSUER = "https://cognito-idp.eu-west-1.amazonaws.com/eu-west-1_Other"
+CLIENT_ID = "testclientid"
+
+signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def jwks(key, kid="test-kid"):
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+    jwk.update(kid=kid, alg="RS256", use="sig")
+    return {"keys": [jwk]}
+
+
+def make_token(token_use="access", client_id=CLIENT_ID, issuer=ISSUER, key=signing_key, kid="test-kid",
+               lifetime=3600, algorithm="RS256", headers=None, without=(), **claims):
+    now = int(time.time())
+    payload = {"sub": "user-1", "iss": issuer, "token_use": token_use, "iat": now, "exp": now + lifetime}
+    if token_use == "id":
+        payload.update({"aud": client_id, "cognito:username": "user-1"})
+    else:
+        payload.update({"client_id": client_id, "username": "user-1"})
+    payload.update(claims)
+    for claim in without:
+        del payload[claim]
+    # Signed as raw bytes, so PyJWT doesn't check (or refuse) the claims we make up
+    return jwt.api_jws.encode(
+        json.dumps(payload).encode(), key, algorithm=algorithm, headers={"kid": kid, **(headers or {})},
+    )
+
+
+def keys_for(issuer, key=signing_key):
+    keys = JwksCache(f"{issuer}/.well-known/jwks.json")
+    keys.load(jwks(key))
+    return keys
+
+
+@pytest.fixture(autouse=True)
+def refreshes(monkeypatch):
+    """Keep the unit tests offline: record the key refreshes we'd start, rather than fetching anything."""
+    refreshes = []
+    monkeypatch.setattr(JwksCache, "refresh_in_background", lambda self: refreshes.append(self.jwks_url))
+
+    def fetch(self):
+        raise OSError("No fetching keys in the unit tests")
+
+    monkeypatch.setattr(JwksCache, "fetch", fetch)
+    return refreshes
+
+
+@pytest.fixture
+def registry():
+    return VerifierRegistry(TokenVerifier(ISSUER, [CLIENT_ID], keys_for(ISSUER)))
+
+
+@pytest.mark.parametrize("token_use", ["access", "id"])
+def test_default_pool(registry, token_use):
+    claims = registry.verify(parse_token(make_token(token_use)), token_use)
+    assert claims["sub"] == "user-1"
+
+
+@pytest.mark.parametrize("token_use", ["access", "id"])
+def test_extra_client_for_the_default_pool(registry, token_use):
+    token = parse_token(make_token(token_use, client_id="extraclientid"))
+    with pytest.raises(InvalidTokenUse if token_use == "access" else jwt.InvalidAudienceError):
+        registry.verify(token, token_use)
+
+    registry.load([{"user_pool_id": "eu-west-1_Test", "client_ids": ["extraclientid"]}])
+
+    assert registry.verify(token, token_use)["sub"] == "user-1"
+    # The app's own client still works too
+    assert registry.verify(parse_token(make_token(token_use)), token_use)["sub"] == "user-1"
+
+
+def test_tenant_pool(registry):
+    registry.load([{"user_pool_id": "eu-west-1_Other", "client_ids": ["otherclientid"]}])
+    # Not started, so load the tenant's keys ourselves
+    registry._verifiers[OTHER_ISSUER].jwks.load(jwks(signing_key))
+
+    token = parse_token(make_token(client_id="otherclientid", issuer=OTHER_ISSUER))
+    assert registry.verify(token, "access")["iss"] == OTHER_ISSUER
+
+    # Each pool only accepts its own app clients
+    with pytest.raises(InvalidTokenUse):
+        registry.verify(parse_token(make_token(client_id=CLIENT_ID, issuer=OTHER_ISSUER)), "access")
+
+
+@pytest.mark.parametrize("issuer", [OTHER_ISSUER, 42, None])
+def test_unknown_issuer(registry, issuer):
+    with pytest.raises(UnknownIssuer):
+        registry.verify(parse_token(make_token(issuer=issuer)), "access")
+
+
+def test_removed_tenant(registry):
+    registry.load([{"user_pool_id": "eu-west-1_Test", "client_ids": ["extraclientid"]}])
+    registry.load([])
+
+    with pytest.raises(InvalidTokenUse):
+        registry.verify(parse_token(make_token(client_id="extraclientid")), "access")
+    assert registry.verify(parse_token(make_token()), "access")["sub"] == "user-1"
+
+
+def write_tenants(path, tenants, mtime_ns):
+    path.write_text(json.dumps(tenants))
+    # Stamped explicitly, so a rewrite within the filesystem's timestamp resolution still counts as a change
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.mark.parametrize("tenants", [
+    "not json",
+    [],
+    {},
+    {"tenants": {}},
+    {"tenants": {"eu-west-1_Other": ["otherclientid"]}},
+    {"tenants": ["eu-west-1_Other"]},
+    {"tenants": [{"client_ids": ["otherclientid"]}]},
+    {"tenants": [{"user_pool_id": "eu-west-1_Other"}]},
+    {"tenants": [{"user_pool_id": "eu-west-1_Other", "client_ids": "otherclientid"}]},
+    {"tenants": [{"user_pool_id": 1, "client_ids": ["otherclientid"]}]},
+    {"tenants": [{"issuer": ["x"], "client_ids": ["otherclientid"]}]},
+])
+def test_malformed_tenants_file_keeps_the_tenants(tmp_path, tenants):
+    path = tmp_path / "tenants.json"
+    registry = VerifierRegistry(TokenVerifier(ISSUER, [CLIENT_ID], keys_for(ISSUER)), tenants_file=str(path))
+    write_tenants(path, {"tenants": [{"user_pool_id": "eu-west-1_Other", "client_ids": ["otherclientid"]}]}, 1)
+    assert registry.reload_if_changed()
+    verifiers = registry._verifiers
+
+    if isinstance(tenants, str):
+        path.write_text(tenants)
+        os.utime(path, ns=(2, 2))
+    else:
+        write_tenants(path, tenants, 2)
+    assert not registry.reload_if_changed()
+    assert registry._verifiers is verifiers
+    assert set(verifiers) == {ISSUER, OTHER_ISSUER}
+
+    # And a fixed file is picked up
+    write_tenants(path, {"tenants": []}, 3)
+    assert registry.reload_if_changed()
+    assert set(registry._verifiers) == {ISSUER}
+
+
+def test_watcher_survives_a_failed_reload(monkeypatch):
+    registry = VerifierRegistry(TokenVerifier(ISSUER, [CLIENT_ID], keys_for(ISSUER)), tenants_file="tenants.json",
+                                reload_interval=0.01)
+    reloads = []
+
+    def reload_if_changed():
+        reloads.append(1)
+        if len(reloads) == 1:
+            raise RuntimeError("Something we didn't expect")
+        if len(reloads) == 3:
+            registry._stopped.set()
+        return False
+
+    monkeypatch.setattr(registry, "reload_if_changed", reload_if_changed)
+    registry._watch()
+    assert len(reloads) == 3
+
+
+def test_unknown_kid_refreshes_the_keys(verifier, refreshes):
+    with pytest.raises(UnknownSigningKey):
+        verifier.verify(parse_token(make_token(kid="unknown-kid")), "access")
+    assert refreshes == [f"{ISSUER}/.well-known/jwks.json"]
+
+
+def pyjwt_verify(verifier, token, token_use):
+    """How we verified tokens with `jwt.decode`, which TokenVerifier.verify has to agree with."""
+    key = verifier.jwks.get(jwt.get_unverified_header(token).get("kid"))
+    if key is None:
+        raise UnknownSigningKey("Unknown signing key")
+
+    claims = jwt.decode(
+        token,
+        key,
+        algorithms=["RS256"],
+        issuer=verifier.issuer,
+        audience=list(verifier.client_ids) if token_use == "id" else None,
+        options={"require": ["exp", "iss", "token_use"], "verify_aud": token_use == "id"},
+    )
+    if claims["token_use"] != token_use:
+        raise InvalidTokenUse(f"Expected an {token_use} token")
+    if token_use == "access" and claims.get("client_id") not in verifier.client_ids:
+        raise InvalidTokenUse("Token was issued to a different client")
+    return claims
+
+
+@pytest.fixture
+def verifier():
+    return TokenVerifier(ISSUER, [CLIENT_ID, "extraclientid"], keys_for(ISSUER))
+
+
+@pytest.mark.parametrize("token_use, token", [
+    ("access", make_token("access")),
+    ("id", make_token("id")),
+    ("id", make_token("id", aud=["someoneelse", CLIENT_ID])),
+    ("access", make_token("access", client_id="extraclientid")),
+    ("access", make_token("access", exp=int(time.time()) + 3600.5)),
+    ("access", make_token("access", nbf=int(time.time()) - 60)),
+    ("access", make_token("access", without=["iat"])),
+])
+def test_accepts_what_pyjwt_accepts(verifier, token_use, token):
+    assert verifier.verify(parse_token(token), token_use) == pyjwt_verify(verifier, token, token_use)
+
+
+@pytest.mark.parametrize("token_use, token, error", [
+    # The header
+    ("access", make_token(algorithm="HS256", key="a-shared-secret-long-enough-for-sha256"), jwt.InvalidAlgorithmError),
+    ("access", make_token(algorithm="RS512"), jwt.InvalidAlgorithmError),
+    # Unsigned, so there are only two segments to it
+    ("access", make_token(algorithm="none", key=None), MalformedToken),
+    ("access", make_token(headers={"crit": ["exp"]}), jwt.InvalidTokenError),
+    ("access", make_token(kid="unknown-kid"), UnknownSigningKey),
+    ("access", make_token(kid=""), UnknownSigningKey),
+    # The signature
+    ("access", make_token(key=other_key), jwt.InvalidSignatureError),
+    ("access", make_token()[:-4] + "AAAA", jwt.InvalidSignatureError),
+    # When it's valid
+    ("access", make_token(lifetime=-60), jwt.ExpiredSignatureError),
+    ("access", make_token(iat=int(time.time()) + 600), jwt.ImmatureSignatureError),
+    ("access", make_token(nbf=int(time.time()) + 600), jwt.ImmatureSignatureError),
+    ("access", make_token(exp=None), jwt.MissingRequiredClaimError),
+    ("access", make_token(without=["exp"]), jwt.MissingRequiredClaimError),
+    ("access", make_token(exp=True), jwt.DecodeError),
+    ("access", make_token(exp=[2000000000]), jwt.DecodeError),
+    ("access", make_token(exp=float("nan")), jwt.DecodeError),
+    ("access", make_token(iat="now"), jwt.InvalidIssuedAtError),
+    # Who it's from
+    ("access", make_token(issuer=OTHER_ISSUER), jwt.InvalidIssuerError),
+    ("access", make_token(without=["iss"]), jwt.MissingRequiredClaimError),
+    # What it's for
+    ("id", make_token("access"), InvalidTokenUse),
+    ("access", make_token("id"), InvalidTokenUse),
+    ("access", make_token(without=["token_use"]), jwt.MissingRequiredClaimError),
+    # Who it's for
+    ("id", make_token("id", client_id="someoneelse"), jwt.InvalidAudienceError),
+    ("id", make_token("id", aud=["someoneelse", "anotherone"]), jwt.InvalidAudienceError),
+    ("id", make_token("id", aud=[]), jwt.InvalidAudienceError),
+    ("id", make_token("id", aud=42), jwt.InvalidAudienceError),
+    ("id", make_token("id", aud=[42]), jwt.InvalidAudienceError),
+    ("id", make_token("id", without=["aud"]), jwt.MissingRequiredClaimError),
+    ("access", make_token(client_id="someoneelse"), InvalidTokenUse),
+    ("access", make_token(without=["client_id"]), InvalidTokenUse),
+])
+def test_rejects_what_pyjwt_rejects(verifier, token_use, token, error):
+    with pytest.raises(error):
+        verifier.verify(parse_token(token), token_use)
+    with pytest.raises(jwt.InvalidTokenError):
+        pyjwt_verify(verifier, token, token_use)
+
+
+@pytest.mark.parametrize("claim", ["exp", "iat", "nbf"])
+def test_time_claims_must_be_numbers(verifier, claim):
+    # PyJWT would take int("...") of these, but they're JSON numbers or nothing
+    token = make_token(**{claim: str(int(time.time()) + (3600 if claim == "exp" else -60))})
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(parse_token(token), "access")
+
+
+def test_client_id_must_be_a_string(verifier):
+    # Checking a list against the client IDs used to fail with a TypeError
+    with pytest.raises(InvalidTokenUse):
+        verifier.verify(parse_token(make_token(client_id=[CLIENT_ID])), "access")
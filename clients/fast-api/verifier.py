@@ -0,0 +1,360 @@
+"""
+Verify Cognito JWTs locally, against the public keys of the user pool.
+
+Cognito publishes the keys it signs tokens with as a JSON Web Key Set (JWKS) at
+`<issuer>/.well-known/jwks.json`. We fetch that once at startup, index the keys
+by their `kid` and keep them fresh from a background thread - so verifying a
+token on the request path never has to wait for a network call.
+
+The tokens come in already split up by `token_parser`, and we check the
+signature and claims ourselves (with PyJWT's RS256 implementation) so that
+none of the token is decoded twice.
+
+See https://docs.aws.amazon.com/cognito/latest/developerguide/amazon-cognito-user-pools-using-tokens-verifying-a-jwt.html
+"""
+
+import json
+import math
+import os
+import threading
+import time
+import urllib.request
+
+import jwt
+from jwt.algorithms import RSAAlgorithm
+
+import metrics
+
+RS256 = RSAAlgorithm(RSAAlgorithm.SHA256)
+
+
+class UnknownSigningKey(jwt.InvalidTokenError):
+    pass
+
+
+class InvalidTokenUse(jwt.InvalidTokenError):
+    pass
+
+
+def issuer_for_user_pool(user_pool_id):
+    """The `iss` claim Cognito puts in tokens for a user pool.
+
+    The region is the prefix of the user pool ID, e.g. `eu-west-1_AbCdEf123`.
+    """
+    region = user_pool_id.split("_", 1)[0]
+    return f"https://cognito-idp.{region}.amazonaws.com/{user_pool_id}"
+
+
+class JwksCache:
+    """The signing keys of one issuer, indexed by `kid`.
+
+    `get` never blocks: if it is asked for a key we don't know (which is what
+    happens when Cognito rotates its keys) it kicks off a background refresh
+    and returns None. Those on-demand refreshes are rate limited, so a flood
+    of tokens with made-up `kid`s can't turn into a flood of JWKS fetches.
+    """
+
+    def __init__(self, jwks_url, refresh_interval=3600, min_refresh_interval=30, timeout=5, shared=None):
+        self.jwks_url = jwks_url
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        # A SharedCache, to share the keys with the other workers on this host
+        self.shared = shared
+
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._last_attempt = 0.0
+        self._refreshing = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def load(self, jwks):
+        """Replace the cached keys with the ones in a JWKS document."""
+        keys = {}
+        for jwk in jwks.get("keys", []):
+            if jwk.get("kty") != "RSA" or "kid" not in jwk:
+                continue
+            keys[jwk["kid"]] = jwt.PyJWK(jwk, algorithm="RS256").key
+
+        # Swap the whole dict in one go, readers never see a half-built index
+        self._keys = keys
+
+    def fetch(self):
+        """Fetch the JWKS from Cognito and load it. This blocks."""
+        with urllib.request.urlopen(self.jwks_url, timeout=self.timeout) as response:
+            jwks = json.load(response)
+        self.load(jwks)
+        if self.shared is not None:
+            self.shared.set_jwks(jwks)
+
+    def load_shared(self, max_age):
+        """Load the keys another worker fetched in the last `max_age` seconds, if there are any."""
+        if self.shared is None:
+            return False
+        jwks, fetched_at = self.shared.get_jwks()
+        if jwks is None or time.time() - fetched_at > max_age:
+            return False
+        self.load(jwks)
+        return True
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, kid):
+        key = self._keys.get(kid)
+        if key is None:
+            self.refresh_in_background()
+        return key
+
+    def refresh_in_background(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._refreshing or now - self._last_attempt < self.min_refresh_interval:
+                return
+            self._refreshing = True
+            self._last_attempt = now
+
+        threading.Thread(target=self._refresh, args=(self.min_refresh_interval,), daemon=True).start()
+
+    def _refresh(self, max_shared_age):
+        try:
+            # Only one worker needs to fetch the keys, the rest pick them up from it
+            if self.load_shared(max_shared_age):
+                metrics.jwks_refreshes.inc("shared")
+            else:
+                self.fetch()
+                metrics.jwks_refreshes.inc("cognito")
+        except Exception as e:
+            # Keep serving the keys we have, we'll try again later
+            metrics.jwks_refreshes.inc("failed")
+            print(f"Failed to refresh JWKS from {self.jwks_url}: {e}")
+        finally:
+            self._refreshing = False
+
+    def start(self):
+        """Load the keys, then keep them fresh from a background thread."""
+        self._last_attempt = time.monotonic()
+        self._refresh(self.refresh_interval)
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._refresh_periodically, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _refresh_periodically(self):
+        while not self._stopped.wait(self.refresh_interval):
+            self._last_attempt = time.monotonic()
+            self._refresh(self.refresh_interval)
+
+
+class UnknownIssuer(jwt.InvalidIssuerError):
+    pass
+
+
+def numeric_date(claims, claim, error):
+    """A time claim, in seconds. Anything but a finite JSON number (a string, a bool, NaN) raises `error`."""
+    value = claims[claim]
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (
+        isinstance(value, float) and not math.isfinite(value)
+    ):
+        raise error(f"The {claim} claim must be a number")
+    return value
+
+
+class TokenVerifier:
+    """Verify the signature and claims of the tokens one user pool issues to its app clients."""
+
+    def __init__(self, issuer, client_ids, jwks):
+        self.issuer = issuer
+        self.client_ids = frozenset(client_ids)
+        self.jwks = jwks
+
+    def verify(self, token, token_use):
+        """Return the claims of `token`, a ParsedToken, or raise a `jwt.InvalidTokenError`.
+
+        `token_use` is "access" or "id". Only ID tokens carry an `aud` claim,
+        access tokens name the app client in `client_id` instead.
+        """
+        header = token.header
+        if header.get("alg") != "RS256":
+            raise jwt.InvalidAlgorithmError("The specified alg value is not allowed")
+        if "crit" in header:
+            # Extensions we'd have to understand to verify the token, which Cognito never uses
+            raise jwt.InvalidTokenError("Unsupported critical header")
+
+        kid = header.get("kid")
+        key = self.jwks.get(kid) if isinstance(kid, str) else None
+        if key is None:
+            raise UnknownSigningKey(f"Unknown signing key: {kid}")
+        if not RS256.verify(token.signing_input, key, token.signature):
+            raise jwt.InvalidSignatureError("Signature verification failed")
+
+        claims = token.claims
+        self.validate(claims, token_use)
+        return claims
+
+    def validate(self, claims, token_use):
+        """Check the claims of a token whose signature we've verified, as `jwt.decode` would."""
+        for claim in ("exp", "iss", "token_use"):
+            if claims.get(claim) is None:
+                raise jwt.MissingRequiredClaimError(claim)
+
+        now = time.time()
+        if numeric_date(claims, "exp", jwt.DecodeError) <= now:
+            raise jwt.ExpiredSignatureError("Signature has expired")
+        if "iat" in claims and numeric_date(claims, "iat", jwt.InvalidIssuedAtError) > now:
+            raise jwt.ImmatureSignatureError("The token is not yet valid (iat)")
+        if "nbf" in claims and numeric_date(claims, "nbf", jwt.DecodeError) > now:
+            raise jwt.ImmatureSignatureError("The token is not yet valid (nbf)")
+
+        if claims["iss"] != self.issuer:
+            raise jwt.InvalidIssuerError("Invalid issuer")
+
+        if claims["token_use"] != token_use:
+            raise InvalidTokenUse(f"Expected an {token_use} token")
+        if token_use == "id":
+            audience = claims.get("aud")
+            if audience is None:
+                raise jwt.MissingRequiredClaimError("aud")
+            if isinstance(audience, str):
+                audience = [audience]
+            if not isinstance(audience, list) or not any(
+                isinstance(a, str) and a in self.client_ids for a in audience
+            ):
+                raise jwt.InvalidAudienceError("Audience doesn't match")
+        elif not isinstance(claims.get("client_id"), str) or claims["client_id"] not in self.client_ids:
+            raise InvalidTokenUse("Token was issued to a different client")
+
+
+class VerifierRegistry:
+    """A TokenVerifier per user pool, picked for each token by its `iss` claim.
+
+    There's always the default pool, which the app logs users in to. Other
+    tenants' pools are listed in a JSON file:
+
+        {"tenants": [{"user_pool_id": "eu-west-1_AbCdEf123", "client_ids": ["..."]}]}
+
+    (with an optional "issuer", for pools which aren't in Cognito, like the
+    stand-in). The file is watched from a background thread, and reloaded when
+    it changes. Pools still listed keep their keys, new ones fetch theirs.
+    """
+
+    def __init__(self, default, tenants_file=None, reload_interval=5, refresh_interval=3600, min_refresh_interval=30):
+        self.default = default
+        self.tenants_file = tenants_file
+        self.reload_interval = reload_interval
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+
+        self._verifiers = {default.issuer: default}
+        self._mtime = None
+        self._started = False
+        self._stopped = threading.Event()
+
+    def verify(self, token, token_use):
+        """Route a ParsedToken to its pool's verifier. Raises a `jwt.InvalidTokenError` if we don't know the pool."""
+        # Always look the pool up - the tenants file can give even the default pool more app clients
+        issuer = token.claims.get("iss")
+        verifier = self._verifiers.get(issuer) if isinstance(issuer, str) else None
+        if verifier is None:
+            raise UnknownIssuer(f"Unknown issuer: {issuer}")
+        return verifier.verify(token, token_use)
+
+    @staticmethod
+    def _pools(tenants):
+        """The client IDs for each tenant's issuer. Raises a ValueError if the tenants aren't laid out right."""
+        try:
+            if not isinstance(tenants, list):
+                raise TypeError(f"expected a list of tenants, not {type(tenants).__name__}")
+            pools = {}
+            for tenant in tenants:
+                issuer = tenant.get("issuer") or issuer_for_user_pool(tenant["user_pool_id"])
+                client_ids = tenant["client_ids"]
+                if not isinstance(client_ids, list) or not all(isinstance(c, str) for c in client_ids):
+                    raise TypeError(f"expected a list of client IDs, not {client_ids!r}")
+                if not isinstance(issuer, str):
+                    raise TypeError(f"expected the issuer as a string, not {issuer!r}")
+                pools[issuer] = set(client_ids)
+            return pools
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Malformed tenants: {e!r}") from e
+
+    def load(self, tenants):
+        """Replace the tenants with these, e.g. `json.load(tenants_file)["tenants"]`.
+
+        Raises a ValueError, and keeps the tenants we have, if they aren't laid out right.
+        """
+        # Check all of them before we change anything, or start fetching any keys
+        pools = self._pools(tenants)
+
+        verifiers = {self.default.issuer: self.default}
+        for issuer, client_ids in pools.items():
+            if issuer == self.default.issuer:
+                # More app clients for the default pool
+                client_ids |= self.default.client_ids
+
+            existing = self._verifiers.get(issuer)
+            if existing is not None:
+                # Keep the keys we already have
+                jwks = existing.jwks
+            else:
+                jwks = JwksCache(
+                    f"{issuer}/.well-known/jwks.json",
+                    refresh_interval=self.refresh_interval,
+                    min_refresh_interval=self.min_refresh_interval,
+                )
+                if self._started:
+                    jwks.start()
+            verifiers[issuer] = TokenVerifier(issuer, client_ids, jwks)
+
+        removed = [v for issuer, v in self._verifiers.items() if issuer not in verifiers]
+        # Swap the whole dict in one go, readers never see a half-built index
+        self._verifiers = verifiers
+        for verifier in removed:
+            verifier.jwks.stop()
+
+    def reload_if_changed(self):
+        """Reload the tenants file if it has changed since we last loaded it."""
+        try:
+            mtime = os.stat(self.tenants_file).st_mtime_ns
+            if mtime == self._mtime:
+                return False
+            with open(self.tenants_file) as f:
+                tenants = json.load(f)["tenants"]
+            self.load(tenants)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # Keep the tenants we have, we'll try again later
+            print(f"Failed to load the tenants from {self.tenants_file}: {e}")
+            return False
+
+        self._mtime = mtime
+        return True
+
+    def start(self):
+        """Load the tenants and their keys, then watch the tenants file for changes."""
+        if self.tenants_file:
+            self.reload_if_changed()
+        for verifier in self._verifiers.values():
+            verifier.jwks.start()
+        # Pools added from now on start fetching their keys as they're loaded
+        self._started = True
+
+        if self.tenants_file:
+            self._stopped.clear()
+            threading.Thread(target=self._watch, daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        for verifier in self._verifiers.values():
+            verifier.jwks.stop()
+
+    def _watch(self):
+        while not self._stopped.wait(self.reload_interval):
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                # Whatever went wrong, keep watching - or we'd never pick up another change
+                print(f"Failed to reload the tenants from {self.tenants_file}: {e!r}")
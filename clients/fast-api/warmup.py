@@ -0,0 +1,73 @@
+"""
+Get a worker ready for its first requests, before it's sent any.
+
+Plenty of what a request needs is set up the first time it's needed: botocore
+loads its service model and opens its connections on the first call to
+Cognito, the first RS256 signature check loads the crypto backend, and so on.
+Left alone, the first users after every deploy (or scale out) pay for all of
+it. So at startup we do it all once, on purpose, and only then say we're ready.
+"""
+
+import json
+import time
+import uuid
+from contextlib import contextmanager
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import metrics
+
+SYNTHETIC_ISSUER = "https://warm-up.invalid"
+
+
+class Readiness:
+    """Whether we've finished warming up, and how long each step took."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.ready = False
+        self.durations = {}
+        self.failed = []
+
+    @contextmanager
+    def step(self, name):
+        """Time a step of the warm-up. A step which fails is logged, and we carry on without it."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.failed.append(name)
+            print(f"Warm-up step {name} failed: {e}")
+        finally:
+            self.durations[name] = time.perf_counter() - start
+            metrics.startup.set(self.durations[name], name)
+
+    def done(self):
+        self.durations["total"] = time.perf_counter() - self.started_at
+        metrics.startup.set(self.durations["total"], "total")
+        self.ready = True
+        print(f"Warmed up in {self.durations['total']:.2f}s")
+
+
+def synthetic_tokens(client_id):
+    """A throwaway JWKS, and an access and ID token signed with its key - shaped like Cognito's.
+
+    The private key is thrown away, so the tokens are only any good to a
+    verifier we give the JWKS to.
+    """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+    jwk.update({"kid": "warm-up", "alg": "RS256", "use": "sig"})
+
+    now = int(time.time())
+    claims = {"iss": SYNTHETIC_ISSUER, "sub": str(uuid.uuid4()), "iat": now, "exp": now + 60}
+    access_token = jwt.encode(
+        {**claims, "token_use": "access", "client_id": client_id, "jti": str(uuid.uuid4())},
+        key, algorithm="RS256", headers={"kid": "warm-up"},
+    )
+    id_token = jwt.encode(
+        {**claims, "token_use": "id", "aud": client_id, "email": "warm-up@example.com"},
+        key, algorithm="RS256", headers={"kid": "warm-up"},
+    )
+    return {"keys": [jwk]}, access_token, id_token
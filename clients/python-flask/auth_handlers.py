@@ -1,10 +1,16 @@
+import base64
+import http.cookiejar
 import time
 import urllib.parse
 
-import jwt
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+import metrics
 from config import config
+from refresh import RefreshCoalescer
+from token_parser import parse_token
 
 COGNITO_CLIENT_ID = config["COGNITO_CLIENT_ID"]
 COGNITO_CLIENT_SECRET = config["COGNITO_CLIENT_SECRET"]
@@ -13,24 +19,92 @@ HOSTEDUIPATH = config["HOSTEDUIPATH"]
 
 cognito_login_path = f"{HOSTEDUIPATH}/oauth2/authorize?client_id={COGNITO_CLIENT_ID}&response_type=code&scope=aws.cognito.signin.user.admin+email+openid+phone+profile&redirect_uri={urllib.parse.quote(REDIRECT_URI)}"
 token_url = f"{HOSTEDUIPATH}/oauth2/token"
+token_timeout = (config["TOKEN_HTTP_CONNECT_TIMEOUT"], config["TOKEN_HTTP_READ_TIMEOUT"])
+
+
+def basic_auth_header(client_id, client_secret):
+    credentials = f"{client_id}:{client_secret}".encode()
+    return f"Basic {base64.b64encode(credentials).decode()}"
+
+
+def make_http_session(pool_size, retries):
+    """A requests Session which keeps its connections to the hosted UI open.
+
+    Reusing connections saves a TCP and TLS handshake on every token exchange.
+    The connection pool is thread-safe, so one session is shared by every thread.
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        # An authorization code can only be used once - if Cognito may have
+        # already seen the request, retrying it would just fail with invalid_grant
+        read=0,
+        status=retries,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+        backoff_factor=0.1,
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # The client credentials never change, so encode them once rather than on every request
+    session.headers["Authorization"] = basic_auth_header(COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET)
+    # The session is shared between users, so it must never hold on to cookies
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+http_session = make_http_session(config["TOKEN_HTTP_POOL_SIZE"], config["TOKEN_HTTP_RETRIES"])
+
+
+def decode_token(token):
+    """Decode a token's claims, without verifying its signature."""
+    with metrics.jwt_decodes.time():
+        # Only the payload is decoded, the header and signature are left alone
+        return parse_token(token).claims
+
 
 def token_is_valid(token):
     """Decode and check that the token is still valid."""
     if not token:
         return False
 
-    jwt_data = jwt.decode(token, options={"verify_signature": False})
+    jwt_data = decode_token(token)
     if jwt_data.get("exp") < int(time.time()):
         return False
     return True
 
 
+def token_expires_within(token, seconds):
+    """Check whether the token will expire in the next `seconds` seconds."""
+    jwt_data = decode_token(token)
+    return jwt_data.get("exp") < int(time.time()) + seconds
+
+
+def tokens_expire_at(tokens):
+    """When the (id_token, access_token) from a refresh expire - we go by the ID token, as the views do."""
+    return decode_token(tokens[0])["exp"]
+
+
 class CodeExchangeException(Exception):
     pass
 
-def exchange_auth_code_for_tokens(code):
-    auth = requests.auth.HTTPBasicAuth(COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET)
+def request_tokens(params):
+    """POST to the hosted UI's token endpoint, and return the JSON it responds with."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        response = http_session.post(token_url, data=params, timeout=token_timeout)
+        response.raise_for_status()
+        outcome = "ok"
+        return response.json()
+    finally:
+        metrics.hosted_ui_calls.observe(time.perf_counter() - start, params["grant_type"], outcome)
 
+def exchange_auth_code_for_tokens(code):
     params = {
         "grant_type": "authorization_code",
         "client_id": COGNITO_CLIENT_ID,
@@ -38,10 +112,7 @@ def exchange_auth_code_for_tokens(code):
         "redirect_uri": REDIRECT_URI
     }
 
-    response = requests.post(token_url, auth=auth, data=params)
-    response.raise_for_status()
-
-    json_response = response.json()
+    json_response = request_tokens(params)
 
     id_token = json_response["id_token"]
     access_token = json_response["access_token"]
@@ -51,21 +122,43 @@ def exchange_auth_code_for_tokens(code):
 
 
 def exchange_refresh_token_for_tokens(refresh_token):
-    auth = requests.auth.HTTPBasicAuth(COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET)
-
     params = {
         "grant_type": "refresh_token",
         "client_id": COGNITO_CLIENT_ID,
         "refresh_token": refresh_token,
     }
 
-    response = requests.post(token_url, auth=auth, data=params)
-    response.raise_for_status()
-
-    json_response = response.json()
+    json_response = request_tokens(params)
 
     id_token = json_response["id_token"]
     access_token = json_response["access_token"]
     # You don't get a new refresh token - you keep using the same one
 
-    return id_token, access_token
\ No newline at end of file
+    return id_token, access_token
+
+
+# Concurrent requests refreshing the same token share a single exchange.
+# Refreshes started ahead of expiry are kept until the next request picks them up.
+refresh_coalescer = RefreshCoalescer(
+    exchange_refresh_token_for_tokens,
+    result_ttl=config["REFRESH_RESULT_TTL"],
+    background_result_ttl=max(config["REFRESH_AHEAD_SECONDS"], config["REFRESH_RESULT_TTL"]),
+    # Not past when the new tokens expire, or we'd hand out expired tokens as fresh ones
+    result_expires_at=tokens_expire_at,
+)
+refresh_ahead_seconds = config["REFRESH_AHEAD_SECONDS"]
+
+
+def refresh_tokens(refresh_token):
+    """Like `exchange_refresh_token_for_tokens`, but shared with any concurrent refreshes."""
+    return refresh_coalescer.refresh(refresh_token)
+
+
+def refresh_tokens_in_background(refresh_token):
+    """Start a refresh, the new tokens are collected later with `refreshed_tokens`."""
+    refresh_coalescer.refresh_in_background(refresh_token)
+
+
+def refreshed_tokens(refresh_token):
+    """The tokens from a recent refresh of `refresh_token`, or None."""
+    return refresh_coalescer.peek(refresh_token)
@@ -0,0 +1,138 @@
+"""
+The token exchanges from `auth_handlers`, for the async app in `hello_async.py`.
+
+While a sync view waits for the hosted UI it holds on to a worker thread, so
+a worker can only have as many exchanges in flight as it has threads. These
+await the hosted UI instead, so one worker can have hundreds in flight.
+
+The sync versions in `auth_handlers` are still there for `hello.py`, and the
+parts which don't wait on anything (decoding tokens, the login URL) are shared.
+"""
+
+import asyncio
+import http.cookiejar
+import time
+
+import httpx
+
+import metrics
+from auth_handlers import (  # noqa: F401 - re-exported for hello_async
+    COGNITO_CLIENT_ID,
+    COGNITO_CLIENT_SECRET,
+    REDIRECT_URI,
+    basic_auth_header,
+    cognito_login_path,
+    token_expires_within,
+    token_is_valid,
+    token_url,
+    tokens_expire_at,
+)
+from config import config
+from refresh import AsyncRefreshCoalescer
+
+# Worth retrying, the hosted UI may not have got as far as using the code
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+token_retries = config["TOKEN_HTTP_RETRIES"]
+
+
+def make_http_client(pool_size, retries):
+    """An httpx AsyncClient which keeps its connections to the hosted UI open.
+
+    Like the sync session, connection errors are retried but timeouts waiting
+    for a response aren't - an authorization code can only be used once.
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        timeout=httpx.Timeout(config["TOKEN_HTTP_READ_TIMEOUT"], connect=config["TOKEN_HTTP_CONNECT_TIMEOUT"]),
+        transport=httpx.AsyncHTTPTransport(retries=retries),
+        # The client credentials never change, so encode them once rather than on every request
+        headers={"Authorization": basic_auth_header(COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET)},
+        # The client is shared between users, so it must never hold on to cookies
+        cookies=http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[])),
+    )
+
+
+http_client = make_http_client(config["ASYNC_TOKEN_HTTP_POOL_SIZE"], token_retries)
+
+
+def retry_delay(response, attempt):
+    """How long to wait before retrying: what the hosted UI asked for, or an exponential backoff."""
+    retry_after = response.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return int(retry_after)
+    return 0.1 * 2 ** attempt
+
+
+async def request_tokens(params):
+    """POST to the hosted UI's token endpoint, and return the JSON it responds with."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        for attempt in range(token_retries + 1):
+            response = await http_client.post(token_url, data=params)
+            if response.status_code not in RETRY_STATUSES or attempt == token_retries:
+                break
+            await asyncio.sleep(retry_delay(response, attempt))
+        response.raise_for_status()
+        outcome = "ok"
+        return response.json()
+    finally:
+        metrics.hosted_ui_calls.observe(time.perf_counter() - start, params["grant_type"], outcome)
+
+
+async def exchange_auth_code_for_tokens(code):
+    params = {
+        "grant_type": "authorization_code",
+        "client_id": COGNITO_CLIENT_ID,
+        "code": code,
+        "redirect_uri": REDIRECT_URI
+    }
+
+    json_response = await request_tokens(params)
+
+    id_token = json_response["id_token"]
+    access_token = json_response["access_token"]
+    refresh_token = json_response["refresh_token"]
+
+    return id_token, access_token, refresh_token
+
+
+async def exchange_refresh_token_for_tokens(refresh_token):
+    params = {
+        "grant_type": "refresh_token",
+        "client_id": COGNITO_CLIENT_ID,
+        "refresh_token": refresh_token,
+    }
+
+    json_response = await request_tokens(params)
+
+    id_token = json_response["id_token"]
+    access_token = json_response["access_token"]
+    # You don't get a new refresh token - you keep using the same one
+
+    return id_token, access_token
+
+
+refresh_coalescer = AsyncRefreshCoalescer(
+    exchange_refresh_token_for_tokens,
+    result_ttl=config["REFRESH_RESULT_TTL"],
+    background_result_ttl=max(config["REFRESH_AHEAD_SECONDS"], config["REFRESH_RESULT_TTL"]),
+    # Not past when the new tokens expire, or we'd hand out expired tokens as fresh ones
+    result_expires_at=tokens_expire_at,
+)
+refresh_ahead_seconds = config["REFRESH_AHEAD_SECONDS"]
+
+
+async def refresh_tokens(refresh_token):
+    """Like `exchange_refresh_token_for_tokens`, but shared with any concurrent refreshes."""
+    return await refresh_coalescer.refresh(refresh_token)
+
+
+def refresh_tokens_in_background(refresh_token):
+    """Start a refresh, the new tokens are collected later with `refreshed_tokens`."""
+    refresh_coalescer.refresh_in_background(refresh_token)
+
+
+def refreshed_tokens(refresh_token):
+    """The tokens from a recent refresh of `refresh_token`, or None."""
+    return refresh_coalescer.peek(refresh_token)
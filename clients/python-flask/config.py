@@ -24,6 +24,26 @@ COGNITO_CLIENT_SECRET = os.environ.get("COGNITO_CLIENT_SECRET", config.get('Cogn
 REDIRECT_URI = os.environ.get("REDIRECT_URI", config.get('RedirectUri'))
 HOSTEDUIPATH = os.environ.get("HOSTEDUIPATH", config.get('HostedUiPath'))
 
+# Optional - tuning for the pooled HTTP connections to the hosted UI's token endpoint
+TOKEN_HTTP_POOL_SIZE = int(os.environ.get("TOKEN_HTTP_POOL_SIZE", 10))
+TOKEN_HTTP_CONNECT_TIMEOUT = float(os.environ.get("TOKEN_HTTP_CONNECT_TIMEOUT", 3.05))
+TOKEN_HTTP_READ_TIMEOUT = float(os.environ.get("TOKEN_HTTP_READ_TIMEOUT", 10))
+TOKEN_HTTP_RETRIES = int(os.environ.get("TOKEN_HTTP_RETRIES", 2))
+# Optional - connections to the hosted UI for the async app, which can have many more exchanges in flight
+ASYNC_TOKEN_HTTP_POOL_SIZE = int(os.environ.get("ASYNC_TOKEN_HTTP_POOL_SIZE", 100))
+# Optional - how long (in seconds) concurrent requests can share the result of one token refresh
+REFRESH_RESULT_TTL = float(os.environ.get("REFRESH_RESULT_TTL", 5))
+# Optional - start refreshing tokens in the background when they're this close (in seconds) to expiring. 0 disables it.
+REFRESH_AHEAD_SECONDS = int(os.environ.get("REFRESH_AHEAD_SECONDS", 300))
+# Optional - where to keep the session: "cookie" (Flask's signed cookie), "memory", "sqlite" or "redis"
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "cookie")
+# Optional - the SQLite file or Redis URL for the session backend
+SESSION_URL = os.environ.get("SESSION_URL")
+# Optional - how many connections to the hosted UI to open at startup, before the first logins need them
+WARMUP_CONNECTIONS = int(os.environ.get("WARMUP_CONNECTIONS", 2))
+# Optional - set to "false" to stop recording the metrics served on /metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() != "false"
+
 def get_config():
     if any([not COGNITO_CLIENT_ID, not COGNITO_CLIENT_SECRET, not REDIRECT_URI, not HOSTEDUIPATH]):
         raise ValueError("""
@@ -40,6 +60,17 @@ def get_config():
         "COGNITO_CLIENT_SECRET": COGNITO_CLIENT_SECRET,
         "REDIRECT_URI": REDIRECT_URI,
         "HOSTEDUIPATH": HOSTEDUIPATH,
+        "TOKEN_HTTP_POOL_SIZE": TOKEN_HTTP_POOL_SIZE,
+        "TOKEN_HTTP_CONNECT_TIMEOUT": TOKEN_HTTP_CONNECT_TIMEOUT,
+        "TOKEN_HTTP_READ_TIMEOUT": TOKEN_HTTP_READ_TIMEOUT,
+        "TOKEN_HTTP_RETRIES": TOKEN_HTTP_RETRIES,
+        "ASYNC_TOKEN_HTTP_POOL_SIZE": ASYNC_TOKEN_HTTP_POOL_SIZE,
+        "REFRESH_RESULT_TTL": REFRESH_RESULT_TTL,
+        "REFRESH_AHEAD_SECONDS": REFRESH_AHEAD_SECONDS,
+        "SESSION_BACKEND": SESSION_BACKEND,
+        "SESSION_URL": SESSION_URL,
+        "WARMUP_CONNECTIONS": WARMUP_CONNECTIONS,
+        "METRICS_ENABLED": METRICS_ENABLED,
     }
 
 config = get_config()
@@ -1,3 +1,6 @@
+import functools
+import time
+
 from flask import (
     Flask,
     redirect,
@@ -5,17 +8,66 @@ from flask import (
     session,
 )
 
+import metrics
 from auth_handlers import (
     cognito_login_path,
     exchange_auth_code_for_tokens,
-    exchange_refresh_token_for_tokens,
+    refresh_ahead_seconds,
+    refresh_tokens,
+    refresh_tokens_in_background,
+    refreshed_tokens,
+    token_expires_within,
     token_is_valid,
 )
+from config import config
+from sessions import ServerSideSessionInterface, make_backend
+from warmup import Readiness, open_connections, synthetic_check
 
 
 app = Flask(__name__)
 app.secret_key = "ThisIsSuperSecret"
 
+# Keep the tokens on the server, so the cookie only has to carry a session ID
+if config["SESSION_BACKEND"] != "cookie":
+    app.session_interface = ServerSideSessionInterface(
+        make_backend(config["SESSION_BACKEND"], config["SESSION_URL"])
+    )
+
+readiness = Readiness()
+
+
+def warm_up():
+    with readiness.step("connections"):
+        opened = open_connections(min(config["WARMUP_CONNECTIONS"], config["TOKEN_HTTP_POOL_SIZE"]))
+        print(f"Opened {opened} connections to the hosted UI")
+    if isinstance(app.session_interface, ServerSideSessionInterface):
+        with readiness.step("sessions"):
+            app.session_interface.backend.get("warm-up")
+    with readiness.step("verify"):
+        synthetic_check()
+    readiness.done()
+
+
+@app.before_request
+def start_warming_up():
+    # Only does anything on the first request this process gets
+    readiness.start(warm_up)
+
+
+def timed(view):
+    """Record how long a view takes, and the status it responds with."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = view(*args, **kwargs)
+            status = response[1] if isinstance(response, tuple) else 200
+            return response
+        finally:
+            metrics.views.observe(time.perf_counter() - start, view.__name__, status)
+    return wrapper
+
 
 @app.route("/")
 def hello_world():
@@ -28,6 +80,7 @@ def login():
     return redirect(cognito_login_path)
 
 @app.route('/callbacks/cognito/login', methods=['GET'])
+@timed
 def callback():
     """Exchange the Authorization Code for a JWT token
     """
@@ -40,6 +93,10 @@ def callback():
     if not token_is_valid(id_token):
         return "<p>Expired token</p>", 401
 
+    # Log in under a new session ID, so an ID someone planted before the login is no use to them
+    if isinstance(app.session_interface, ServerSideSessionInterface):
+        session.regenerate()
+
     # If we successfully get the tokens, we store them in the session
     session["id_token"] = id_token
     session["access_token"] = access_token
@@ -48,6 +105,7 @@ def callback():
     return "<p>Success. Go to <a href='/private'>the private area</a></p>"
 
 @app.route("/private")
+@timed
 def private():
     """Show the private area - if you're logged in
     """
@@ -57,10 +115,17 @@ def private():
     if not id_token:
         return "<p>Not logged in. <a href='/login'>Login in here.</a></p>", 401
 
+    # Pick up the new tokens if an earlier request refreshed them in the background
+    refreshed = refreshed_tokens(session["refresh_token"])
+    if refreshed is not None and refreshed[0] != id_token:
+        id_token, access_token = refreshed
+        session["id_token"] = id_token
+        session["access_token"] = access_token
+
     # If it has expired, we can use the refresh token to get a new one
     if not token_is_valid(id_token):
         refresh_token = session["refresh_token"]
-        id_token, access_token = exchange_refresh_token_for_tokens(refresh_token)
+        id_token, access_token = refresh_tokens(refresh_token)
 
         # If we fail to refresh it, we need to log in again
         if not token_is_valid(id_token):
@@ -71,7 +136,22 @@ def private():
         session["id_token"] = id_token
         session["access_token"] = access_token
 
+    # If it's about to expire, refresh it now - without making this request wait
+    elif refresh_ahead_seconds and token_expires_within(id_token, refresh_ahead_seconds):
+        refresh_tokens_in_background(session["refresh_token"])
+
     return "<p>Welcome to the secret space!</p>"
 
+@app.route("/ready")
+def ready():
+    """200 once we've warmed up, 503 until then. For load balancers' health checks."""
+    body = {"ready": readiness.ready, "startup": readiness.durations, "failed": readiness.failed}
+    return body, 200 if readiness.ready else 503
+
+@app.route("/metrics")
+def read_metrics():
+    """The metrics, for Prometheus to scrape."""
+    return app.response_class(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=3000)
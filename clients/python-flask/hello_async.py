@@ -0,0 +1,185 @@
+"""
+The same app as `hello.py`, async - on Quart, which is Flask for asyncio.
+
+The views await the hosted UI rather than holding a thread while they wait
+for it, so one worker can have hundreds of logins and refreshes in flight.
+Run it with an ASGI server, e.g. `hypercorn hello_async:app --bind 0.0.0.0:3000`.
+"""
+
+import asyncio
+import functools
+import time
+
+from quart import (
+    Quart,
+    redirect,
+    request,
+    session,
+)
+
+import metrics
+from auth_handlers_async import (
+    cognito_login_path,
+    exchange_auth_code_for_tokens,
+    http_client,
+    refresh_ahead_seconds,
+    refresh_tokens,
+    refresh_tokens_in_background,
+    refreshed_tokens,
+    token_expires_within,
+    token_is_valid,
+    token_url,
+)
+from config import config
+from sessions import make_backend
+from sessions_async import AsyncServerSideSessionInterface
+from warmup import Readiness, synthetic_check
+
+
+app = Quart(__name__)
+app.secret_key = "ThisIsSuperSecret"
+
+# Keep the tokens on the server, so the cookie only has to carry a session ID
+if config["SESSION_BACKEND"] != "cookie":
+    app.session_interface = AsyncServerSideSessionInterface(
+        make_backend(config["SESSION_BACKEND"], config["SESSION_URL"])
+    )
+
+readiness = Readiness()
+
+
+async def open_connections(count):
+    """Open `count` connections to the hosted UI, without sending the client credentials."""
+    async def get():
+        warm_up_request = http_client.build_request("GET", token_url)
+        del warm_up_request.headers["Authorization"]
+        await http_client.send(warm_up_request)
+
+    results = await asyncio.gather(*(get() for _ in range(count)), return_exceptions=True)
+    return sum(1 for result in results if not isinstance(result, Exception))
+
+
+async def warm_up():
+    with readiness.step("connections"):
+        opened = await open_connections(min(config["WARMUP_CONNECTIONS"], config["ASYNC_TOKEN_HTTP_POOL_SIZE"]))
+        print(f"Opened {opened} connections to the hosted UI")
+    if isinstance(app.session_interface, AsyncServerSideSessionInterface):
+        with readiness.step("sessions"):
+            await app.session_interface.call_backend(app.session_interface.backend.get, "warm-up")
+    with readiness.step("verify"):
+        synthetic_check()
+    readiness.done()
+
+
+@app.before_serving
+async def start_warming_up():
+    # Each worker process serves from here, so unlike the sync app we can start straight away
+    app.add_background_task(warm_up)
+
+
+@app.after_serving
+async def close_connections():
+    await http_client.aclose()
+
+
+def timed(view):
+    """Record how long a view takes, and the status it responds with."""
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await view(*args, **kwargs)
+            status = response[1] if isinstance(response, tuple) else 200
+            return response
+        finally:
+            metrics.views.observe(time.perf_counter() - start, view.__name__, status)
+    return wrapper
+
+
+@app.route("/")
+async def hello_world():
+    return "<p>Hello, World!</p>"
+
+@app.route("/login")
+async def login():
+    """Redirect to the Cognito hosted UI
+    """
+    return redirect(cognito_login_path)
+
+@app.route('/callbacks/cognito/login', methods=['GET'])
+@timed
+async def callback():
+    """Exchange the Authorization Code for a JWT token
+    """
+    code = request.args.get('code')
+
+    # Exchange the code for tokens
+    id_token, access_token, refresh_token = await exchange_auth_code_for_tokens(code)
+
+    # Validate the token for authenticity and expiration
+    if not token_is_valid(id_token):
+        return "<p>Expired token</p>", 401
+
+    # Log in under a new session ID, so an ID someone planted before the login is no use to them
+    if isinstance(app.session_interface, AsyncServerSideSessionInterface):
+        session.regenerate()
+
+    # If we successfully get the tokens, we store them in the session
+    session["id_token"] = id_token
+    session["access_token"] = access_token
+    session["refresh_token"] = refresh_token
+
+    return "<p>Success. Go to <a href='/private'>the private area</a></p>"
+
+@app.route("/private")
+@timed
+async def private():
+    """Show the private area - if you're logged in
+    """
+    id_token = session.get("id_token")
+
+    # If there is no token, you've never logged in.
+    if not id_token:
+        return "<p>Not logged in. <a href='/login'>Login in here.</a></p>", 401
+
+    # Pick up the new tokens if an earlier request refreshed them in the background
+    refreshed = refreshed_tokens(session["refresh_token"])
+    if refreshed is not None and refreshed[0] != id_token:
+        id_token, access_token = refreshed
+        session["id_token"] = id_token
+        session["access_token"] = access_token
+
+    # If it has expired, we can use the refresh token to get a new one
+    if not token_is_valid(id_token):
+        refresh_token = session["refresh_token"]
+        id_token, access_token = await refresh_tokens(refresh_token)
+
+        # If we fail to refresh it, we need to log in again
+        if not token_is_valid(id_token):
+            return "<p>Expired token. <a href='/login'>Login in again here.</a></p>", 401
+
+        print("Token refreshed")  # So you can see in the console that it's working
+
+        session["id_token"] = id_token
+        session["access_token"] = access_token
+
+    # If it's about to expire, refresh it now - without making this request wait
+    elif refresh_ahead_seconds and token_expires_within(id_token, refresh_ahead_seconds):
+        refresh_tokens_in_background(session["refresh_token"])
+
+    return "<p>Welcome to the secret space!</p>"
+
+@app.route("/ready")
+async def ready():
+    """200 once we've warmed up, 503 until then. For load balancers' health checks."""
+    body = {"ready": readiness.ready, "startup": readiness.durations, "failed": readiness.failed}
+    return body, 200 if readiness.ready else 503
+
+@app.route("/metrics")
+async def read_metrics():
+    """The metrics, for Prometheus to scrape."""
+    return metrics.registry.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+if __name__ == "__main__":
+    app.run(debug=True, host="0.0.0.0", port=3000)
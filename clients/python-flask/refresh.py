@@ -0,0 +1,192 @@
+"""
+Coalesce concurrent refreshes of the same refresh token into one call.
+
+When a token expires, a browser will often have several requests in flight,
+and each of them would otherwise exchange the refresh token on its own. Here
+the first request does the exchange and the others wait for, and share, its
+result. The result is kept for a few seconds so that requests which arrive
+just after the exchange finished reuse it too.
+
+Refreshes can also be started in the background, ahead of the token expiring.
+Their result is kept until a later request collects it with `peek`. No result
+is kept past `result_expires_at`, when the tokens in it expire.
+
+`AsyncRefreshCoalescer` does the same for the async app, where the requests
+waiting for an exchange share an asyncio future rather than blocking threads.
+"""
+
+import asyncio
+import functools
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _RecentResults:
+    """The results of recent refreshes, kept for `result_ttl` seconds.
+
+    `result_expires_at`, if given, returns the (epoch) time a result's tokens
+    expire - we never hand out a result after that, however long its TTL.
+    """
+
+    def __init__(self, result_ttl, background_result_ttl, result_expires_at=None):
+        self.result_ttl = result_ttl
+        self.background_result_ttl = background_result_ttl
+        self.result_expires_at = result_expires_at
+        self._results = {}  # key -> (expires_at, result)
+
+    @staticmethod
+    def _key(refresh_token):
+        # Don't keep the refresh tokens themselves hanging around in memory
+        return hashlib.sha256(refresh_token.encode()).digest()
+
+    def _cached(self, key):
+        cached = self._results.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached
+        return None
+
+    def peek(self, refresh_token):
+        """Return the result of a recent refresh of `refresh_token`, if there is one."""
+        cached = self._cached(self._key(refresh_token))
+        return cached[1] if cached is not None else None
+
+    def _store(self, key, result, ttl):
+        now = time.monotonic()
+        for expired in [k for k, (expires_at, _) in self._results.items() if expires_at <= now]:
+            del self._results[expired]
+
+        if self.result_expires_at is not None:
+            ttl = min(ttl, self.result_expires_at(result) - time.time())
+        self._results[key] = (now + ttl, result)
+
+
+class RefreshCoalescer(_RecentResults):
+
+    def __init__(self, exchange, result_ttl=5, background_result_ttl=300, background_workers=4,
+                 result_expires_at=None):
+        super().__init__(result_ttl, background_result_ttl, result_expires_at)
+        self.exchange = exchange
+
+        self._lock = threading.Lock()
+        self._in_flight = {}  # key -> _Call
+        self._executor = ThreadPoolExecutor(background_workers, thread_name_prefix="refresh")
+
+    def refresh_in_background(self, refresh_token):
+        """Start refreshing `refresh_token`, without waiting for the result."""
+        key = self._key(refresh_token)
+        with self._lock:
+            if key in self._in_flight or self._cached(key) is not None:
+                return
+
+        self._executor.submit(self._refresh_in_background, refresh_token)
+
+    def _refresh_in_background(self, refresh_token):
+        try:
+            self.refresh(refresh_token, result_ttl=self.background_result_ttl)
+        except Exception as e:
+            # The token is still valid, the next request will try again
+            print(f"Background token refresh failed: {e}")
+
+    def refresh(self, refresh_token, result_ttl=None):
+        """Exchange `refresh_token`, or share an exchange which is already happening."""
+        key = self._key(refresh_token)
+
+        with self._lock:
+            cached = self._cached(key)
+            if cached is not None:
+                metrics.token_refreshes.inc("cached")
+                return cached[1]
+
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+
+        metrics.token_refreshes.inc("exchanged" if leader else "shared")
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self.exchange(refresh_token)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if call.error is None:
+                    self._store(key, call.result, result_ttl or self.result_ttl)
+            call.done.set()
+
+        return call.result
+
+
+class AsyncRefreshCoalescer(_RecentResults):
+    """Like RefreshCoalescer, for an `async` exchange. Only use it from one event loop."""
+
+    def __init__(self, exchange, result_ttl=5, background_result_ttl=300, result_expires_at=None):
+        super().__init__(result_ttl, background_result_ttl, result_expires_at)
+        self.exchange = exchange
+
+        # Everything happens on the event loop, so none of this needs a lock
+        self._in_flight = {}  # key -> asyncio.Future
+        self._background = set()
+
+    def refresh_in_background(self, refresh_token):
+        """Start refreshing `refresh_token`, without waiting for the result."""
+        key = self._key(refresh_token)
+        if key in self._in_flight or self._cached(key) is not None:
+            return
+
+        # Hold on to the task, or it could be garbage collected before it's finished
+        task = asyncio.ensure_future(self._refresh_in_background(refresh_token))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _refresh_in_background(self, refresh_token):
+        try:
+            await self.refresh(refresh_token, result_ttl=self.background_result_ttl)
+        except Exception as e:
+            # The token is still valid, the next request will try again
+            print(f"Background token refresh failed: {e}")
+
+    async def refresh(self, refresh_token, result_ttl=None):
+        """Exchange `refresh_token`, or share an exchange which is already happening."""
+        key = self._key(refresh_token)
+
+        cached = self._cached(key)
+        if cached is not None:
+            metrics.token_refreshes.inc("cached")
+            return cached[1]
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            metrics.token_refreshes.inc("shared")
+            # Shielded, so one request going away doesn't cancel the exchange for the rest
+            return await asyncio.shield(future)
+
+        metrics.token_refreshes.inc("exchanged")
+        future = self._in_flight[key] = asyncio.ensure_future(self.exchange(refresh_token))
+        # Tidied up when the exchange finishes, even if every request waiting for it has gone away
+        future.add_done_callback(functools.partial(self._finished, key, result_ttl or self.result_ttl))
+        return await asyncio.shield(future)
+
+    def _finished(self, key, ttl, future):
+        del self._in_flight[key]
+        if not future.cancelled() and future.exception() is None:
+            self._store(key, future.result(), ttl)
@@ -0,0 +1,200 @@
+"""
+Server-side sessions for Flask.
+
+Flask's default session is a signed cookie holding everything we put in it -
+which for us is three JWTs, about 4KB sent with every request. Instead we keep
+the session data on the server and the cookie holds only a random session ID.
+
+There are three places to keep the data:
+
+* `memory` - an LRU in this process. Fast, but not shared between workers.
+* `sqlite` - a SQLite database file, shared by the workers on one host.
+* `redis` - anything which speaks the Redis protocol, shared by every host.
+"""
+
+import json
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class MemoryBackend:
+
+    def __init__(self, max_entries=10_000):
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()  # sid -> (expires_at, data)
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._sessions[sid]
+                return None
+            self._sessions.move_to_end(sid)
+            return json.loads(entry[1])
+
+    def set(self, sid, data, ttl):
+        with self._lock:
+            self._sessions[sid] = (time.time() + ttl, json.dumps(data))
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+class SqliteBackend:
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data TEXT, expires_at REAL)"
+        )
+
+    def _connection(self):
+        # SQLite connections can't be shared between threads, so each thread gets its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, sid):
+        row = self._connection().execute(
+            "SELECT data FROM sessions WHERE sid = ? AND expires_at > ?", (sid, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, sid, data, ttl):
+        connection = self._connection()
+        now = time.time()
+        connection.execute(
+            "INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)",
+            (sid, json.dumps(data), now + ttl),
+        )
+        # Clear out expired sessions every now and then, rather than on every write
+        if secrets.randbelow(100) == 0:
+            connection.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+    def delete(self, sid):
+        self._connection().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+
+class RedisBackend:
+
+    def __init__(self, url, prefix="session:"):
+        if redis is None:
+            raise ValueError("The redis session backend needs the redis package: pip install redis")
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, sid):
+        data = self._client.get(self.prefix + sid)
+        return json.loads(data) if data else None
+
+    def set(self, sid, data, ttl):
+        self._client.set(self.prefix + sid, json.dumps(data), ex=int(ttl))
+
+    def delete(self, sid):
+        self._client.delete(self.prefix + sid)
+
+
+def make_backend(name, url=None):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SqliteBackend(url or "sessions.db")
+    if name == "redis":
+        return RedisBackend(url or "redis://localhost:6379/0")
+    raise ValueError(f"Unknown session backend: {name}")
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Move the session to a new ID, e.g. on login. The old ID's record is deleted when it's saved."""
+        if not self.new and self.replaced_sid is None:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+# The IDs we hand out are URL-safe base64, anything else isn't worth a lookup
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{43}$")
+
+
+class ServerSideSessionInterface(SessionInterface):
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID_PATTERN.match(sid):
+            data = self.backend.get(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.replaced_sid is not None:
+            self.backend.delete(session.replaced_sid)
+            session.replaced_sid = None
+
+        if not session:
+            if session.modified and not session.new:
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Only write when something changed - most requests just read the session
+        if not session.modified:
+            return
+
+        self.backend.set(session.sid, dict(session), app.permanent_session_lifetime.total_seconds())
+
+        if session.new or session.permanent:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
@@ -0,0 +1,90 @@
+"""
+Server-side sessions for the async app in `hello_async.py`.
+
+They use the same backends as `sessions.py`. Quart's session interface is
+Flask's with `async` methods. The SQLite and Redis backends block, so their
+calls run in a thread, and the event loop keeps serving other requests meanwhile.
+"""
+
+import asyncio
+import secrets
+
+from quart.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from sessions import SESSION_ID_PATTERN, MemoryBackend
+
+
+class AsyncServerSideSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Move the session to a new ID, e.g. on login. The old ID's record is deleted when it's saved."""
+        if not self.new and self.replaced_sid is None:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class AsyncServerSideSessionInterface(SessionInterface):
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def call_backend(self, method, *args):
+        # Only in memory, there's nothing to wait for
+        if isinstance(self.backend, MemoryBackend):
+            return method(*args)
+        return await asyncio.to_thread(method, *args)
+
+    async def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID_PATTERN.match(sid):
+            data = await self.call_backend(self.backend.get, sid)
+            if data is not None:
+                return AsyncServerSideSession(data, sid=sid)
+
+        return AsyncServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    async def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.replaced_sid is not None:
+            await self.call_backend(self.backend.delete, session.replaced_sid)
+            session.replaced_sid = None
+
+        if not session:
+            if session.modified and not session.new:
+                await self.call_backend(self.backend.delete, session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Only write when something changed - most requests just read the session
+        if not session.modified:
+            return
+
+        await self.call_backend(self.backend.set, session.sid, dict(session), app.permanent_session_lifetime.total_seconds())
+
+        if session.new or session.permanent:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
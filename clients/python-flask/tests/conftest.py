@@ -0,0 +1,8 @@
+import os
+
+# config.py insists on these, but nothing under test talks to the hosted UI
+os.environ.setdefault("COGNITO_CLIENT_ID", "testclientid")
+os.environ.setdefault("COGNITO_CLIENT_SECRET", "testclientsecret")
+os.environ.setdefault("REDIRECT_URI", "http://localhost:3000/callbacks/cognito/login")
+os.environ.setdefault("HOSTEDUIPATH", "http://localhost:9229")
+os.environ.setdefault("WARMUP_CONNECTIONS", "0")
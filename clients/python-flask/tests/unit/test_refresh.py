@@ -0,0 +1,217 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from refresh import AsyncRefreshCoalescer, RefreshCoalescer
+
+
+class Exchange:
+    """A stand-in for the hosted UI's token exchange, which holds each call until it's released."""
+
+    def __init__(self, error=None):
+        self.calls = 0
+        self.error = error
+        self.release = threading.Event()
+
+    def __call__(self, refresh_token):
+        self.calls += 1
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return f"tokens-for-{refresh_token}-{self.calls}"
+
+
+def refresh_concurrently(coalescer, count, refresh_token="refresh-token"):
+    """Call `refresh` from `count` threads at once. Returns each one's result or error."""
+    results = [None] * count
+
+    def refresh(i):
+        try:
+            results[i] = coalescer.refresh(refresh_token)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=refresh, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    # Let them all reach the exchange before it answers
+    time.sleep(0.1)
+    coalescer.exchange.release.set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_refreshes_share_one_exchange():
+    coalescer = RefreshCoalescer(Exchange())
+    results = refresh_concurrently(coalescer, 10)
+
+    assert coalescer.exchange.calls == 1
+    assert results == ["tokens-for-refresh-token-1"] * 10
+
+
+def test_different_refresh_tokens_are_exchanged_separately():
+    exchange = Exchange()
+    exchange.release.set()
+    coalescer = RefreshCoalescer(exchange)
+
+    assert coalescer.refresh("a") == "tokens-for-a-1"
+    assert coalescer.refresh("b") == "tokens-for-b-2"
+
+
+def test_every_waiter_gets_the_error():
+    error = RuntimeError("The hosted UI is down")
+    coalescer = RefreshCoalescer(Exchange(error))
+    results = refresh_concurrently(coalescer, 5)
+
+    assert coalescer.exchange.calls == 1
+    assert results == [error] * 5
+
+
+def test_errors_are_not_cached():
+    coalescer = RefreshCoalescer(Exchange(RuntimeError("The hosted UI is down")))
+    refresh_concurrently(coalescer, 1)
+
+    coalescer.exchange.error = None
+    assert coalescer.refresh("refresh-token") == "tokens-for-refresh-token-2"
+
+
+def test_results_are_reused_until_their_ttl():
+    exchange = Exchange()
+    exchange.release.set()
+    coalescer = RefreshCoalescer(exchange, result_ttl=0.2)
+
+    assert coalescer.refresh("refresh-token") == "tokens-for-refresh-token-1"
+    assert coalescer.refresh("refresh-token") == "tokens-for-refresh-token-1"
+    assert coalescer.peek("refresh-token") == "tokens-for-refresh-token-1"
+
+    time.sleep(0.25)
+    assert coalescer.peek("refresh-token") is None
+    assert coalescer.refresh("refresh-token") == "tokens-for-refresh-token-2"
+
+
+def test_background_refresh():
+    exchange = Exchange()
+    exchange.release.set()
+    coalescer = RefreshCoalescer(exchange, result_ttl=0.01, background_result_ttl=5)
+
+    coalescer.refresh_in_background("refresh-token")
+    coalescer._executor.shutdown(wait=True)
+
+    # Kept for the background TTL, until a request collects it
+    time.sleep(0.05)
+    assert coalescer.peek("refresh-token") == "tokens-for-refresh-token-1"
+    assert exchange.calls == 1
+
+
+class AsyncExchange:
+
+    def __init__(self, error=None):
+        self.calls = 0
+        self.error = error
+        self.release = None
+
+    async def __call__(self, refresh_token):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return f"tokens-for-{refresh_token}-{self.calls}"
+
+
+def refresh_concurrently_async(coalescer, count):
+    async def run():
+        coalescer.exchange.release = asyncio.Event()
+        tasks = [asyncio.ensure_future(coalescer.refresh("refresh-token")) for _ in range(count)]
+        await asyncio.sleep(0.01)
+        coalescer.exchange.release.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    return asyncio.run(run())
+
+
+def test_async_concurrent_refreshes_share_one_exchange():
+    coalescer = AsyncRefreshCoalescer(AsyncExchange())
+    results = refresh_concurrently_async(coalescer, 10)
+
+    assert coalescer.exchange.calls == 1
+    assert results == ["tokens-for-refresh-token-1"] * 10
+    assert coalescer.peek("refresh-token") == "tokens-for-refresh-token-1"
+
+
+def test_async_every_waiter_gets_the_error():
+    error = RuntimeError("The hosted UI is down")
+    coalescer = AsyncRefreshCoalescer(AsyncExchange(error))
+    results = refresh_concurrently_async(coalescer, 5)
+
+    assert coalescer.exchange.calls == 1
+    assert results == [error] * 5
+    assert coalescer.peek("refresh-token") is None
+
+
+def test_async_results_are_reused_until_their_ttl():
+    coalescer = AsyncRefreshCoalescer(AsyncExchange(), result_ttl=0.2)
+    refresh_concurrently_async(coalescer, 1)
+    assert coalescer.peek("refresh-token") == "tokens-for-refresh-token-1"
+
+    time.sleep(0.25)
+    assert coalescer.peek("refresh-token") is None
+
+
+def test_async_exchange_outlives_a_cancelled_caller():
+    async def run():
+        coalescer = AsyncRefreshCoalescer(AsyncExchange())
+        coalescer.exchange.release = asyncio.Event()
+        first = asyncio.ensure_future(coalescer.refresh("refresh-token"))
+        second = asyncio.ensure_future(coalescer.refresh("refresh-token"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        coalescer.exchange.release.set()
+
+        assert await second == "tokens-for-refresh-token-1"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return coalescer
+
+    coalescer = asyncio.run(run())
+    assert coalescer.exchange.calls == 1
+
+
+def test_results_are_not_kept_past_their_tokens_expiry():
+    # A background refresh's TTL can be longer than the new tokens live
+    expires_at = time.time() + 0.2
+    coalescer = RefreshCoalescer(
+        lambda refresh_token: ("id-token", "access-token"),
+        result_ttl=0.01,
+        background_result_ttl=300,
+        result_expires_at=lambda tokens: expires_at,
+    )
+    coalescer.refresh_in_background("refresh-token")
+    coalescer._executor.shutdown(wait=True)
+    assert coalescer.peek("refresh-token") == ("id-token", "access-token")
+
+    time.sleep(0.25)
+    # So the request which finds them expired exchanges the refresh token again
+    assert coalescer.peek("refresh-token") is None
+    coalescer.exchange = lambda refresh_token: ("new-id-token", "new-access-token")
+    assert coalescer.refresh("refresh-token") == ("new-id-token", "new-access-token")
+
+
+def test_async_results_are_not_kept_past_their_tokens_expiry():
+    async def exchange(refresh_token):
+        return "tokens"
+
+    async def run():
+        coalescer.refresh_in_background("refresh-token")
+        await asyncio.gather(*coalescer._background)
+
+    coalescer = AsyncRefreshCoalescer(
+        exchange, background_result_ttl=300, result_expires_at=lambda tokens: time.time() + 0.2,
+    )
+    asyncio.run(run())
+    assert coalescer.peek("refresh-token") == "tokens"
+
+    time.sleep(0.25)
+    assert coalescer.peek("refresh-token") is None
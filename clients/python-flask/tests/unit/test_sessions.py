@@ -0,0 +1,199 @@
+import os
+import time
+
+import pytest
+from flask import Flask, session
+
+import sessions
+from sessions import SESSION_ID_PATTERN, MemoryBackend, ServerSideSessionInterface, SqliteBackend
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryBackend()
+        return
+    if request.param == "sqlite":
+        yield SqliteBackend(str(tmp_path / "sessions.db"))
+        return
+
+    # Only with a Redis to test against, e.g. TEST_REDIS_URL=redis://localhost:6379/15
+    if sessions.redis is None or not os.environ.get("TEST_REDIS_URL"):
+        pytest.skip("Set TEST_REDIS_URL (and pip install redis) to test the redis backend")
+    backend = sessions.RedisBackend(os.environ["TEST_REDIS_URL"], prefix="test-session:")
+    yield backend
+    for key in backend._client.scan_iter("test-session:*"):
+        backend._client.delete(key)
+
+
+@pytest.fixture
+def later(monkeypatch):
+    """Move the clock forward by `seconds`."""
+    def move(seconds):
+        now = time.time() + seconds
+        monkeypatch.setattr(sessions.time, "time", lambda: now)
+    return move
+
+
+def test_round_trip(backend):
+    data = {"id_token": "a.b.c", "access_token": "d.e.f", "refresh_token": "g"}
+    backend.set("sid", data, 60)
+    assert backend.get("sid") == data
+
+
+def test_missing(backend):
+    assert backend.get("no-such-sid") is None
+
+
+def test_overwrite(backend):
+    backend.set("sid", {"n": 1}, 60)
+    backend.set("sid", {"n": 2}, 60)
+    assert backend.get("sid") == {"n": 2}
+
+
+def test_delete(backend):
+    backend.set("sid", {"n": 1}, 60)
+    backend.delete("sid")
+    assert backend.get("sid") is None
+    # Deleting what isn't there is fine too
+    backend.delete("sid")
+
+
+def test_expiry(backend, later):
+    if isinstance(backend, sessions.RedisBackend):
+        backend.set("sid", {"n": 1}, 1)
+        time.sleep(1.1)
+    else:
+        backend.set("sid", {"n": 1}, 60)
+        assert backend.get("sid") == {"n": 1}
+        later(61)
+    assert backend.get("sid") is None
+
+
+def test_memory_backend_drops_the_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    backend.set("a", {}, 60)
+    backend.set("b", {}, 60)
+    backend.get("a")
+    backend.set("c", {}, 60)
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == ({}, None, {})
+
+
+def test_sqlite_backend_is_shared_between_instances(tmp_path):
+    # As it is between the workers on a host
+    path = str(tmp_path / "sessions.db")
+    SqliteBackend(path).set("sid", {"n": 1}, 60)
+    assert SqliteBackend(path).get("sid") == {"n": 1}
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.session_interface = ServerSideSessionInterface(MemoryBackend())
+
+    @app.route("/set")
+    def set_value():
+        session["value"] = "set"
+        return ""
+
+    @app.route("/get")
+    def get_value():
+        return session.get("value", "")
+
+    @app.route("/login")
+    def login():
+        session.regenerate()
+        session["tokens"] = "tokens"
+        return ""
+
+    @app.route("/clear")
+    def clear():
+        session.clear()
+        return ""
+
+    return app
+
+
+def session_id(client):
+    cookie = client.get_cookie("session")
+    return cookie.value if cookie is not None else None
+
+
+def test_the_cookie_only_carries_the_session_id(app):
+    client = app.test_client()
+    client.get("/set")
+
+    sid = session_id(client)
+    assert SESSION_ID_PATTERN.match(sid)
+    assert app.session_interface.backend.get(sid) == {"value": "set"}
+    assert client.get("/get").text == "set"
+
+
+def test_reading_the_session_doesnt_write_it(app):
+    client = app.test_client()
+    client.get("/get")
+    assert session_id(client) is None
+    assert len(app.session_interface.backend._sessions) == 0
+
+
+def test_an_unknown_session_id_isnt_adopted(app):
+    # e.g. one planted in the browser by someone else
+    client = app.test_client()
+    planted = "p" * 43
+    client.set_cookie("session", planted)
+    client.get("/set")
+
+    assert session_id(client) != planted
+    assert app.session_interface.backend.get(planted) is None
+
+
+def test_logging_in_moves_the_session_to_a_new_id(app):
+    client = app.test_client()
+    client.get("/set")
+    before = session_id(client)
+
+    client.get("/login")
+    after = session_id(client)
+
+    assert after != before
+    assert app.session_interface.backend.get(before) is None
+    assert app.session_interface.backend.get(after) == {"value": "set", "tokens": "tokens"}
+    assert client.get("/get").text == "set"
+
+
+def test_logging_in_without_a_session(app):
+    client = app.test_client()
+    client.get("/login")
+    assert app.session_interface.backend.get(session_id(client)) == {"tokens": "tokens"}
+
+
+def test_clearing_the_session_deletes_it(app):
+    client = app.test_client()
+    client.get("/set")
+    sid = session_id(client)
+
+    client.get("/clear")
+    assert app.session_interface.backend.get(sid) is None
+    assert session_id(client) is None
+
+
+def test_the_login_callback_moves_the_session_to_a_new_id(monkeypatch):
+    import hello
+
+    backend = MemoryBackend()
+    monkeypatch.setattr(hello.app, "session_interface", ServerSideSessionInterface(backend))
+    monkeypatch.setattr(hello.readiness, "start", lambda warm_up: None)
+    monkeypatch.setattr(hello, "exchange_auth_code_for_tokens", lambda code: ("id", "access", "refresh"))
+    monkeypatch.setattr(hello, "token_is_valid", lambda token: True)
+
+    client = hello.app.test_client()
+    planted = "p" * 43
+    backend.set(planted, {}, 60)
+    client.set_cookie("session", planted)
+
+    assert client.get("/callbacks/cognito/login?code=code").status_code == 200
+    sid = session_id(client)
+    assert sid != planted
+    assert backend.get(planted) is None
+    assert backend.get(sid) == {"id_token": "id", "access_token": "access", "refresh_token": "refresh"}
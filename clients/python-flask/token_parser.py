@@ -0,0 +1,113 @@
+"""
+Split JWTs (and the FastAPI client's combined tokens) in one pass - and only decode what we read.
+
+PyJWT parses a token from scratch every time it's handed one: the header once
+to find the `kid`, then the header, payload and signature again to verify it -
+and all of it when the Flask client only wants the `exp` claim. Here we find
+where the segments are (with `str.find`, so nothing is copied), check the
+shape of the token before doing any decoding work, and base64- and JSON-decode
+each segment at most once, the first time it's asked for.
+
+Anything too long, or with the wrong number of segments, is turned away with a
+MalformedToken before we decode a byte of it.
+
+The clients are self-contained, so each has a copy of this file. Keep them
+identical - clients/fast-api/tests/unit/test_token_parser.py fails if they aren't.
+"""
+
+import base64
+import binascii
+import json
+
+import jwt
+
+# Cognito's tokens are one to two KB each. ID tokens grow with the user's
+# attributes and groups, so this leaves plenty of room
+MAX_TOKEN_LENGTH = 16 * 1024
+
+
+class MalformedToken(jwt.DecodeError):
+    pass
+
+
+def _b64decode(segment):
+    try:
+        return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+    except (binascii.Error, ValueError) as e:
+        raise MalformedToken(f"Invalid base64 in token: {e}") from e
+
+
+def _json_object(segment, part):
+    try:
+        value = json.loads(_b64decode(segment))
+    except ValueError as e:
+        raise MalformedToken(f"Invalid {part} JSON in token: {e}") from e
+    if not isinstance(value, dict):
+        raise MalformedToken(f"The token's {part} must be a JSON object")
+    return value
+
+
+class ParsedToken:
+    """One JWT, split into its segments. Each is decoded the first time it's read."""
+
+    __slots__ = ("token", "_first_dot", "_second_dot", "_header", "_claims")
+
+    def __init__(self, token, max_length=MAX_TOKEN_LENGTH):
+        if len(token) > max_length:
+            raise MalformedToken("Token is too long")
+        if not token.isascii():
+            raise MalformedToken("Token isn't ASCII")
+
+        first_dot = token.find(".")
+        second_dot = token.find(".", first_dot + 1) if first_dot > 0 else -1
+        if second_dot <= first_dot + 1 or second_dot == len(token) - 1 or token.find(".", second_dot + 1) != -1:
+            raise MalformedToken("Expected a token with three non-empty segments")
+
+        self.token = token
+        self._first_dot = first_dot
+        self._second_dot = second_dot
+        self._header = None
+        self._claims = None
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = _json_object(self.token[:self._first_dot], "header")
+        return self._header
+
+    @property
+    def claims(self):
+        """The payload - not verified, until the token has been."""
+        if self._claims is None:
+            self._claims = _json_object(self.token[self._first_dot + 1:self._second_dot], "payload")
+        return self._claims
+
+    @property
+    def signing_input(self):
+        return self.token[:self._second_dot].encode()
+
+    @property
+    def signature(self):
+        return _b64decode(self.token[self._second_dot + 1:])
+
+
+def parse_token(token, max_length=MAX_TOKEN_LENGTH):
+    return ParsedToken(token, max_length)
+
+
+def parse_combined(token, delimiter, max_length=MAX_TOKEN_LENGTH):
+    """Split an access token and ID token joined by `delimiter` into two ParsedTokens.
+
+    `max_length` is the longest each of the tokens may be.
+    """
+    if len(token) > 2 * max_length + len(delimiter):
+        raise MalformedToken("Token is too long")
+
+    split = token.find(delimiter)
+    if split == -1 or token.find(delimiter, split + len(delimiter)) != -1:
+        raise MalformedToken("Expected an access token and an ID token")
+
+    return (
+        ParsedToken(token[:split], max_length),
+        ParsedToken(token[split + len(delimiter):], max_length),
+    )
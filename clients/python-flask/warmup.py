@@ -0,0 +1,95 @@
+"""
+Get the app ready for its first users, before they turn up.
+
+The first call to the hosted UI has to look up its address and open a TLS
+connection, a server-side session store has to be connected to, and so on.
+Left alone, the first users after every deploy (or scale out) pay for all of
+it. So we do it all once, on purpose, and only then say we're ready.
+
+Flask has no startup hook, and servers like gunicorn may fork the app after
+importing it - and connections opened before a fork can't be shared by the
+processes after it. So each process starts warming up when it gets its first
+request (which will be the load balancer's first health check), in the background.
+"""
+
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import jwt
+
+import metrics
+from auth_handlers import http_session, token_is_valid, token_timeout, token_url
+
+
+class Readiness:
+    """Whether we've finished warming up, and how long each step took."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.ready = False
+        self.durations = {}
+        self.failed = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self, warm_up):
+        """Run `warm_up` in a background thread, unless this process has already started it.
+
+        For the sync app. The async app starts its warm-up when it starts serving.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.started_at = time.perf_counter()
+        threading.Thread(target=warm_up, daemon=True).start()
+
+    @contextmanager
+    def step(self, name):
+        """Time a step of the warm-up. A step which fails is logged, and we carry on without it."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.failed.append(name)
+            print(f"Warm-up step {name} failed: {e}")
+        finally:
+            self.durations[name] = time.perf_counter() - start
+            metrics.startup.set(self.durations[name], name)
+
+    def done(self):
+        self.durations["total"] = time.perf_counter() - self.started_at
+        metrics.startup.set(self.durations["total"], "total")
+        self.ready = True
+        print(f"Warmed up in {self.durations['total']:.2f}s")
+
+
+def open_connections(count):
+    """Open `count` connections to the hosted UI. Returns how many got an answer.
+
+    The requests are made at the same time, so each one needs a connection of
+    its own. They're only to open the connections, so they don't send the
+    client credentials.
+    """
+    if count < 1:
+        return 0
+
+    def get():
+        http_session.get(token_url, headers={"Authorization": None}, timeout=token_timeout)
+
+    with ThreadPoolExecutor(count) as executor:
+        futures = [executor.submit(get) for _ in range(count)]
+    return sum(1 for future in futures if future.exception() is None)
+
+
+def synthetic_check():
+    """Check a made-up token the way we check real ones, so whatever that loads is loaded now."""
+    token = jwt.encode({"exp": int(time.time()) + 60, "token_use": "id"}, secrets.token_bytes(32), algorithm="HS256")
+    if not token_is_valid(token):
+        raise ValueError("The made-up token wasn't valid")
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Create (and tear down) lots of test users in the playground's user pool, for load testing.
+
+    python provision_users.py create --count 1000 --credentials users.json
+    python provision_users.py delete --credentials users.json
+
+Each user is created with AdminCreateUser and then given a permanent password
+with AdminSetUserPassword, so they can log in straight away - just like the
+stack does for its initial user. The calls are made from a pool of threads,
+paced to stay inside Cognito's request rate quotas.
+
+Progress is recorded, a line per user, as we go. If a run is interrupted (or
+some users fail) run the same command again, and it carries on from where it
+got to. The credentials file is a JSON list of `{"username", "password"}`,
+as `loadtest/loadgen.py --credentials` expects.
+
+The user pool ID comes from `--user-pool-id`, the USER_POOL_ID ENV VAR, or the
+`cdk_outputs.json` written by `cdk deploy --outputs-file cdk_outputs.json`.
+Pass `--endpoint-url` to provision users in the stand-in in `cognito-local/` instead.
+"""
+
+import argparse
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+STACK_NAME = os.environ.get("STACK_NAME", "CognitoPlaygroundStack")
+
+THROTTLING_ERRORS = {"TooManyRequestsException", "ThrottlingException", "LimitExceededException"}
+
+
+def error_code(exception):
+    """The Cognito error code of a botocore ClientError, or None for anything else."""
+    return getattr(exception, "response", {}).get("Error", {}).get("Code")
+
+
+class TokenBucket:
+    """Paces callers to `rate` calls per second on average, in bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Take a token, waiting for one if there are none left."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Take it now, even if that means going into debt, and wait for the debt to be paid off
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class Progress:
+    """What's been done so far, in a file of JSON lines we append to as we go."""
+
+    def __init__(self, path):
+        self.path = path
+        self.users = {}  # username -> {"username", "password", "status"}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        user = json.loads(line)
+                        self.users[user["username"]] = user
+
+    def record(self, username, password, status):
+        user = {"username": username, "password": password, "status": status}
+        with self._lock:
+            self.users[username] = user
+            with open(self.path, "a") as f:
+                f.write(json.dumps(user) + "\n")
+
+    def with_status(self, status):
+        return [user for user in self.users.values() if user["status"] == status]
+
+
+class Provisioner:
+
+    def __init__(self, client, user_pool_id, workers=8, rate=20, max_retries=5, retry_base_delay=0.2):
+        self.client = client
+        self.user_pool_id = user_pool_id
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self._bucket = TokenBucket(rate) if rate else None
+
+    def _call(self, operation, **kwargs):
+        """Call a Cognito operation, paced, retrying with jittered backoff if we're throttled."""
+        for attempt in range(self.max_retries + 1):
+            if self._bucket is not None:
+                self._bucket.take()
+            try:
+                return getattr(self.client, operation)(UserPoolId=self.user_pool_id, **kwargs)
+            except Exception as e:
+                if error_code(e) not in THROTTLING_ERRORS or attempt == self.max_retries:
+                    raise
+            time.sleep(random.uniform(0, self.retry_base_delay * 2 ** attempt))
+
+    def create_user(self, username, password):
+        try:
+            self._call(
+                "admin_create_user",
+                Username=username,
+                UserAttributes=[
+                    {"Name": "email", "Value": username},
+                    {"Name": "email_verified", "Value": "true"},
+                ],
+                # Don't send them an invitation email
+                MessageAction="SUPPRESS",
+            )
+        except Exception as e:
+            # An earlier run may have created them, and failed to set their password
+            if error_code(e) != "UsernameExistsException":
+                raise
+
+        # Confirm their password, so they don't have to change it when they first log in
+        self._call("admin_set_user_password", Username=username, Password=password, Permanent=True)
+
+    def delete_user(self, username):
+        try:
+            self._call("admin_delete_user", Username=username)
+        except Exception as e:
+            if error_code(e) != "UserNotFoundException":
+                raise
+
+    def _run(self, task, users, progress, status):
+        """Run `task(username, password)` for each user, in parallel. Returns how many failed."""
+        failures = 0
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = {executor.submit(task, user["username"], user["password"]): user for user in users}
+            for future in as_completed(futures):
+                user = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failures += 1
+                    print(f"Failed on {user['username']}: {e}")
+                else:
+                    progress.record(user["username"], user["password"], status)
+        return failures
+
+    def create(self, usernames, progress):
+        """Create the users we haven't already created. Returns how many failed."""
+        users = []
+        for username in usernames:
+            done = progress.users.get(username)
+            if done is not None and done["status"] == "created":
+                continue
+            # Keep the password from an earlier attempt, in case it got as far as setting it
+            password = done["password"] if done is not None else generate_password()
+            users.append({"username": username, "password": password})
+
+        return self._run(self.create_user, users, progress, "created")
+
+    def delete(self, progress):
+        """Delete the users we've created. Returns how many failed."""
+        return self._run(lambda username, _: self.delete_user(username), progress.with_status("created"), progress, "deleted")
+
+
+def generate_password():
+    # Random, with something from each of the character classes Cognito's default policy requires
+    return secrets.token_urlsafe(12) + "Aa1!"
+
+
+def usernames(prefix, domain, count):
+    return [f"{prefix}-{i:06d}@{domain}" for i in range(count)]
+
+
+def write_credentials(path, progress):
+    credentials = [
+        {"username": user["username"], "password": user["password"]}
+        for user in progress.with_status("created")
+    ]
+    with open(path, "w") as f:
+        json.dump(credentials, f, indent=2)
+    return len(credentials)
+
+
+def make_client(workers, endpoint_url=None):
+    # Imported here, so the rest of this can be used (and tested) without boto3
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        "cognito-idp",
+        endpoint_url=endpoint_url,
+        # One connection per thread. We retry throttling ourselves, with our own pacing
+        config=Config(max_pool_connections=workers, retries={"mode": "standard", "max_attempts": 1}),
+    )
+
+
+def default_user_pool_id():
+    if os.environ.get("USER_POOL_ID"):
+        return os.environ["USER_POOL_ID"]
+    try:
+        with open("cdk_outputs.json") as f:
+            return json.load(f)[STACK_NAME]["UserPoolId"]
+    except (FileNotFoundError, KeyError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("action", choices=["create", "delete"])
+    parser.add_argument("--count", type=int, default=100, help="how many users to create")
+    parser.add_argument("--prefix", default="loadtest", help="usernames are <prefix>-000000@<domain>, ...")
+    parser.add_argument("--domain", default="example.com")
+    parser.add_argument("--credentials", default="users.json", help="where to write the users' credentials")
+    parser.add_argument("--progress", help="the progress file (default: <credentials>.progress)")
+    parser.add_argument("--workers", type=int, default=8, help="calls to Cognito in flight at once")
+    parser.add_argument("--rate", type=float, default=20, help="calls to Cognito per second, 0 for no limit")
+    parser.add_argument("--user-pool-id", default=default_user_pool_id())
+    parser.add_argument("--endpoint-url", help="e.g. http://127.0.0.1:9229 for the stand-in")
+    args = parser.parse_args()
+
+    if not args.user_pool_id:
+        parser.error("Pass --user-pool-id, set USER_POOL_ID, or write cdk_outputs.json")
+
+    progress = Progress(args.progress or f"{args.credentials}.progress")
+    provisioner = Provisioner(
+        make_client(args.workers, args.endpoint_url), args.user_pool_id, workers=args.workers, rate=args.rate,
+    )
+
+    start = time.monotonic()
+    if args.action == "create":
+        failures = provisioner.create(usernames(args.prefix, args.domain, args.count), progress)
+    else:
+        failures = provisioner.delete(progress)
+    count = write_credentials(args.credentials, progress)
+
+    print(f"{args.action}: {failures} failed in {time.monotonic() - start:.1f}s, "
+          f"{count} users in {args.credentials}")
+    if failures:
+        print("Run the same command again to retry them")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
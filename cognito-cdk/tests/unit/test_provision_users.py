@@ -0,0 +1,134 @@
+import json
+import threading
+
+import pytest
+
+import provision_users
+
+
+class ClientError(Exception):
+    """Shaped like botocore's ClientError, which is all the provisioner looks at."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeCognito:
+
+    def __init__(self, throttle_every=0, fail_users=()):
+        self.users = {}
+        self.calls = []
+        self.throttle_every = throttle_every
+        self.fail_users = set(fail_users)
+        self._lock = threading.Lock()
+
+    def _record(self, operation):
+        with self._lock:
+            self.calls.append(operation)
+            if self.throttle_every and len(self.calls) % self.throttle_every == 0:
+                raise ClientError("TooManyRequestsException")
+
+    def admin_create_user(self, UserPoolId, Username, UserAttributes, MessageAction):
+        self._record("admin_create_user")
+        if Username in self.fail_users:
+            raise ClientError("InternalErrorException")
+        if Username in self.users:
+            raise ClientError("UsernameExistsException")
+        self.users[Username] = {"password": None, "attributes": UserAttributes}
+
+    def admin_set_user_password(self, UserPoolId, Username, Password, Permanent):
+        self._record("admin_set_user_password")
+        self.users[Username]["password"] = Password
+
+    def admin_delete_user(self, UserPoolId, Username):
+        self._record("admin_delete_user")
+        if self.users.pop(Username, None) is None:
+            raise ClientError("UserNotFoundException")
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return tmp_path / "users.json", tmp_path / "users.json.progress"
+
+
+def provision(client, count, progress_path, **kwargs):
+    kwargs.setdefault("rate", 0)
+    provisioner = provision_users.Provisioner(client, "eu-west-1_Test", retry_base_delay=0, **kwargs)
+    progress = provision_users.Progress(str(progress_path))
+    return provisioner.create(provision_users.usernames("loadtest", "example.com", count), progress), progress
+
+
+def test_creates_users_and_writes_their_credentials(paths):
+    credentials_path, progress_path = paths
+    client = FakeCognito()
+
+    failures, progress = provision(client, 25, progress_path)
+    assert failures == 0
+    assert provision_users.write_credentials(str(credentials_path), progress) == 25
+
+    credentials = json.loads(credentials_path.read_text())
+    assert {c["username"] for c in credentials} == set(client.users)
+    assert all(client.users[c["username"]]["password"] == c["password"] for c in credentials)
+
+
+def test_resumes_where_it_left_off(paths):
+    _, progress_path = paths
+    client = FakeCognito(fail_users={"loadtest-000003@example.com"})
+
+    failures, _ = provision(client, 10, progress_path)
+    assert failures == 1
+
+    client.fail_users.clear()
+    client.calls.clear()
+    failures, progress = provision(client, 10, progress_path)
+    assert failures == 0
+    assert client.calls == ["admin_create_user", "admin_set_user_password"]
+    assert len(progress.with_status("created")) == 10
+
+
+def test_user_which_already_exists_gets_its_password_set(paths):
+    _, progress_path = paths
+    client = FakeCognito()
+    client.users["loadtest-000000@example.com"] = {"password": None, "attributes": []}
+
+    failures, progress = provision(client, 1, progress_path)
+    assert failures == 0
+    assert client.users["loadtest-000000@example.com"]["password"] == progress.users["loadtest-000000@example.com"]["password"]
+
+
+def test_throttled_calls_are_retried(paths):
+    _, progress_path = paths
+    client = FakeCognito(throttle_every=3)
+
+    failures, progress = provision(client, 20, progress_path, workers=4)
+    assert failures == 0
+    assert len(client.users) == 20
+
+
+def test_delete_tears_down_what_was_created(paths):
+    credentials_path, progress_path = paths
+    client = FakeCognito()
+    provision(client, 5, progress_path)
+    # Deleted behind our back, which shouldn't count as a failure
+    del client.users["loadtest-000001@example.com"]
+
+    provisioner = provision_users.Provisioner(client, "eu-west-1_Test", rate=0)
+    progress = provision_users.Progress(str(progress_path))
+    assert provisioner.delete(progress) == 0
+    assert client.users == {}
+    assert provision_users.write_credentials(str(credentials_path), progress) == 0
+
+
+def test_token_bucket_paces_calls(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(provision_users.time, "sleep", sleeps.append)
+
+    bucket = provision_users.TokenBucket(rate=10, burst=2)
+    for _ in range(4):
+        bucket.take()
+
+    # Two from the burst, then waits for the next tokens
+    assert len(sleeps) == 2
+    assert sleeps[0] == pytest.approx(0.1, abs=0.01)
+    assert sleeps[1] == pytest.approx(0.2, abs=0.01)
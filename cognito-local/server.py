@@ -0,0 +1,557 @@
+"""
+A local stand-in for the parts of Cognito the clients talk to.
+
+It serves:
+
+* the Cognito Identity Provider API which boto3 calls (`InitiateAuth`, and the
+  admin user management calls) at `/`
+* the hosted UI's `/oauth2/authorize`, `/login` and `/oauth2/token`
+* the user pool's signing keys at `/<user pool ID>/.well-known/jwks.json`
+
+The tokens it hands out are signed with an RSA key generated at startup, and
+look like the ones Cognito issues - just with this server as their issuer.
+
+You can make it behave like a slow, or busy, Cognito with `--latency` and
+`--throttle-rps`, so the clients can be load tested without using up any of
+your real Cognito quota.
+
+    python server.py --port 9229
+"""
+
+import argparse
+import base64
+import hashlib
+import hmac
+import html
+import json
+import random
+import secrets
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+AUTHORIZATION_CODE_LIFETIME = 300
+
+
+class CognitoError(Exception):
+    """An error in the shape the Cognito API returns them."""
+
+    def __init__(self, error_type, message, status=400):
+        super().__init__(message)
+        self.error_type = error_type
+        self.message = message
+        self.status = status
+
+
+class TokenBucket:
+    """Allows `rate` requests per second, in bursts of up to `rate` requests (but at least one)."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        # Each request takes a whole token, so a smaller bucket would never allow one
+        self.burst = max(1, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class UserPool:
+    """The users, codes and refresh tokens of one user pool and app client."""
+
+    def __init__(self, user_pool_id, client_id, client_secret, issuer,
+                 access_token_lifetime=3600, id_token_lifetime=3600):
+        self.user_pool_id = user_pool_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.issuer = issuer
+        self.access_token_lifetime = access_token_lifetime
+        self.id_token_lifetime = id_token_lifetime
+
+        self.kid = uuid.uuid4().hex
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+        self._lock = threading.Lock()
+        self._users = {}  # username -> user
+        self._codes = {}  # authorization code -> (username, expires_at)
+        self._refresh_tokens = {}  # refresh token -> username
+
+    def jwks(self):
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self._private_key.public_key()))
+        jwk.update(kid=self.kid, alg="RS256", use="sig")
+        return {"keys": [jwk]}
+
+    # Users
+
+    def create_user(self, username, password=None, attributes=None, confirmed=False):
+        with self._lock:
+            if username in self._users:
+                raise CognitoError("UsernameExistsException", "User account already exists")
+
+            attributes = dict(attributes or {})
+            attributes.setdefault("sub", str(uuid.uuid4()))
+            user = {
+                "Username": username,
+                "Password": password,
+                "Attributes": attributes,
+                "Enabled": True,
+                "UserStatus": "CONFIRMED" if confirmed else "FORCE_CHANGE_PASSWORD",
+                "UserCreateDate": time.time(),
+                "UserLastModifiedDate": time.time(),
+            }
+            self._users[username] = user
+            return user
+
+    def find_user(self, username):
+        """Look a user up by their username, or an alias (email) or their sub."""
+        user = self._users.get(username)
+        if user is not None:
+            return user
+        for user in list(self._users.values()):
+            if username in (user["Attributes"].get("email"), user["Attributes"].get("sub")):
+                return user
+        raise CognitoError("UserNotFoundException", "User does not exist.")
+
+    def delete_user(self, username):
+        user = self.find_user(username)
+        with self._lock:
+            self._users.pop(user["Username"], None)
+
+    def users(self):
+        return sorted(self._users.values(), key=lambda user: user["UserCreateDate"])
+
+    # Authentication
+
+    def secret_hash(self, username):
+        message = (username + self.client_id).encode()
+        digest = hmac.new(self.client_secret.encode(), message, digestmod=hashlib.sha256).digest()
+        return base64.b64encode(digest).decode()
+
+    def check_client(self, client_id, client_secret=None):
+        if client_id != self.client_id:
+            raise CognitoError("ResourceNotFoundException", "User pool client does not exist.")
+        if client_secret is not None and not hmac.compare_digest(client_secret, self.client_secret):
+            raise CognitoError("NotAuthorizedException", "Unable to verify secret hash for client")
+
+    def authenticate(self, username, password):
+        try:
+            user = self.find_user(username)
+        except CognitoError:
+            raise CognitoError("NotAuthorizedException", "Incorrect username or password.")
+        if user["Password"] != password:
+            raise CognitoError("NotAuthorizedException", "Incorrect username or password.")
+        if not user["Enabled"]:
+            raise CognitoError("NotAuthorizedException", "User is disabled.")
+        return user
+
+    def issue_code(self, user):
+        code = str(uuid.uuid4())
+        with self._lock:
+            self._codes[code] = (user["Username"], time.time() + AUTHORIZATION_CODE_LIFETIME)
+        return code
+
+    def redeem_code(self, code):
+        with self._lock:
+            username, expires_at = self._codes.pop(code, (None, 0))
+        if username is None or expires_at < time.time():
+            raise CognitoError("invalid_grant", "invalid_grant")
+        return self.find_user(username)
+
+    def issue_tokens(self, user, with_refresh_token=True):
+        now = int(time.time())
+        sub = user["Attributes"]["sub"]
+        event_id = str(uuid.uuid4())
+
+        access_token = jwt.encode({
+            "sub": sub,
+            "iss": self.issuer,
+            "client_id": self.client_id,
+            "origin_jti": event_id,
+            "event_id": event_id,
+            "token_use": "access",
+            "scope": "aws.cognito.signin.user.admin openid email phone profile",
+            "auth_time": now,
+            "iat": now,
+            "exp": now + self.access_token_lifetime,
+            "jti": str(uuid.uuid4()),
+            "username": user["Username"],
+        }, self._private_key, algorithm="RS256", headers={"kid": self.kid})
+
+        id_claims = {
+            "sub": sub,
+            "iss": self.issuer,
+            "aud": self.client_id,
+            "cognito:username": user["Username"],
+            "origin_jti": event_id,
+            "event_id": event_id,
+            "token_use": "id",
+            "auth_time": now,
+            "iat": now,
+            "exp": now + self.id_token_lifetime,
+            "jti": str(uuid.uuid4()),
+        }
+        for name in ("email", "email_verified"):
+            if name in user["Attributes"]:
+                value = user["Attributes"][name]
+                id_claims[name] = value == "true" if name == "email_verified" else value
+        id_token = jwt.encode(id_claims, self._private_key, algorithm="RS256", headers={"kid": self.kid})
+
+        tokens = {
+            "AccessToken": access_token,
+            "IdToken": id_token,
+            "ExpiresIn": self.access_token_lifetime,
+            "TokenType": "Bearer",
+        }
+        if with_refresh_token:
+            refresh_token = secrets.token_urlsafe(96)
+            with self._lock:
+                self._refresh_tokens[refresh_token] = user["Username"]
+            tokens["RefreshToken"] = refresh_token
+        return tokens
+
+    def refresh(self, refresh_token):
+        username = self._refresh_tokens.get(refresh_token)
+        if username is None:
+            raise CognitoError("NotAuthorizedException", "Invalid Refresh Token")
+        return self.issue_tokens(self.find_user(username), with_refresh_token=False)
+
+    def sign_out(self, username):
+        """Revoke every refresh token the user has."""
+        with self._lock:
+            for refresh_token in [t for t, u in self._refresh_tokens.items() if u == username]:
+                del self._refresh_tokens[refresh_token]
+
+
+def user_attributes(user):
+    return [{"Name": name, "Value": value} for name, value in user["Attributes"].items()]
+
+
+def user_type(user):
+    """A user in the shape ListUsers and AdminCreateUser return them."""
+    return {
+        "Username": user["Username"],
+        "Attributes": user_attributes(user),
+        "UserCreateDate": user["UserCreateDate"],
+        "UserLastModifiedDate": user["UserLastModifiedDate"],
+        "Enabled": user["Enabled"],
+        "UserStatus": user["UserStatus"],
+    }
+
+
+class CognitoApi:
+    """The JSON API boto3 calls, dispatched on the `X-Amz-Target` header."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def dispatch(self, operation, params):
+        handler = getattr(self, operation, None)
+        if handler is None:
+            raise CognitoError("InvalidAction", f"{operation} isn't supported by the stand-in")
+        if "UserPoolId" in params and params["UserPoolId"] != self.pool.user_pool_id:
+            raise CognitoError("ResourceNotFoundException", "User pool does not exist.")
+        return handler(params)
+
+    def InitiateAuth(self, params):
+        auth = params.get("AuthParameters", {})
+        self.pool.check_client(params.get("ClientId"))
+
+        if params.get("AuthFlow") == "USER_PASSWORD_AUTH":
+            username = auth.get("USERNAME", "")
+            if auth.get("SECRET_HASH") != self.pool.secret_hash(username):
+                raise CognitoError("NotAuthorizedException", "Unable to verify secret hash for client")
+            user = self.pool.authenticate(username, auth.get("PASSWORD"))
+            return {"AuthenticationResult": self.pool.issue_tokens(user), "ChallengeParameters": {}}
+
+        if params.get("AuthFlow") in ("REFRESH_TOKEN_AUTH", "REFRESH_TOKEN"):
+            return {"AuthenticationResult": self.pool.refresh(auth.get("REFRESH_TOKEN")), "ChallengeParameters": {}}
+
+        raise CognitoError("InvalidParameterException", f"Unsupported AuthFlow: {params.get('AuthFlow')}")
+
+    def GlobalSignOut(self, params):
+        claims = jwt.decode(params.get("AccessToken", ""), options={"verify_signature": False})
+        self.pool.sign_out(claims["username"])
+        return {}
+
+    def AdminUserGlobalSignOut(self, params):
+        self.pool.sign_out(self.pool.find_user(params["Username"])["Username"])
+        return {}
+
+    def AdminCreateUser(self, params):
+        attributes = {a["Name"]: a["Value"] for a in params.get("UserAttributes", [])}
+        user = self.pool.create_user(params["Username"], params.get("TemporaryPassword"), attributes)
+        return {"User": user_type(user)}
+
+    def AdminSetUserPassword(self, params):
+        user = self.pool.find_user(params["Username"])
+        user["Password"] = params["Password"]
+        if params.get("Permanent"):
+            user["UserStatus"] = "CONFIRMED"
+        return {}
+
+    def AdminDeleteUser(self, params):
+        self.pool.delete_user(params["Username"])
+        return {}
+
+    def AdminGetUser(self, params):
+        user = self.pool.find_user(params["Username"])
+        response = user_type(user)
+        response["UserAttributes"] = response.pop("Attributes")
+        return response
+
+    def AdminDisableUser(self, params):
+        self.pool.find_user(params["Username"])["Enabled"] = False
+        return {}
+
+    def AdminEnableUser(self, params):
+        self.pool.find_user(params["Username"])["Enabled"] = True
+        return {}
+
+    def ListUsers(self, params):
+        limit = min(int(params.get("Limit", 60)), 60)
+        start = int(params.get("PaginationToken") or 0)
+        users = self.pool.users()
+        response = {"Users": [user_type(user) for user in users[start:start + limit]]}
+        if start + limit < len(users):
+            response["PaginationToken"] = str(start + limit)
+        return response
+
+
+LOGIN_FORM = """<!DOCTYPE html>
+<html><body>
+<h1>Cognito stand-in</h1>
+<form method="post">
+  <p><label>Username <input name="username"></label></p>
+  <p><label>Password <input name="password" type="password"></label></p>
+  <p><button type="submit">Sign in</button></p>
+  {hidden}
+</form>
+</body></html>
+"""
+
+
+def make_handler(pool, api, latency=0.0, jitter=0.0, bucket=None):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            # Logging every request would be the slowest part of a load test
+            pass
+
+        # Responses
+
+        def send_body(self, status, body, content_type, headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, status, data, content_type="application/json"):
+            self.send_body(status, json.dumps(data).encode(), content_type)
+
+        def redirect(self, location):
+            self.send_body(302, b"", "text/plain", {"Location": location})
+
+        def read_body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return self.rfile.read(length) if length else b""
+
+        def behave_like_cognito(self):
+            """Add the configured latency, and return False if this request is throttled."""
+            if latency or jitter:
+                time.sleep(latency + random.uniform(0, jitter))
+            return bucket is None or bucket.take()
+
+        # Routing
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query))
+
+            if url.path == f"/{pool.user_pool_id}/.well-known/jwks.json":
+                return self.send_json(200, pool.jwks())
+            if url.path == "/oauth2/authorize":
+                return self.authorize(query)
+            if url.path == "/login":
+                hidden = "".join(
+                    f'<input type="hidden" name="{html.escape(k)}" value="{html.escape(v)}">'
+                    for k, v in query.items()
+                )
+                return self.send_body(200, LOGIN_FORM.format(hidden=hidden).encode(), "text/html")
+            self.send_json(404, {"error": "not_found"})
+
+        def do_POST(self):
+            url = urllib.parse.urlsplit(self.path)
+            body = self.read_body()
+
+            if url.path == "/" and "X-Amz-Target" in self.headers:
+                return self.api_call(body)
+            if url.path == "/login":
+                return self.login(dict(urllib.parse.parse_qsl(url.query)), dict(urllib.parse.parse_qsl(body.decode())))
+            if url.path == "/oauth2/token":
+                return self.token(dict(urllib.parse.parse_qsl(body.decode())))
+            self.send_json(404, {"error": "not_found"})
+
+        # The Cognito API
+
+        def api_call(self, body):
+            operation = self.headers["X-Amz-Target"].rsplit(".", 1)[-1]
+            content_type = "application/x-amz-json-1.1"
+
+            if not self.behave_like_cognito():
+                return self.send_json(400, {
+                    "__type": "TooManyRequestsException",
+                    "message": "Too many requests",
+                }, content_type)
+
+            try:
+                response = api.dispatch(operation, json.loads(body or b"{}"))
+            except CognitoError as e:
+                return self.send_json(e.status, {"__type": e.error_type, "message": e.message}, content_type)
+            self.send_json(200, response, content_type)
+
+        # The hosted UI
+
+        def authorize(self, query):
+            try:
+                pool.check_client(query.get("client_id"))
+            except CognitoError:
+                return self.send_json(400, {"error": "invalid_client"})
+            if query.get("response_type") != "code" or not query.get("redirect_uri"):
+                return self.send_json(400, {"error": "invalid_request"})
+            self.redirect("/login?" + urllib.parse.urlencode(query))
+
+        def login(self, query, form):
+            query = {**query, **{k: v for k, v in form.items() if k not in ("username", "password")}}
+            if not self.behave_like_cognito():
+                return self.send_json(429, {"error": "too_many_requests"})
+            try:
+                pool.check_client(query.get("client_id"))
+                user = pool.authenticate(form.get("username", ""), form.get("password"))
+            except CognitoError as e:
+                return self.send_body(401, html.escape(e.message).encode(), "text/html")
+
+            redirect = {"code": pool.issue_code(user)}
+            if "state" in query:
+                redirect["state"] = query["state"]
+            self.redirect(query["redirect_uri"] + "?" + urllib.parse.urlencode(redirect))
+
+        def token(self, form):
+            if not self.behave_like_cognito():
+                return self.send_json(429, {"error": "too_many_requests"})
+
+            client_id, client_secret = form.get("client_id"), None
+            authorization = self.headers.get("Authorization", "")
+            if authorization.startswith("Basic "):
+                client_id, _, client_secret = base64.b64decode(authorization[6:]).decode().partition(":")
+            try:
+                pool.check_client(client_id, client_secret if client_secret is not None else "")
+            except CognitoError:
+                return self.send_json(401, {"error": "invalid_client"})
+
+            try:
+                if form.get("grant_type") == "authorization_code":
+                    tokens = pool.issue_tokens(pool.redeem_code(form.get("code")))
+                elif form.get("grant_type") == "refresh_token":
+                    tokens = pool.refresh(form.get("refresh_token"))
+                else:
+                    return self.send_json(400, {"error": "unsupported_grant_type"})
+            except CognitoError:
+                return self.send_json(400, {"error": "invalid_grant"})
+
+            response = {
+                "id_token": tokens["IdToken"],
+                "access_token": tokens["AccessToken"],
+                "expires_in": tokens["ExpiresIn"],
+                "token_type": tokens["TokenType"],
+            }
+            if "RefreshToken" in tokens:
+                response["refresh_token"] = tokens["RefreshToken"]
+            self.send_json(200, response)
+
+    return Handler
+
+
+def make_server(host="127.0.0.1", port=9229, user_pool_id="eu-west-1_Local",
+                client_id="localclientid", client_secret="localclientsecret",
+                access_token_lifetime=3600, id_token_lifetime=3600,
+                latency=0.0, jitter=0.0, throttle_rps=None, users=None):
+    """Create (but don't start) a stand-in server. Pass port=0 to pick a free port."""
+    server = ThreadingHTTPServer((host, port), None)
+    server.daemon_threads = True
+    issuer = f"http://{host}:{server.server_address[1]}/{user_pool_id}"
+
+    pool = UserPool(user_pool_id, client_id, client_secret, issuer,
+                    access_token_lifetime=access_token_lifetime,
+                    id_token_lifetime=id_token_lifetime)
+    for user in users or []:
+        pool.create_user(
+            user["username"],
+            user["password"],
+            {"email": user.get("email", user["username"]), "email_verified": "true"},
+            confirmed=True,
+        )
+
+    bucket = TokenBucket(throttle_rps) if throttle_rps else None
+    server.RequestHandlerClass = make_handler(pool, CognitoApi(pool), latency, jitter, bucket)
+    server.pool = pool
+    server.url = f"http://{host}:{server.server_address[1]}"
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9229)
+    parser.add_argument("--user-pool-id", default="eu-west-1_Local")
+    parser.add_argument("--client-id", default="localclientid")
+    parser.add_argument("--client-secret", default="localclientsecret")
+    parser.add_argument("--access-token-lifetime", type=int, default=3600, help="seconds")
+    parser.add_argument("--id-token-lifetime", type=int, default=3600, help="seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API and hosted UI request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, at random")
+    parser.add_argument("--throttle-rps", type=float, help="throttle requests above this rate, like Cognito's quotas")
+    parser.add_argument("--users", help="a JSON file of [{username, password, email}] to create at startup")
+    args = parser.parse_args()
+
+    if args.users:
+        with open(args.users) as f:
+            users = json.load(f)
+    else:
+        users = [{"username": "user@example.com", "password": "Password123!"}]
+
+    server = make_server(
+        args.host, args.port, args.user_pool_id, args.client_id, args.client_secret,
+        args.access_token_lifetime, args.id_token_lifetime,
+        args.latency, args.jitter, args.throttle_rps, users,
+    )
+    print(f"Cognito stand-in listening on {server.url}")
+    print(f"  COGNITO_ENDPOINT_URL={server.url}")
+    print(f"  COGNITO_ISSUER={server.pool.issuer}")
+    print(f"  HOSTEDUIPATH={server.url}")
+    print(f"  COGNITO_USER_POOL_ID={args.user_pool_id}")
+    print(f"  COGNITO_CLIENT_ID={args.client_id}")
+    print(f"  COGNITO_CLIENT_SECRET={args.client_secret}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
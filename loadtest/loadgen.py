@@ -0,0 +1,265 @@
+"""
+Simulate many concurrent users logging in to, and using, the client apps.
+
+    python loadgen.py flask --app-url http://127.0.0.1:3000 --users 500 --duration 60
+    python loadgen.py fastapi --app-url http://127.0.0.1:8000 --users 500 --duration 60
+
+Each simulated user logs in, then makes authenticated requests (with a pause
+between them) until the test ends:
+
+* flask - `/login`, through the hosted UI's login form, to `/callbacks/cognito/login`,
+  then `/private` repeatedly. The app refreshes the tokens itself as they expire.
+* fastapi - `/token`, then `/users/me/` repeatedly, logging in again whenever
+  the token has expired.
+
+Run it against the Cognito stand-in in `cognito-local/` - start it with short
+token lifetimes to exercise refreshes. With `--ramp-up 0` every user logs in
+at once, so their tokens all expire (and are refreshed) at the same time too.
+
+At the end it prints the throughput, error rate and latency histogram of each endpoint.
+"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import random
+import time
+import urllib.parse
+
+import httpx
+
+# Upper bounds (in ms) of the latency histogram buckets
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf")]
+
+# How long (in seconds) a user waits before logging in again after a failed login,
+# doubling with each failure in a row up to the max. The actual wait is jittered
+LOGIN_BACKOFF = 0.5
+LOGIN_MAX_BACKOFF = 30
+
+
+class EndpointStats:
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.statuses = {}
+
+    def record(self, latency, status, ok):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+
+        def percentile(p):
+            return round(latencies[min(count - 1, int(count * p / 100))] * 1000, 2) if count else None
+
+        histogram = [0] * len(BUCKETS_MS)
+        for latency in latencies:
+            histogram[bisect.bisect_left(BUCKETS_MS, latency * 1000)] += 1
+
+        return {
+            "requests": count,
+            "requests_per_sec": round(count / duration, 1),
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0,
+            "statuses": self.statuses,
+            "p50_ms": percentile(50),
+            "p90_ms": percentile(90),
+            "p99_ms": percentile(99),
+            "max_ms": percentile(100),
+            "histogram_ms": {f"<={b}": n for b, n in zip(BUCKETS_MS, histogram) if n},
+        }
+
+
+class LoadTest:
+
+    def __init__(self, app_url, credentials, think_time, stats=None):
+        self.app_url = app_url.rstrip("/")
+        self.credentials = credentials
+        self.think_time = think_time
+        self.stats = stats if stats is not None else {}
+
+    async def request(self, client, name, method, url, ok_statuses=(200,), **kwargs):
+        """Make a request, recording its latency and outcome under `name`."""
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats.setdefault(name, EndpointStats()).record(time.perf_counter() - start, type(e).__name__, False)
+            return None
+
+        self.stats.setdefault(name, EndpointStats()).record(
+            time.perf_counter() - start, response.status_code, response.status_code in ok_statuses,
+        )
+        return response
+
+    async def think(self):
+        await asyncio.sleep(random.uniform(0, 2 * self.think_time))
+
+
+class FlaskLoadTest(LoadTest):
+
+    async def login(self, client, username, password):
+        response = await self.request(client, "GET /login", "GET", f"{self.app_url}/login", ok_statuses=(302,))
+        if response is None:
+            return False
+
+        # The hosted UI redirects from /oauth2/authorize to its login form
+        response = await self.request(
+            client, "GET hosted-ui /oauth2/authorize", "GET", response.headers["Location"], ok_statuses=(302,),
+        )
+        if response is None:
+            return False
+        login_url = urllib.parse.urljoin(str(response.url), response.headers["Location"])
+
+        response = await self.request(
+            client, "POST hosted-ui /login", "POST", login_url,
+            ok_statuses=(302,), data={"username": username, "password": password},
+        )
+        if response is None or response.status_code != 302:
+            return False
+
+        response = await self.request(
+            client, "GET /callbacks/cognito/login", "GET", response.headers["Location"],
+        )
+        return response is not None and response.status_code == 200
+
+    async def session(self, client, username, password, deadline):
+        if not await self.login(client, username, password):
+            return False
+
+        while time.monotonic() < deadline:
+            await self.think()
+            response = await self.request(client, "GET /private", "GET", f"{self.app_url}/private")
+            if response is not None and response.status_code == 401:
+                # The refresh failed, so start again
+                if not await self.login(client, username, password):
+                    return False
+        return True
+
+
+class FastApiLoadTest(LoadTest):
+
+    async def login(self, client, username, password):
+        response = await self.request(
+            client, "POST /token", "POST", f"{self.app_url}/token",
+            data={"username": username, "password": password},
+        )
+        if response is None or response.status_code != 200:
+            return None
+        return response.json()["access_token"]
+
+    async def session(self, client, username, password, deadline):
+        token = await self.login(client, username, password)
+
+        while token and time.monotonic() < deadline:
+            await self.think()
+            response = await self.request(
+                client, "GET /users/me/", "GET", f"{self.app_url}/users/me/",
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            if response is not None and response.status_code == 401:
+                # There's no refresh endpoint, the token has expired so log in again
+                token = await self.login(client, username, password)
+        return token is not None
+
+
+class SharedTransport(httpx.AsyncBaseTransport):
+    """A transport several clients can use. Closing a client leaves it open, for the others."""
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        pass
+
+
+async def login_backoff(failures, deadline):
+    """Wait before logging in again after `failures` failed logins in a row, so they don't hammer the app."""
+    backoff = min(LOGIN_MAX_BACKOFF, LOGIN_BACKOFF * 2 ** (failures - 1))
+    await asyncio.sleep(max(0, min(random.uniform(0, backoff), deadline - time.monotonic())))
+
+
+async def run(load_test, users, duration, ramp_up, max_connections):
+    # All the users share one connection pool, but each has its own cookies
+    transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+        max_connections=max_connections, max_keepalive_connections=max_connections,
+    ))
+    shared_transport = SharedTransport(transport)
+    start = time.monotonic()
+    deadline = start + duration
+
+    async def simulated_user(i):
+        username, password = load_test.credentials[i % len(load_test.credentials)]
+        if ramp_up:
+            await asyncio.sleep(ramp_up * i / users)
+        async with httpx.AsyncClient(transport=shared_transport, timeout=30, trust_env=False) as client:
+            # Keep going until the end of the test, logging in again if a session gives up
+            failures = 0
+            while time.monotonic() < deadline:
+                # A session returns False when a login fails
+                if await load_test.session(client, username, password, deadline):
+                    failures = 0
+                else:
+                    failures += 1
+                    await login_backoff(failures, deadline)
+                client.cookies.clear()
+
+    try:
+        await asyncio.gather(*(simulated_user(i) for i in range(users)))
+    finally:
+        await transport.aclose()
+
+    return time.monotonic() - start
+
+
+def load_credentials(path):
+    """Read the credentials written by `cognito-cdk/provision_users.py`, or similar."""
+    if not path:
+        return [("user@example.com", "Password123!")]
+    with open(path) as f:
+        return [(user["username"], user["password"]) for user in json.load(f)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("app", choices=["flask", "fastapi"])
+    parser.add_argument("--app-url", required=True)
+    parser.add_argument("--users", type=int, default=100, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which the users start")
+    parser.add_argument("--think-time", type=float, default=0.5, help="average seconds between a user's requests")
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--credentials", help="a JSON file of [{username, password}]")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    load_test_class = FlaskLoadTest if args.app == "flask" else FastApiLoadTest
+    load_test = load_test_class(args.app_url, load_credentials(args.credentials), args.think_time)
+
+    elapsed = asyncio.run(run(load_test, args.users, args.duration, args.ramp_up, args.max_connections))
+
+    results = {name: stats.summary(elapsed) for name, stats in sorted(load_test.stats.items())}
+    for name, result in results.items():
+        print(
+            f"{name:36} {result['requests']:>8} reqs {result['requests_per_sec']:>9.1f}/s "
+            f"{result['error_rate']:>7.2%} errors   p50 {result['p50_ms']}ms  p90 {result['p90_ms']}ms  "
+            f"p99 {result['p99_ms']}ms  max {result['max_ms']}ms"
+        )
+        print(f"{'':36} {result['histogram_ms']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()